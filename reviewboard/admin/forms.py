@@ -128,6 +128,13 @@ class GeneralSettingsForm(SiteSettingsForm):
         required=False,
         widget=forms.TextInput(attrs={'size': '50'}))
 
+    search_index_batch_size = forms.IntegerField(
+        label=_("Search index batch size"),
+        help_text=_("The number of review requests to fetch and index at a "
+                    "time when updating the search index."),
+        min_value=1,
+        required=False)
+
     cache_type = forms.ChoiceField(
         label=_("Cache Backend"),
         choices=CACHE_TYPE_CHOICES,
@@ -301,7 +308,8 @@ class GeneralSettingsForm(SiteSettingsForm):
                 'classes': ('wide',),
                 'title': _("Search"),
                 'fields': ('search_enable', 'max_search_results',
-                           'search_results_per_page', 'search_index_file'),
+                           'search_results_per_page', 'search_index_file',
+                           'search_index_batch_size'),
             },
         )
 
@@ -507,6 +515,24 @@ class DiffSettingsForm(SiteSettingsForm):
         required=False,
         widget=forms.TextInput(attrs={'size': '5'}))
 
+    diffviewer_syntax_highlighting_timeout = forms.IntegerField(
+        label=_("Syntax highlighting time limit (seconds)"),
+        help_text=_("Files that take longer than this to highlight will be "
+                    "shown as plain text, and won't be highlighted again. "
+                    "Enter 0 for no limit."),
+        min_value=0,
+        required=False,
+        widget=forms.TextInput(attrs={'size': '5'}))
+
+    diffviewer_highlight_shown_lines_only = forms.BooleanField(
+        label=_("Only highlight shown lines"),
+        help_text=_("Only syntax-highlight the changed lines and their "
+                    "context when generating a diff. Collapsed lines are "
+                    "highlighted when they're expanded. This is faster for "
+                    "large files, but lines inside long comments or strings "
+                    "may not be highlighted correctly."),
+        required=False)
+
     diffviewer_show_trailing_whitespace = forms.BooleanField(
         label=_("Show trailing whitespace"),
         help_text=_("Show excess trailing whitespace as red blocks. This "
@@ -549,6 +575,75 @@ class DiffSettingsForm(SiteSettingsForm):
                     'to disable size restrictions.'),
         widget=forms.TextInput(attrs={'size': '15'}))
 
+    diffviewer_patched_file_cache_size = forms.IntegerField(
+        label=_('Patched file cache size (bytes)'),
+        help_text=_('The amount of memory (in bytes) each server process '
+                    'may use to keep recently patched files around. Enter 0 '
+                    'to only use the main cache backend.'),
+        min_value=0,
+        widget=forms.TextInput(attrs={'size': '15'}))
+
+    diffviewer_chunk_generation_workers = forms.IntegerField(
+        label=_('Diff generation threads'),
+        help_text=_('The number of threads used to generate diffs for '
+                    'multiple files at once. Enter 1 to generate them one '
+                    'at a time.'),
+        min_value=1,
+        widget=forms.TextInput(attrs={'size': '5'}))
+
+    diffviewer_diff_cost_budget = forms.IntegerField(
+        label=_('Diff cost budget'),
+        help_text=_('The amount of work allowed when diffing a file before '
+                    'switching to a faster but less precise diff. This is '
+                    'roughly the number of lines in the files plus the '
+                    'number of steps taken searching for changes. Enter 0 '
+                    'for no limit.'),
+        min_value=0,
+        widget=forms.TextInput(attrs={'size': '15'}))
+
+    diffviewer_move_detection_budget = forms.IntegerField(
+        label=_('Move detection budget'),
+        help_text=_('The amount of work allowed when looking for moved '
+                    'lines in a file. This is roughly the number of times '
+                    'an inserted line is checked against a group of removed '
+                    'lines. Moves found before this is reached are still '
+                    'shown. Enter 0 for no limit.'),
+        min_value=0,
+        widget=forms.TextInput(attrs={'size': '15'}))
+
+    repository_diff_cost_budgets = forms.CharField(
+        label=_('Per-repository diff cost budgets'),
+        required=False,
+        help_text=_('Overrides the diff cost budget for specific '
+                    'repositories. Enter one repository per line, in the '
+                    'form "Repository ID: budget".'),
+        widget=forms.Textarea(attrs={'rows': '4', 'cols': '60'}))
+
+    histogram_diff_repositories = forms.CharField(
+        label=_('Use histogram diffs for'),
+        required=False,
+        help_text=_('Repositories whose new diffs will use the histogram '
+                    'diff algorithm, which anchors on rarer lines and '
+                    'often produces clearer diffs of moved or rewritten '
+                    'code. Enter one repository ID per line. Existing '
+                    'diffs are not affected.'),
+        widget=forms.Textarea(attrs={'rows': '4', 'cols': '60'}))
+
+    diffviewer_precompute_chunks = forms.BooleanField(
+        label=_('Generate diffs in the background'),
+        help_text=_('Queue new diffs to be generated ahead of time, so '
+                    'reviewers don\'t have to wait for them. This requires '
+                    'running <code>rb-site manage /path/to/site '
+                    'precompute-diffs</code> to process the queue.'),
+        required=False)
+
+    diffviewer_stream_fragments = forms.BooleanField(
+        label=_('Stream rendered diffs'),
+        help_text=_('Send each file\'s diff to the browser as it\'s being '
+                    'generated, rather than once the whole file is done. '
+                    'This helps with very large files.'),
+        required=False)
+
     def load(self):
         # TODO: Move this check into a dependencies module so we can catch it
         #       when the user starts up Review Board.
@@ -559,26 +654,127 @@ class DiffSettingsForm(SiteSettingsForm):
             self.disabled_reasons['diffviewer_syntax_highlighting'] = _(reason)
             self.disabled_fields['diffviewer_syntax_highlighting_threshold'] = True
             self.disabled_reasons['diffviewer_syntax_highlighting_threshold'] = _(reason)
+            self.disabled_fields['diffviewer_syntax_highlighting_timeout'] = True
+            self.disabled_reasons['diffviewer_syntax_highlighting_timeout'] = _(reason)
+            self.disabled_fields['diffviewer_highlight_shown_lines_only'] = True
+            self.disabled_reasons['diffviewer_highlight_shown_lines_only'] = _(reason)
 
         super(DiffSettingsForm, self).load()
         self.fields['include_space_patterns'].initial = \
             ', '.join(self.siteconfig.get('diffviewer_include_space_patterns'))
+        self.fields['repository_diff_cost_budgets'].initial = '\n'.join(
+            '%s: %s' % (repository_id, budget)
+            for repository_id, budget in sorted(
+                six.iteritems(self.siteconfig.get(
+                    'diffviewer_repository_diff_cost_budgets')),
+                key=lambda item: int(item[0]))
+        )
+        self.fields['histogram_diff_repositories'].initial = '\n'.join(
+            sorted(self.siteconfig.get(
+                'diffviewer_histogram_diff_repositories'), key=int))
+
+    def clean_diffviewer_syntax_highlighting_timeout(self):
+        # A blank value (which is also what's submitted when the field is
+        # disabled) means there's no limit.
+        timeout = self.cleaned_data['diffviewer_syntax_highlighting_timeout']
+
+        return timeout or 0
+
+    def clean_repository_diff_cost_budgets(self):
+        budgets = {}
+
+        for line in self.cleaned_data['repository_diff_cost_budgets'] \
+                .splitlines():
+            line = line.strip()
+
+            if not line:
+                continue
+
+            repository_id, sep, budget = line.rpartition(':')
+
+            try:
+                repository_id = int(repository_id)
+                budget = int(budget)
+            except ValueError:
+                budget = -1
+
+            if not sep or budget < 0:
+                raise ValidationError(
+                    _('"%s" must be in the form "Repository ID: budget".')
+                    % line)
+
+            budgets[six.text_type(repository_id)] = budget
+
+        self._validate_repository_ids(budgets.keys())
+
+        return budgets
+
+    def clean_histogram_diff_repositories(self):
+        repository_ids = []
+
+        for line in self.cleaned_data['histogram_diff_repositories'] \
+                .splitlines():
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                repository_ids.append(six.text_type(int(line)))
+            except ValueError:
+                raise ValidationError(
+                    _('"%s" is not a repository ID.') % line)
+
+        self._validate_repository_ids(repository_ids)
+
+        return repository_ids
+
+    def _validate_repository_ids(self, repository_ids):
+        """Checks that repository IDs entered in the form exist.
+
+        Repository names are only unique within a Local Site, so the
+        per-repository settings are keyed by ID.
+        """
+        # This is imported here to avoid a circular import.
+        from reviewboard.scmtools.models import Repository
+
+        repository_ids = set(int(repository_id)
+                             for repository_id in repository_ids)
+        found_ids = set(Repository.objects.filter(
+            pk__in=repository_ids).values_list('pk', flat=True))
+        missing_ids = repository_ids - found_ids
+
+        if missing_ids:
+            raise ValidationError(
+                _('There are no repositories with the IDs %s.')
+                % ', '.join(six.text_type(repository_id)
+                            for repository_id in sorted(missing_ids)))
 
     def save(self):
         self.siteconfig.set(
             'diffviewer_include_space_patterns',
             re.split(r",\s*", self.cleaned_data['include_space_patterns']))
+        self.siteconfig.set(
+            'diffviewer_repository_diff_cost_budgets',
+            self.cleaned_data['repository_diff_cost_budgets'])
+        self.siteconfig.set(
+            'diffviewer_histogram_diff_repositories',
+            self.cleaned_data['histogram_diff_repositories'])
 
         super(DiffSettingsForm, self).save()
 
     class Meta:
         title = _("Diff Viewer Settings")
-        save_blacklist = ('include_space_patterns',)
+        save_blacklist = ('include_space_patterns',
+                          'repository_diff_cost_budgets',
+                          'histogram_diff_repositories')
         fieldsets = (
             {
                 'classes': ('wide',),
                 'fields': ('diffviewer_syntax_highlighting',
                            'diffviewer_syntax_highlighting_threshold',
+                           'diffviewer_syntax_highlighting_timeout',
+                           'diffviewer_highlight_shown_lines_only',
                            'diffviewer_show_trailing_whitespace',
                            'include_space_patterns'),
             },
@@ -593,7 +789,15 @@ class DiffSettingsForm(SiteSettingsForm):
                 'fields': ('diffviewer_max_diff_size',
                            'diffviewer_context_num_lines',
                            'diffviewer_paginate_by',
-                           'diffviewer_paginate_orphans')
+                           'diffviewer_paginate_orphans',
+                           'diffviewer_patched_file_cache_size',
+                           'diffviewer_chunk_generation_workers',
+                           'diffviewer_stream_fragments',
+                           'diffviewer_precompute_chunks',
+                           'diffviewer_diff_cost_budget',
+                           'diffviewer_move_detection_budget',
+                           'repository_diff_cost_budgets',
+                           'histogram_diff_repositories')
             }
         )
 
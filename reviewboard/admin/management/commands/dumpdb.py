@@ -1,52 +1,214 @@
 from __future__ import unicode_literals
 
+import gzip
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from optparse import make_option
+
 from django.core import serializers
-from django.core.management.base import NoArgsCommand
-from django.db.models import get_apps, get_models
+from django.core.management.base import CommandError, NoArgsCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import get_apps, get_model, get_models
 
 
 class Command(NoArgsCommand):
+    """Dumps a common serialized version of the database.
+
+    The dump starts with a header line containing the number of objects,
+    followed by one JSON-serialized object per line. This can be loaded
+    into another type of database with the ``loaddb`` command.
+
+    Objects are fetched for each model in batches, ordered by primary key,
+    with each batch starting after the last primary key of the previous
+    one. That keeps each query fast, no matter how far into a large table
+    the dump has gotten.
+
+    Models can be dumped in parallel by passing ``--processes``. Each model
+    is then dumped to a temporary file in a worker process, and the files
+    are written out in model order, so the dump is the same as when dumping
+    in a single process.
+    """
     help = 'Dump a common serialized version of the database to stdout.'
 
+    option_list = NoArgsCommand.option_list + (
+        make_option('-o', '--output',
+                    dest='output',
+                    help='The file to write the dump to, instead of stdout'),
+        make_option('--gzip', action='store_true', default=False,
+                    dest='gzip',
+                    help='Compress the dump with gzip. This is the default '
+                         'if the output file ends with ".gz"'),
+        make_option('--batch-size', type='int', default=1000,
+                    dest='batch_size',
+                    help='The number of objects to fetch at a time'),
+        make_option('--processes', type='int', default=1,
+                    dest='processes',
+                    help='The number of models to dump in parallel'),
+    )
+
     def handle_noargs(self, **options):
-        models = []
+        batch_size = options['batch_size']
+        processes = options['processes']
+        output = options['output']
 
-        for app in get_apps():
-            models.extend(get_models(app))
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
 
-        OBJECT_LIMIT = 150
+        if processes < 1:
+            raise CommandError('--processes must be at least 1')
 
-        serializer = serializers.get_serializer("json")()
+        models = []
+
+        for app in get_apps():
+            models.extend(
+                model
+                for model in get_models(app)
+                if not model._meta.proxy
+            )
 
         totalobjs = 0
-        for model in models:
-            totalobjs += model.objects.count()
 
-        prev_pct = -1
-        i = 0
+        for model in models:
+            totalobjs += model._default_manager.count()
+
+        if output:
+            if options['gzip'] or output.endswith('.gz'):
+                out = gzip.open(output, 'wb')
+            else:
+                out = open(output, 'wb')
+        elif options['gzip']:
+            out = gzip.GzipFile(fileobj=sys.stdout, mode='wb')
+        else:
+            out = self.stdout
 
         self.stderr.write("Dump the database. This may take a while...\n")
 
-        self.stdout.write("# dbdump v1 - %s objects" % totalobjs)
-
-        for model in models:
-            count = model.objects.count()
-            j = 0
+        start_time = time.time()
+        self._num_dumped = 0
+        self._prev_pct = -1
 
-            while j < count:
-                for obj in model.objects.all()[j:j + OBJECT_LIMIT].iterator():
-                    value = serializer.serialize([obj])
+        try:
+            out.write(b"# dbdump v1 - %d objects\n" % totalobjs)
 
-                    if value != "[]":
-                        self.stdout.write(value[1:-1])  # Skip the "[" and "]"
+            if processes > 1:
+                self._dump_parallel(out, models, batch_size, processes,
+                                    totalobjs)
+            else:
+                for model in models:
+                    for lines in _iter_model_lines(model, batch_size):
+                        for line in lines:
+                            out.write(line)
+
+                        self._report_progress(len(lines), totalobjs)
+        finally:
+            if out is not self.stdout:
+                out.close()
+
+        elapsed = time.time() - start_time
+
+        self.stderr.write("\nDumped %d objects in %.1f seconds "
+                          "(%.1f objects/sec)\n"
+                          % (self._num_dumped, elapsed,
+                             self._num_dumped / max(elapsed, 1e-9)))
+        self.stderr.write("Done.\n")
+
+    def _dump_parallel(self, out, models, batch_size, processes, totalobjs):
+        """Dumps models in worker processes.
+
+        Each worker dumps a model to a temporary file. These are written to
+        the output in model order as they finish.
+        """
+        temp_dir = tempfile.mkdtemp(prefix='rb-dumpdb-')
+
+        # The workers need their own database connections.
+        for connection in connections.all():
+            connection.close()
+
+        pool = multiprocessing.Pool(processes)
+
+        try:
+            jobs = [
+                (model._meta.app_label, model._meta.object_name, batch_size,
+                 temp_dir)
+                for model in models
+            ]
+
+            for filename, count in pool.imap(_dump_model_to_file, jobs):
+                with open(filename, 'rb') as fp:
+                    for line in fp:
+                        out.write(line)
+
+                os.unlink(filename)
+                self._report_progress(count, totalobjs)
+
+            pool.close()
+        finally:
+            pool.terminate()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def _report_progress(self, num_dumped, totalobjs):
+        """Writes the percentage of objects dumped so far."""
+        self._num_dumped += num_dumped
+
+        pct = self._num_dumped * 100 / max(totalobjs, 1)
+
+        if pct != self._prev_pct:
+            self.stderr.write("  [%s%%]\r" % pct)
+            self.stderr.flush()
+            self._prev_pct = pct
+
+
+def _iter_model_lines(model, batch_size):
+    """Yields batches of serialized objects for a model.
+
+    Each batch is a list of JSON-serialized objects, each on its own line
+    and encoded as UTF-8.
+    Objects are fetched in order of their primary keys, with each batch
+    fetched starting after the last primary key of the previous batch.
+    """
+    queryset = model._default_manager.order_by('pk')
+    last_pk = None
+
+    while True:
+        if last_pk is None:
+            objs = list(queryset[:batch_size])
+        else:
+            objs = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+
+        if not objs:
+            break
+
+        last_pk = objs[-1].pk
+
+        yield [
+            ('%s\n' % json.dumps(data, cls=DjangoJSONEncoder)).encode('utf-8')
+            for data in serializers.serialize('python', objs)
+        ]
+
+
+def _dump_model_to_file(args):
+    """Dumps all objects for a model to a temporary file.
+
+    This is run in a worker process. It returns the name of the file and
+    the number of objects dumped.
+    """
+    app_label, object_name, batch_size, temp_dir = args
+    model = get_model(app_label, object_name)
+    count = 0
 
-                    i += 1
-                    pct = i * 100 / totalobjs
-                    if pct != prev_pct:
-                        self.stderr.write("  [%s%%]\r" % pct)
-                        self.stderr.flush()
-                        prev_pct = pct
+    fd, filename = tempfile.mkstemp(prefix='%s.%s-' % (app_label,
+                                                       object_name),
+                                    dir=temp_dir)
 
-                j += OBJECT_LIMIT
+    with os.fdopen(fd, 'wb') as fp:
+        for lines in _iter_model_lines(model, batch_size):
+            fp.writelines(lines)
+            count += len(lines)
 
-        self.stderr.write("\nDone.\n")
+    return filename, count
@@ -1,30 +1,61 @@
 from __future__ import unicode_literals
 
+import gzip
+import itertools
 import os
 import re
+import time
+from optparse import make_option
 
 from django import db
 from django.core import serializers
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-from django.db.models import get_apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import AutoField, get_apps
 from django.utils.six.moves import input
 
 
 class Command(BaseCommand):
+    """Loads data formatted by dumpdb.
+
+    Objects are loaded in batches, each in its own transaction. By default,
+    the objects in a batch are inserted in bulk, a model at a time. If a
+    batch fails to load that way, its objects are saved one at a time
+    instead, so that the objects that can't be loaded are reported.
+    Passing ``--no-bulk`` always saves objects one at a time, which is
+    slower, but sends the model signals for each object.
+
+    Dumps compressed with gzip are decompressed automatically.
+    """
+    args = '<filename>'
     help = ('Loads data formatted by dumpdb, for migration across types '
             'of databases.')
 
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=5000,
+                    dest='batch_size',
+                    help='The number of objects to load in each transaction'),
+        make_option('--no-bulk', action='store_false', default=True,
+                    dest='bulk',
+                    help='Save objects one at a time, instead of inserting '
+                         'them in bulk'),
+    )
+
     def handle(self, *args, **options):
         if len(args) != 1:
             raise CommandError("You must specify a filename on the command "
                                "line.")
 
         filename = args[0]
+        batch_size = options['batch_size']
 
         if not os.path.exists(filename):
             raise CommandError("%s does not exist." % filename)
 
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
         confirm = input("""
 This will wipe out your existing database prior to loading. It is highly
 recommended that you have a full SQL database dump in case things go wrong.
@@ -43,59 +74,197 @@ Type 'yes' to continue, or 'no' to cancel: """)
 
         os.system("./reviewboard/manage.py reset --noinput %s" % ' '.join(apps))
 
-        transaction_setup = False
-
         try:
-            with open(filename, 'r') as f:
-                line = f.readline()
+            self._load(filename, batch_size, options['bulk'])
+        except CommandError:
+            raise
+        except Exception as e:
+            raise CommandError("Problem installing '%s': %s\n" % (filename, e))
+
+        self.stdout.write('\nDone.')
+
+    def _load(self, filename, batch_size, bulk):
+        """Loads the objects in a dump file."""
+        with open(filename, 'rb') as f:
+            is_gzip = (f.read(2) == b'\x1f\x8b')
+
+        if is_gzip:
+            f = gzip.open(filename, 'rb')
+        else:
+            f = open(filename, 'rb')
 
-                m = re.match("^# dbdump v(\d+) - (\d+) objects$", line)
-                if not m:
-                    raise CommandError("Unknown dump format\n")
+        with f:
+            line = f.readline()
 
-                version = int(m.group(1))
-                totalobjs = int(m.group(2))
-                i = 0
-                prev_pct = -1
+            m = re.match("^# dbdump v(\d+) - (\d+) objects$", line.rstrip())
+            if not m:
+                raise CommandError("Unknown dump format\n")
 
-                if version != 1:
-                    raise CommandError("Unknown dump version\n")
+            version = int(m.group(1))
+            totalobjs = int(m.group(2))
 
-                transaction.commit_unless_managed()
-                transaction.enter_transaction_management()
-                transaction.managed(True)
-                transaction_setup = True
+            if version != 1:
+                raise CommandError("Unknown dump version\n")
 
-                self.stdout.write("Importing new style dump format (v%s)" %
-                                  version)
-                for line in f:
+            self.stdout.write("Importing new style dump format (v%s)" %
+                              version)
+
+            start_time = time.time()
+            num_loaded = 0
+            prev_pct = -1
+            lines = []
+            models = set()
+
+            # The header was line 1.
+            for i, line in enumerate(itertools.chain(f, [None]), start=2):
+                if line is not None:
                     if line[0] == "{":
-                        for obj in serializers.deserialize("json",
-                                                           "[%s]" % line):
-                            try:
-                                obj.save()
-                            except Exception as e:
-                                self.stderr.write("Error: %s\n" % e)
-                                self.stderr.write("Line %s: '%s'" % (i, line))
+                        lines.append(line)
                     elif line[0] != "#":
                         self.stderr.write("Junk data on line %s" % i)
 
+                if lines and (line is None or len(lines) == batch_size):
+                    objs = list(serializers.deserialize(
+                        "json", "[%s]" % ",".join(lines)))
+                    models.update(type(obj.object) for obj in objs)
+
+                    self._load_batch(objs, bulk)
+
+                    num_loaded += len(lines)
+                    lines = []
                     db.reset_queries()
 
-                    i += 1
-                    pct = (i * 100 / totalobjs)
+                    pct = (num_loaded * 100 / max(totalobjs, 1))
                     if pct != prev_pct:
                         self.stdout.write("  [%s%%]\r" % pct)
                         self.stdout.flush()
                         prev_pct = pct
 
-            transaction.commit()
-            transaction.leave_transaction_management()
-        except Exception as e:
-            raise CommandError("Problem installing '%s': %s\n" % (filename, e))
+        self._reset_sequences(models)
 
-            if transaction_setup:
-                transaction.rollback()
-                transaction.leave_transaction_management()
+        elapsed = time.time() - start_time
 
-        self.stdout.write('\nDone.')
+        self.stdout.write("\nLoaded %d objects in %.1f seconds "
+                          "(%.1f objects/sec)"
+                          % (num_loaded, elapsed,
+                             num_loaded / max(elapsed, 1e-9)))
+
+    def _load_batch(self, objs, bulk):
+        """Loads a batch of deserialized objects in a transaction.
+
+        If the objects can't be inserted in bulk, they're saved one at a
+        time, and any that fail are reported.
+        """
+        if bulk:
+            try:
+                with transaction.atomic():
+                    self._bulk_insert(objs)
+
+                return
+            except Exception as e:
+                self.stderr.write("Unable to insert a batch of objects in "
+                                  "bulk (%s). Saving them one at a time.\n"
+                                  % e)
+
+        with transaction.atomic():
+            for obj in objs:
+                try:
+                    with transaction.atomic():
+                        obj.save()
+                except Exception as e:
+                    self.stderr.write("Error: %s\n" % e)
+                    self.stderr.write("Object: %s %s\n"
+                                      % (obj.object._meta, obj.object.pk))
+
+    def _bulk_insert(self, objs):
+        """Inserts deserialized objects in bulk.
+
+        This works like saving them through the deserializer, in that no
+        model save methods are called, and fields are stored exactly as
+        they were dumped. Unlike the deserializer, no signals are sent.
+        Models that inherit from other concrete models can't be inserted in
+        bulk, and are saved one at a time.
+        """
+        for model, model_objs in itertools.groupby(
+                objs, lambda obj: type(obj.object)):
+            model_objs = list(model_objs)
+
+            if model._meta.parents:
+                for obj in model_objs:
+                    obj.save()
+
+                continue
+
+            self._insert(model, [obj.object for obj in model_objs])
+
+            # Insert the rows for any many-to-many relations.
+            through_rows = {}
+
+            for obj in model_objs:
+                for field_name, related_pks in obj.m2m_data.items():
+                    field = model._meta.get_field(field_name)
+                    through = field.rel.through
+                    source_attname = through._meta.get_field(
+                        field.m2m_field_name()).attname
+                    target_attname = through._meta.get_field(
+                        field.m2m_reverse_field_name()).attname
+
+                    through_rows.setdefault(through, []).extend(
+                        through(**{
+                            source_attname: obj.object.pk,
+                            target_attname: related_pk,
+                        })
+                        for related_pk in related_pks
+                    )
+
+            for through, rows in through_rows.items():
+                self._insert(through, rows)
+
+    def _insert(self, model, instances):
+        """Inserts model instances in as few queries as possible.
+
+        This is like QuerySet.bulk_create, but the field values are inserted
+        as-is (like a raw save), so that fields such as modification
+        timestamps aren't updated. As with bulk_create, instances without a
+        primary key (such as many-to-many rows) are inserted without one,
+        letting the database assign it.
+        """
+        fields = model._meta.local_concrete_fields
+        with_pk = [instance for instance in instances
+                   if instance.pk is not None]
+        without_pk = [instance for instance in instances
+                      if instance.pk is None]
+
+        if with_pk:
+            self._insert_rows(model, with_pk, fields)
+
+        if without_pk:
+            self._insert_rows(
+                model, without_pk,
+                [field for field in fields
+                 if not isinstance(field, AutoField)])
+
+    def _insert_rows(self, model, instances, fields):
+        """Inserts the given fields of model instances in batches."""
+        batch_size = max(connection.ops.bulk_batch_size(fields, instances), 1)
+
+        for i in range(0, len(instances), batch_size):
+            model._base_manager._insert(instances[i:i + batch_size],
+                                        fields=fields,
+                                        raw=True,
+                                        using=connection.alias)
+
+    def _reset_sequences(self, models):
+        """Resets the primary key sequences for the loaded models.
+
+        Objects are loaded with their original primary keys, so databases
+        using sequences need to be told to start after the highest one.
+        """
+        sequence_sql = connection.ops.sequence_reset_sql(no_style(),
+                                                         list(models))
+
+        if sequence_sql:
+            cursor = connection.cursor()
+
+            for sql in sequence_sql:
+                cursor.execute(sql)
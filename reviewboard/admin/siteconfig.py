@@ -122,14 +122,24 @@ defaults.update({
     'auth_x509_username_field':            'SSL_CLIENT_S_DN_CN',
     'auth_x509_username_regex':            '',
     'auth_x509_autocreate_users':          False,
+    'diffviewer_chunk_generation_workers': 1,
     'diffviewer_context_num_lines':        5,
+    'diffviewer_diff_cost_budget':         2000000,
+    'diffviewer_highlight_shown_lines_only': False,
+    'diffviewer_histogram_diff_repositories': [],
     'diffviewer_include_space_patterns':   [],
     'diffviewer_max_diff_size':            0,
+    'diffviewer_move_detection_budget':    500000,
     'diffviewer_paginate_by':              20,
     'diffviewer_paginate_orphans':         10,
+    'diffviewer_patched_file_cache_size':  32 * 1024 * 1024,
+    'diffviewer_precompute_chunks':        False,
+    'diffviewer_repository_diff_cost_budgets': {},
     'diffviewer_syntax_highlighting':      True,
     'diffviewer_syntax_highlighting_threshold': 0,
+    'diffviewer_syntax_highlighting_timeout': 5,
     'diffviewer_show_trailing_whitespace': True,
+    'diffviewer_stream_fragments':         False,
     'mail_send_review_mail':               False,
     'mail_send_new_user_mail':             False,
     'mail_enable_autogenerated_header':    True,
@@ -140,6 +150,7 @@ defaults.update({
     'search_index_file': os.path.join(settings.SITE_DATA_DIR,
                                       'search-index'),
     'search_results_per_page': 20,
+    'search_index_batch_size': 1000,
     'max_search_results': 200,
 
     # Overwrite this.
@@ -182,6 +193,8 @@ def load_site_config():
                 'ENGINE': settings.HAYSTACK_CONNECTIONS['default']['ENGINE'],
                 'PATH': (siteconfig.get('search_index_file') or
                          defaults['search_index_file']),
+                'BATCH_SIZE': (siteconfig.get('search_index_batch_size') or
+                               defaults['search_index_batch_size']),
             },
         })
 
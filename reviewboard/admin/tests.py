@@ -1,14 +1,31 @@
 from __future__ import unicode_literals
 
+import gzip
+import json
 import os
 import shutil
 import tempfile
 
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import get_models
 from django.forms import ValidationError
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from djblets.db.fields import JSONField
 from djblets.siteconfig.models import SiteConfiguration
 
 from reviewboard.admin import checks
+from reviewboard.admin.forms import DiffSettingsForm
+from reviewboard.admin.management.commands.loaddb import \
+    Command as LoadDBCommand
+from reviewboard.reviews.models import Group
 from reviewboard.ssh.client import SSHClient
 from reviewboard.admin.validation import validate_bug_tracker
 from reviewboard.site.urlresolvers import local_site_reverse
@@ -159,3 +176,275 @@ class SSHSettingsFormTestCase(TestCase):
 
         # Check whether the key has been deleted.
         self.assertEqual(self.ssh_client.get_user_key(), None)
+
+
+class DiffSettingsFormTests(TestCase):
+    """Unit tests for DiffSettingsForm in /admin/forms.py"""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(DiffSettingsFormTests, self).setUp()
+
+        self.repository = self.create_repository()
+        self.form = DiffSettingsForm(SiteConfiguration.objects.get_current())
+
+    def test_clean_repository_diff_cost_budgets(self):
+        """Testing DiffSettingsForm.clean_repository_diff_cost_budgets"""
+        self.form.cleaned_data = {
+            'repository_diff_cost_budgets': '%s: 50\n\n' % self.repository.pk,
+        }
+
+        self.assertEqual(self.form.clean_repository_diff_cost_budgets(),
+                         {'%s' % self.repository.pk: 50})
+
+    def test_clean_repository_diff_cost_budgets_invalid(self):
+        """Testing DiffSettingsForm.clean_repository_diff_cost_budgets with
+        invalid lines and unknown repositories
+        """
+        for value in ('%s' % self.repository.pk,
+                      '%s: -1' % self.repository.pk,
+                      '%s: 50' % self.repository.name,
+                      '%s: 50' % (self.repository.pk + 1)):
+            self.form.cleaned_data = {
+                'repository_diff_cost_budgets': value,
+            }
+
+            self.assertRaises(ValidationError,
+                              self.form.clean_repository_diff_cost_budgets)
+
+    def test_clean_syntax_highlighting_timeout_blank(self):
+        """Testing DiffSettingsForm with a blank syntax highlighting
+        timeout
+        """
+        self.form.cleaned_data = {
+            'diffviewer_syntax_highlighting_timeout': None,
+        }
+
+        self.assertFalse(
+            self.form.fields['diffviewer_syntax_highlighting_timeout']
+            .required)
+        self.assertEqual(
+            self.form.clean_diffviewer_syntax_highlighting_timeout(), 0)
+
+    def test_clean_histogram_diff_repositories(self):
+        """Testing DiffSettingsForm.clean_histogram_diff_repositories"""
+        self.form.cleaned_data = {
+            'histogram_diff_repositories': '\n %s \n' % self.repository.pk,
+        }
+
+        self.assertEqual(self.form.clean_histogram_diff_repositories(),
+                         ['%s' % self.repository.pk])
+
+    def test_clean_histogram_diff_repositories_invalid(self):
+        """Testing DiffSettingsForm.clean_histogram_diff_repositories with
+        names and unknown repositories
+        """
+        for value in (self.repository.name,
+                      '%s' % (self.repository.pk + 1)):
+            self.form.cleaned_data = {
+                'histogram_diff_repositories': value,
+            }
+
+            self.assertRaises(ValidationError,
+                              self.form.clean_histogram_diff_repositories)
+
+
+class DumpLoadDBTests(TestCase):
+    """Unit tests for the dumpdb and loaddb management commands"""
+    fixtures = ['test_users', 'test_scmtools']
+
+    def setUp(self):
+        super(DumpLoadDBTests, self).setUp()
+
+        self.tempdir = tempfile.mkdtemp(prefix='rb-tests-')
+
+        review_request = self.create_review_request(publish=True,
+                                                    create_repository=True)
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset)
+
+        group = Group.objects.create(name='devgroup')
+        group.users.add(*User.objects.all())
+        review_request.target_groups.add(group)
+        review_request.target_people.add(User.objects.get(username='grumpy'))
+
+    def tearDown(self):
+        super(DumpLoadDBTests, self).tearDown()
+
+        shutil.rmtree(self.tempdir)
+
+    def test_dump_and_load(self):
+        """Testing dumpdb and loaddb with a bulk load"""
+        expected = self._get_objects()
+        self.assertTrue(any(
+            data['model'] == 'reviews.group' and data['fields']['users']
+            for data in expected))
+
+        filename = self._dump('dump.json')
+
+        with open(filename, 'rb') as fp:
+            lines = fp.readlines()
+
+        self.assertEqual(lines[0],
+                         b'# dbdump v1 - %d objects\n' % len(expected))
+        self.assertEqual(len(lines), len(expected) + 1)
+
+        self._wipe_database()
+        self.assertEqual(self._get_objects(), [])
+
+        # Every batch should be inserted in bulk.
+        self.assertEqual(self._load(filename), '')
+        self.assertEqual(self._get_objects(), expected)
+
+    def test_dump_and_load_gzip_no_bulk(self):
+        """Testing dumpdb --gzip and loaddb --no-bulk"""
+        expected = self._get_objects()
+        filename = self._dump('dump.json', gzip=True)
+
+        with open(filename, 'rb') as fp:
+            self.assertEqual(fp.read(2), b'\x1f\x8b')
+
+        self._wipe_database()
+        self._load(filename, bulk=False)
+        self.assertEqual(self._get_objects(), expected)
+
+    def test_dump_parallel(self):
+        """Testing dumpdb with multiple processes"""
+        filename = self._dump('dump.json')
+        parallel_filename = self._dump('dump-parallel.json.gz', processes=3)
+
+        with open(filename, 'rb') as fp:
+            expected = fp.read()
+
+        with gzip.open(parallel_filename, 'rb') as fp:
+            self.assertEqual(fp.read(), expected)
+
+        # The temporary files for each model are removed.
+        self.assertEqual(os.listdir(self.tempdir),
+                         ['dump-parallel.json.gz', 'dump.json'])
+
+    def test_load_with_failed_bulk_insert(self):
+        """Testing loaddb saving objects one at a time when a batch can't
+        be inserted in bulk
+        """
+        expected = self._get_objects()
+        filename = self._dump('dump.json')
+
+        # A duplicated object can't be inserted along with the others.
+        with open(filename, 'rb') as fp:
+            lines = fp.readlines()
+
+        user_line = [
+            line
+            for line in lines
+            if b'"model": "auth.user"' in line
+        ][0]
+
+        with open(filename, 'wb') as fp:
+            fp.writelines(lines + [user_line])
+
+        self._wipe_database()
+        stderr = self._load(filename, batch_size=len(lines))
+
+        self.assertIn('Unable to insert a batch of objects in bulk', stderr)
+        self.assertEqual(self._get_objects(), expected)
+
+    def test_insert_without_pk(self):
+        """Testing loaddb inserting rows without primary keys"""
+        through = Group.users.through
+        group = Group.objects.get(name='devgroup')
+        user_ids = list(group.users.values_list('pk', flat=True))
+        group.users.clear()
+
+        # Many-to-many rows are created without primary keys, and must be
+        # inserted without the column, rather than with a NULL.
+        rows = [
+            through(group_id=group.pk, user_id=user_id)
+            for user_id in user_ids
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            LoadDBCommand()._insert(through, rows)
+
+        self.assertEqual(len(queries), 1)
+
+        sql = queries[0]['sql']
+        self.assertTrue('INSERT INTO "%s"' % through._meta.db_table in sql)
+        self.assertFalse('"id"' in sql)
+        self.assertEqual(
+            sorted(group.users.values_list('pk', flat=True)),
+            sorted(user_ids))
+
+    def test_load_resets_sequences(self):
+        """Testing loaddb resets primary key sequences"""
+        max_pk = User.objects.order_by('-pk')[0].pk
+        filename = self._dump('dump.json')
+
+        self._wipe_database()
+        self._load(filename)
+
+        user = User.objects.create(username='newuser')
+        self.assertTrue(user.pk > max_pk)
+
+    def _dump(self, filename, **options):
+        """Dumps the database to a file in the temporary directory."""
+        filename = os.path.join(self.tempdir, filename)
+
+        # A small batch size makes dumps of each model span several
+        # batches.
+        call_command('dumpdb', output=filename, batch_size=2,
+                     stdout=StringIO(), stderr=StringIO(), **options)
+
+        return filename
+
+    def _load(self, filename, bulk=True, batch_size=7):
+        """Loads a dump into the database.
+
+        This returns anything written to stderr.
+        """
+        command = LoadDBCommand()
+        command.stdout = StringIO()
+        command.stderr = StringIO()
+        command._load(filename, batch_size, bulk)
+
+        ContentType.objects.clear_cache()
+
+        return command.stderr.getvalue()
+
+    def _wipe_database(self):
+        """Deletes everything in the database."""
+        cursor = connection.cursor()
+        tables = connection.introspection.django_table_names(
+            only_existing=True)
+
+        for sql in connection.ops.sql_flush(no_style(), tables, []):
+            cursor.execute(sql)
+
+        ContentType.objects.clear_cache()
+
+    def _get_objects(self):
+        """Returns every object in the database, serialized."""
+        objects = []
+
+        for model in get_models():
+            if model._meta.proxy:
+                continue
+
+            # The keys in serialized JSON fields can be in any order.
+            json_fields = [
+                field.name
+                for field in model._meta.fields
+                if isinstance(field, JSONField)
+            ]
+
+            for data in serializers.serialize(
+                    'python', model._default_manager.order_by('pk')):
+                data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+
+                for field_name in json_fields:
+                    data['fields'][field_name] = \
+                        json.loads(data['fields'][field_name])
+
+                objects.append(data)
+
+        return sorted(objects, key=lambda data: (data['model'], data['pk']))
@@ -20,6 +20,8 @@ from reviewboard.admin.support import get_support_url
 from reviewboard.admin.widgets import (dynamic_activity_data,
                                        primary_widgets,
                                        secondary_widgets)
+from reviewboard.diffviewer.filecache import get_patched_file_cache
+from reviewboard.hostingsvcs.responsecache import get_response_cache
 from reviewboard.ssh.client import SSHClient
 from reviewboard.ssh.utils import humanize_key
 
@@ -49,6 +51,9 @@ def cache_stats(request, template_name="admin/cache_stats.html"):
     return render_to_response(template_name, RequestContext(request, {
         'cache_hosts': cache_stats,
         'cache_backend': settings.CACHES['default']['BACKEND'],
+        'patched_file_cache_stats': get_patched_file_cache().get_stats(),
+        'hosting_service_response_cache_stats':
+            get_response_cache().get_stats(),
         'title': _("Server Cache"),
         'root_path': settings.SITE_ROOT + "admin/db/"
     }))
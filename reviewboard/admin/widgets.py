@@ -281,6 +281,29 @@ class ServerCacheWidget(Widget):
         }
 
 
+class SyntaxHighlightingTimeoutsWidget(Widget):
+    """Syntax highlighting timeouts widget.
+
+    Displays the types of files that have most often taken too long to
+    syntax highlight in the diff viewer.
+    """
+    title = _('Syntax Highlighting Timeouts')
+    template = 'admin/widgets/w-syntax-highlighting-timeouts.html'
+    cache_data = False
+
+    MAX_FILE_TYPES = 10
+
+    def generate_data(self, request):
+        # This is imported here to avoid a circular import.
+        from reviewboard.diffviewer.chunk_generator import \
+            get_syntax_highlighting_timeouts
+
+        return {
+            'timeouts': get_syntax_highlighting_timeouts()[
+                :self.MAX_FILE_TYPES],
+        }
+
+
 class NewsWidget(Widget):
     """News widget.
 
@@ -497,5 +520,6 @@ register(ReviewRequestStatusesWidget)
 register(RecentActionsWidget)
 register(ReviewGroupsWidget)
 register(ServerCacheWidget)
+register(SyntaxHighlightingTimeoutsWidget)
 register(NewsWidget)
 register(DatabaseStatsWidget)
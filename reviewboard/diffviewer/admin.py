@@ -6,7 +6,8 @@ from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import DiffLexer
 
-from reviewboard.diffviewer.models import FileDiff, DiffSet, DiffSetHistory
+from reviewboard.diffviewer.models import (DiffChunkJob, DiffSet,
+                                           DiffSetHistory, FileDiff)
 
 
 class FileDiffAdmin(admin.ModelAdmin):
@@ -71,6 +72,15 @@ class DiffSetHistoryAdmin(admin.ModelAdmin):
     ordering = ('-timestamp',)
 
 
+class DiffChunkJobAdmin(admin.ModelAdmin):
+    list_display = ('filediff', 'status', 'priority', 'attempts',
+                    'last_updated')
+    list_filter = ('status',)
+    raw_id_fields = ('filediff',)
+    ordering = ('-priority', 'timestamp')
+
+
+admin.site.register(DiffChunkJob, DiffChunkJobAdmin)
 admin.site.register(FileDiff, FileDiffAdmin)
 admin.site.register(DiffSet, DiffSetAdmin)
 admin.site.register(DiffSetHistory, DiffSetHistoryAdmin)
@@ -1,22 +1,33 @@
 from __future__ import unicode_literals
 
 import fnmatch
+import logging
+import posixpath
 import re
+import time
+import zlib
 
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import six
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
-from django.utils.six.moves import range
+from django.utils.six.moves import cPickle as pickle, range
 from django.utils.translation import get_language
 from djblets.log import log_timed
-from djblets.cache.backend import cache_memoize
+from djblets.cache.backend import (CACHE_CHUNK_SIZE, DEFAULT_EXPIRATION_TIME,
+                                   make_cache_key)
 from djblets.siteconfig.models import SiteConfiguration
-from pygments import highlight
-from pygments.lexers import get_lexer_for_filename
+from pygments import format as format_tokens, highlight
+from pygments.lexers import LEXERS, get_lexer_for_filename
 from pygments.formatters import HtmlFormatter
+from pygments.util import ClassNotFound
 
 from reviewboard.diffviewer.differ import get_differ
-from reviewboard.diffviewer.diffutils import (get_line_changed_regions,
+from reviewboard.diffviewer.diffutils import (filediffs_share_original,
+                                              get_diff_cost_budget,
+                                              get_interdiff_search_ranges,
+                                              get_line_changed_regions,
                                               get_original_file,
                                               get_patched_file,
                                               convert_to_unicode)
@@ -42,6 +53,141 @@ class NoWrapperHtmlFormatter(HtmlFormatter):
                 yield tup
 
 
+class SyntaxHighlightingTimeoutError(Exception):
+    """Raised when syntax highlighting a file takes too long."""
+    pass
+
+
+# The formatter doesn't hold any state between calls, so one instance can be
+# shared by all highlighting.
+_formatter = NoWrapperHtmlFormatter()
+
+# Lexers for files, keyed by extension (or by basename, for files that aren't
+# matched by extension alone). A value of None means there's no lexer.
+_lexers = {}
+_lexer_filenames_re = None
+
+
+def get_lexer_for_file(filename):
+    """Returns a Pygments lexer for highlighting the given file.
+
+    Lexers are looked up once per file extension and then reused, so that
+    the full list of Pygments lexers only needs to be searched the first
+    time a type of file is highlighted. Files matching a lexer's filename
+    pattern that isn't a simple extension (such as ``Makefile`` or
+    ``CMakeLists.txt``) are looked up by their basename instead.
+
+    If there's no lexer for the file, this returns None.
+    """
+    global _lexer_filenames_re
+
+    if _lexer_filenames_re is None:
+        patterns = set()
+
+        for lexer_info in six.itervalues(LEXERS):
+            for pattern in lexer_info[3]:
+                if (not pattern.startswith('*.') or
+                        any(c in pattern[2:] for c in '*?.')):
+                    patterns.add(fnmatch.translate(pattern))
+
+        _lexer_filenames_re = re.compile('|'.join(sorted(patterns)))
+
+    basename = posixpath.basename(filename)
+
+    if _lexer_filenames_re.match(basename):
+        key = basename
+    else:
+        key = posixpath.splitext(basename)[1] or basename
+
+    try:
+        return _lexers[key]
+    except KeyError:
+        pass
+
+    try:
+        lexer = get_lexer_for_filename(basename,
+                                       stripnl=False,
+                                       encoding='utf-8')
+        lexer.add_filter('codetagify')
+    except ClassNotFound:
+        lexer = None
+
+    _lexers[key] = lexer
+
+    return lexer
+
+
+def _get_file_type(filename):
+    """Returns the type of file used for syntax highlighting statistics.
+
+    This is the file's extension, or its basename if it has no extension.
+    """
+    basename = posixpath.basename(filename)
+    file_type = (posixpath.splitext(basename)[1] or basename).lower()
+
+    if not re.match(r'^[\w.+-]{1,32}$', file_type):
+        file_type = '(other)'
+
+    return file_type
+
+
+def record_syntax_highlighting_timeout(filename):
+    """Records that syntax highlighting a file took too long.
+
+    Counts are kept per type of file (see get_syntax_highlighting_timeouts)
+    in the main cache backend, so that they cover all processes serving the
+    site.
+    """
+    file_type = _get_file_type(filename)
+    key = make_cache_key('syntax-highlighting-timeouts:%s' % file_type)
+
+    try:
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The counter doesn't exist yet.
+            cache.add(key, 1, DEFAULT_EXPIRATION_TIME)
+
+        # This isn't atomic, but at worst a file type may be missing from
+        # the list until it times out again.
+        types_key = make_cache_key('syntax-highlighting-timeouts')
+        file_types = cache.get(types_key) or []
+
+        if file_type not in file_types:
+            cache.set(types_key, file_types + [file_type],
+                      DEFAULT_EXPIRATION_TIME)
+    except Exception as e:
+        logging.debug('Unable to record syntax highlighting timeout for '
+                      '%s: %s', file_type, e)
+
+
+def get_syntax_highlighting_timeouts():
+    """Returns how often syntax highlighting has timed out per file type.
+
+    This returns a list of ``(file_type, count)`` tuples, with the file
+    types that have timed out the most first.
+    """
+    file_types = cache.get(make_cache_key('syntax-highlighting-timeouts'))
+
+    if not file_types:
+        return []
+
+    keys = dict(
+        (make_cache_key('syntax-highlighting-timeouts:%s' % file_type),
+         file_type)
+        for file_type in file_types
+    )
+    values = cache.get_many(list(keys.keys()))
+
+    return sorted(
+        [
+            (file_type, int(values[key]))
+            for key, file_type in six.iteritems(keys)
+            if values.get(key)
+        ],
+        key=lambda item: (-item[1], item[0]))
+
+
 class DiffChunkGenerator(object):
     """Generates chunks for a diff that can be used for rendering.
 
@@ -79,6 +225,11 @@ class DiffChunkGenerator(object):
          in this case, so we have to indicate that we are indeed in
          interdiff mode so that we can special-case this and not
          grab a patched file for the interdiff version.
+
+    Generated chunks are cached individually, along with a small header
+    record containing a summary of each chunk (see get_chunk_summaries).
+    This allows callers that only need part of a diff, such as comment
+    fragments, to load just the chunks they need.
     """
     NEWLINES_RE = re.compile(r'\r?\n')
 
@@ -89,6 +240,19 @@ class DiffChunkGenerator(object):
     # Default tab size used in browsers.
     TAB_SIZE = DiffOpcodeGenerator.TAB_SIZE
 
+    # The number of tokens highlighted between checks of the time limit.
+    HIGHLIGHTING_TIMEOUT_CHECK_INTERVAL = 100
+
+    # Characters escaped in unhighlighted lines. &amp; must come last when
+    # unescaping.
+    ESCAPED_CHARS = (
+        ('&lt;', '<'),
+        ('&gt;', '>'),
+        ('&quot;', '"'),
+        ('&#39;', "'"),
+        ('&amp;', '&'),
+    )
+
     def __init__(self, request, filediff, interfilediff=None,
                  force_interdiff=False, enable_syntax_highlighting=True):
         assert filediff
@@ -103,11 +267,7 @@ class DiffChunkGenerator(object):
 
         self.filename = filediff.source_file
 
-        # Chunk processing state.
-        self._last_header = [None, None]
-        self._last_header_index = [0, 0]
-        self._cur_meta = {}
-        self._chunk_index = 0
+        self._reset_chunk_state()
 
     def make_cache_key(self):
         """Creates a cache key for any generated chunks."""
@@ -124,6 +284,9 @@ class DiffChunkGenerator(object):
         else:
             key += 'interdiff-%s-none' % self.filediff.pk
 
+        # Chunks diffed under a different cost budget may differ.
+        key += '-budget%s' % get_diff_cost_budget(self.diffset.repository)
+
         key += '-%s' % get_language()
 
         return key
@@ -138,27 +301,282 @@ class DiffChunkGenerator(object):
         returned. Otherwise, new chunks will be generated, stored in cache,
         and returned.
         """
-        if (self.filediff.binary or
-                self.filediff.deleted or
-                self.filediff.source_revision == ''):
+        if not self._has_chunks():
             return []
 
-        return cache_memoize(self.make_cache_key(),
-                             lambda: list(self._get_chunks_uncached()),
-                             large_data=True)
+        header = self._get_cached_header()
+
+        if header is not None:
+            chunks = self._get_cached_chunks(
+                header, range(len(header['summaries'])))
+
+            if chunks is not None:
+                return chunks
+
+        return self._generate_and_cache_chunks()
+
+    def get_chunks_by_index(self, indexes):
+        """Returns the chunks with the given indexes.
+
+        Only the requested chunks are loaded from the cache. If any of them
+        aren't cached, all the chunks will be generated and cached.
+        """
+        if not self._has_chunks():
+            return []
+
+        header = self._get_cached_header()
+
+        if header is not None:
+            chunks = self._get_cached_chunks(header, indexes)
+
+            if chunks is not None:
+                return chunks
+
+        chunks = self._generate_and_cache_chunks()
+
+        return [chunks[i] for i in indexes]
+
+    def get_chunk_summaries(self):
+        """Returns a summary of each of the chunks for the diff.
+
+        Each summary is a dictionary containing the ``change`` type, the
+        ``first_line`` and ``last_line`` virtual line numbers in the chunk,
+        the ``numlines``, whether it's a ``whitespace_chunk``, and its
+        ``headers`` (if any).
+
+        This only requires loading the cache's header record. If that isn't
+        cached, the chunks will be generated and cached.
+        """
+        if not self._has_chunks():
+            return []
+
+        header = self._get_cached_header()
+
+        if header is None:
+            header = self._make_header(self._generate_and_cache_chunks())
+
+        return header['summaries']
+
+    def is_cached(self):
+        """Returns whether the chunks for the diff are in the cache.
+
+        Files that can't have any chunks (see get_chunks) are always
+        considered cached, since there's nothing to generate for them.
+        """
+        return (not self._has_chunks() or
+                self._get_cached_header() is not None)
+
+    def iter_chunks(self):
+        """Yields the chunks for the given diff information.
+
+        This works like get_chunks, except that if the chunks aren't already
+        in the cache, each one is yielded as soon as it's generated, rather
+        than once the whole file has been processed. After the last chunk has
+        been generated, they're all stored in the cache.
+        """
+        if not self._has_chunks():
+            return
+
+        header = self._get_cached_header()
+
+        if header is not None:
+            chunks = self._get_cached_chunks(
+                header, range(len(header['summaries'])))
+
+            if chunks is not None:
+                for chunk in chunks:
+                    yield chunk
+
+                return
+
+        chunks = []
+
+        for chunk in self._get_chunks_uncached():
+            chunks.append(chunk)
+            yield chunk
+
+        self._cache_chunks(chunks)
+
+    def _has_chunks(self):
+        """Returns whether the diff can have any chunks.
+
+        Binary and deleted files don't, and neither do files that have moved
+        with no additional changes.
+        """
+        return not (self.filediff.binary or
+                    self.filediff.deleted or
+                    self.filediff.source_revision == '')
+
+    def _make_chunk_cache_key(self, index, part):
+        """Creates a cache key for part of a stored chunk."""
+        return make_cache_key('%s-chunk-%d-%d' % (self.make_cache_key(),
+                                                  index, part))
+
+    def _make_header(self, chunks, parts=None):
+        """Creates the header record stored in the cache for chunks.
+
+        The header contains a summary of each chunk and the number of
+        cache entries each chunk is split across.
+        """
+        summaries = []
+
+        for chunk in chunks:
+            lines = chunk['lines']
+            meta = chunk.get('meta', {})
+
+            summaries.append({
+                'change': chunk['change'],
+                'first_line': lines[0][0],
+                'last_line': lines[-1][0],
+                'numlines': chunk['numlines'],
+                'whitespace_chunk': meta.get('whitespace_chunk', False),
+                'headers': meta.get('headers'),
+            })
+
+        return {
+            'summaries': summaries,
+            'parts': parts,
+        }
+
+    def _get_cached_header(self):
+        """Returns the cached header record for the chunks, if any."""
+        try:
+            header = cache.get(make_cache_key(self.make_cache_key()))
+        except Exception as e:
+            logging.warning('Unable to load diff chunk header for '
+                            'FileDiff %s: %s', self.filediff.pk, e)
+            return None
+
+        # Anything other than a header here was stored by an older version,
+        # which cached all the chunks together.
+        if not isinstance(header, dict):
+            return None
+
+        return header
+
+    def _get_cached_chunks(self, header, indexes):
+        """Returns the chunks with the given indexes from the cache.
+
+        All the chunks are fetched at once. If any of them are missing
+        or can't be loaded, this returns None.
+        """
+        chunk_keys = [
+            [self._make_chunk_cache_key(i, part)
+             for part in range(header['parts'][i])]
+            for i in indexes
+        ]
+
+        try:
+            data = cache.get_many([
+                key
+                for keys in chunk_keys
+                for key in keys
+            ])
+        except Exception as e:
+            logging.warning('Unable to load diff chunks for FileDiff %s: %s',
+                            self.filediff.pk, e)
+            return None
+
+        chunks = []
+
+        for keys in chunk_keys:
+            try:
+                chunk_data = b''.join(data[key][0] for key in keys)
+            except KeyError:
+                logging.debug('Cache miss for diff chunk in FileDiff %s',
+                              self.filediff.pk)
+                return None
+
+            try:
+                chunks.append(pickle.loads(zlib.decompress(chunk_data)))
+            except Exception as e:
+                logging.warning('Unable to unpickle diff chunk for '
+                                'FileDiff %s: %s', self.filediff.pk, e)
+                return None
+
+        return chunks
+
+    def _generate_and_cache_chunks(self):
+        """Generates all the chunks and stores them in the cache."""
+        chunks = list(self._get_chunks_uncached())
+        self._cache_chunks(chunks)
+
+        return chunks
+
+    def _cache_chunks(self, chunks):
+        """Stores chunks in the cache.
+
+        Each chunk is pickled and compressed separately, and split across
+        several cache entries if it's too large for one. The header record
+        is stored last, so that it's only found once all the chunks are
+        available.
+        """
+        expiration = getattr(settings, 'CACHE_EXPIRATION_TIME',
+                             DEFAULT_EXPIRATION_TIME)
+        items = {}
+        parts = []
+
+        for i, chunk in enumerate(chunks):
+            data = zlib.compress(pickle.dumps(chunk,
+                                              pickle.HIGHEST_PROTOCOL))
+            num_parts = max(1, (len(data) + CACHE_CHUNK_SIZE - 1) //
+                               CACHE_CHUNK_SIZE)
+
+            # Each part is stored in a list, so that the cache backend
+            # doesn't try to convert the binary data to Unicode.
+            for part in range(num_parts):
+                items[self._make_chunk_cache_key(i, part)] = [
+                    data[part * CACHE_CHUNK_SIZE:
+                         (part + 1) * CACHE_CHUNK_SIZE],
+                ]
+
+            parts.append(num_parts)
+
+        try:
+            if items:
+                cache.set_many(items, expiration)
+
+            cache.set(make_cache_key(self.make_cache_key()),
+                      self._make_header(chunks, parts),
+                      expiration)
+        except Exception as e:
+            logging.warning('Unable to cache diff chunks for FileDiff %s: '
+                            '%s', self.filediff.pk, e)
+
+    def _reset_chunk_state(self):
+        """Resets the state used while generating chunks."""
+        self._changed_regions = {}
+        self._highlighting_deadline = None
+        self._highlighting_timed_out = False
+        self._last_header = [None, None]
+        self._last_header_index = [0, 0]
+        self._cur_meta = {}
+        self._chunk_index = 0
 
     def _get_chunks_uncached(self):
         """Returns the list of chunks, bypassing the cache."""
+        self._reset_chunk_state()
+
         encoding_list = self.diffset.repository.get_encoding_list()
 
         old = get_original_file(self.filediff, self.request, encoding_list)
         new = get_patched_file(old, self.filediff, self.request)
+        search_ranges = None
 
         if self.interfilediff:
+            if filediffs_share_original(self.filediff, self.interfilediff):
+                # Both revisions patch the same file, so there's no need to
+                # fetch it again. Only the regions touched by either diff
+                # can differ, so that's all the differ needs to look at.
+                interdiff_orig = old
+                search_ranges = get_interdiff_search_ranges(
+                    interdiff_orig, self.filediff, self.interfilediff)
+            else:
+                interdiff_orig = get_original_file(self.interfilediff,
+                                                   self.request,
+                                                   encoding_list)
+
             old = new
-            interdiff_orig = get_original_file(self.interfilediff,
-                                               self.request,
-                                               encoding_list)
             new = get_patched_file(interdiff_orig, self.interfilediff,
                                    self.request)
         elif self.force_interdiff:
@@ -187,30 +605,6 @@ class DiffChunkGenerator(object):
         a_num_lines = len(a)
         b_num_lines = len(b)
 
-        markup_a = markup_b = None
-
-        if self._get_enable_syntax_highlighting(old, new, a, b):
-            repository = self.filediff.diffset.repository
-            tool = repository.get_scmtool()
-            source_file = \
-                tool.normalize_path_for_display(self.filediff.source_file)
-            dest_file = \
-                tool.normalize_path_for_display(self.filediff.dest_file)
-
-            try:
-                # TODO: Try to figure out the right lexer for these files
-                #       once instead of twice.
-                markup_a = self._apply_pygments(old or '', source_file)
-                markup_b = self._apply_pygments(new or '', dest_file)
-            except:
-                pass
-
-        if not markup_a:
-            markup_a = self.NEWLINES_RE.split(escape(old))
-
-        if not markup_b:
-            markup_b = self.NEWLINES_RE.split(escape(new))
-
         siteconfig = SiteConfiguration.objects.get_current()
         ignore_space = True
 
@@ -219,8 +613,11 @@ class DiffChunkGenerator(object):
                 ignore_space = False
                 break
 
-        self.differ = get_differ(a, b, ignore_space=ignore_space,
-                                 compat_version=self.diffset.diffcompat)
+        self.differ = get_differ(
+            a, b, ignore_space=ignore_space,
+            compat_version=self.diffset.diffcompat,
+            cost_budget=get_diff_cost_budget(self.diffset.repository),
+            search_ranges=search_ranges)
         self.differ.add_interesting_lines_for_headers(self.filename)
 
         context_num_lines = siteconfig.get("diffviewer_context_num_lines")
@@ -239,9 +636,42 @@ class DiffChunkGenerator(object):
                 request=self.request)
 
         line_num = 1
-        opcodes_generator = get_diff_opcode_generator(self.differ,
-                                                      self.filediff,
-                                                      self.interfilediff)
+        opcodes = list(get_diff_opcode_generator(self.differ,
+                                                 self.filediff,
+                                                 self.interfilediff))
+
+        markup_a = markup_b = None
+        highlight_pending = False
+
+        if self._get_enable_syntax_highlighting(old, new, a, b):
+            source_file, dest_file = self._get_display_filenames()
+            self._start_highlighting_timer()
+
+            try:
+                if siteconfig.get('diffviewer_highlight_shown_lines_only'):
+                    a_ranges, b_ranges = self._get_shown_line_ranges(
+                        opcodes, a_num_lines, b_num_lines, context_num_lines,
+                        collapse_threshold)
+                    markup_a = self._apply_pygments_to_ranges(
+                        a, source_file, a_ranges)
+                    markup_b = self._apply_pygments_to_ranges(
+                        b, dest_file, b_ranges)
+                    highlight_pending = True
+                else:
+                    markup_a = self._apply_pygments(old or '', source_file)
+                    markup_b = self._apply_pygments(new or '', dest_file)
+            except SyntaxHighlightingTimeoutError:
+                markup_a = markup_b = None
+                highlight_pending = False
+                self._record_highlighting_timeout(dest_file)
+            except:
+                pass
+
+        if not markup_a:
+            markup_a = self.NEWLINES_RE.split(escape(old))
+
+        if not markup_b:
+            markup_b = self.NEWLINES_RE.split(escape(new))
 
         counts = {
             'equal': 0,
@@ -250,7 +680,7 @@ class DiffChunkGenerator(object):
             'delete': 0,
         }
 
-        for tag, i1, i2, j1, j2, meta in opcodes_generator:
+        for tag, i1, i2, j1, j2, meta in opcodes:
             old_lines = markup_a[i1:i2]
             new_lines = markup_b[j1:j2]
             num_lines = max(len(old_lines), len(new_lines))
@@ -265,22 +695,22 @@ class DiffChunkGenerator(object):
             counts[tag] += num_lines
 
             if tag == 'equal' and num_lines > collapse_threshold:
-                last_range_start = num_lines - context_num_lines
-
-                if line_num == 1:
-                    yield self._new_chunk(lines, 0, last_range_start, True)
-                    yield self._new_chunk(lines, last_range_start, num_lines)
-                else:
-                    yield self._new_chunk(lines, 0, context_num_lines)
-
-                    if i2 == a_num_lines and j2 == b_num_lines:
-                        yield self._new_chunk(lines, context_num_lines,
-                                              num_lines, True)
-                    else:
-                        yield self._new_chunk(lines, context_num_lines,
-                                              last_range_start, True)
-                        yield self._new_chunk(lines, last_range_start,
-                                              num_lines)
+                # Collapsed lines in equal chunks without indentation changes
+                # aren't highlighted until they're shown. Their markup is
+                # just the escaped text.
+                pending = (highlight_pending and
+                           not meta.get('indentation_changes'))
+
+                for start, end, collapsable in self._get_equal_segments(
+                        num_lines, line_num == 1,
+                        i2 == a_num_lines and j2 == b_num_lines,
+                        context_num_lines):
+                    chunk = self._new_chunk(lines, start, end, collapsable)
+
+                    if collapsable and pending:
+                        chunk['meta']['highlight_pending'] = True
+
+                    yield chunk
             else:
                 yield self._new_chunk(lines, 0, num_lines, False, tag, meta)
 
@@ -302,6 +732,170 @@ class DiffChunkGenerator(object):
                 total_line_count=insert_count + delete_count +
                                  replace_count + equal_count)
 
+    def highlight_pending_chunks(self, chunks):
+        """Highlights collapsed chunks that weren't highlighted when generated.
+
+        When the ``diffviewer_highlight_shown_lines_only`` setting is on,
+        collapsed chunks are left unhighlighted until they're expanded. This
+        highlights any such chunks in the list, in place. Other chunks are
+        left alone.
+        """
+        pending = [
+            chunk
+            for chunk in chunks
+            if chunk.get('meta', {}).get('highlight_pending')
+        ]
+
+        if not pending:
+            return
+
+        if (self.enable_syntax_highlighting and
+                not self.filediff.extra_data.get(
+                    'syntax_highlighting_timed_out')):
+            source_file, dest_file = self._get_display_filenames()
+            self._start_highlighting_timer()
+        else:
+            source_file = dest_file = None
+
+        for chunk in pending:
+            del chunk['meta']['highlight_pending']
+
+            if source_file is None:
+                continue
+
+            lines = chunk['lines']
+            all_markup = []
+
+            try:
+                for markup_index, filename in ((2, source_file),
+                                               (5, dest_file)):
+                    text = ''.join(
+                        '%s\n' % self._unescape(line[markup_index])
+                        for line in lines
+                    )
+                    all_markup.append(
+                        (markup_index, self._apply_pygments(text, filename)))
+            except SyntaxHighlightingTimeoutError:
+                # Leave this and any remaining chunks unhighlighted.
+                chunk['meta']['syntax_highlighting_timed_out'] = True
+                self._record_highlighting_timeout(dest_file)
+                source_file = dest_file = None
+                continue
+            except:
+                continue
+
+            for markup_index, markup in all_markup:
+                if markup and len(markup) == len(lines):
+                    for line, line_markup in zip(lines, markup):
+                        line[markup_index] = mark_safe(line_markup)
+
+    def _start_highlighting_timer(self):
+        """Starts the time limit for syntax highlighting a file.
+
+        The limit comes from the ``diffviewer_syntax_highlighting_timeout``
+        setting, and covers everything highlighted until this is next
+        called.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+        timeout = siteconfig.get('diffviewer_syntax_highlighting_timeout')
+
+        if timeout:
+            self._highlighting_deadline = time.time() + timeout
+        else:
+            self._highlighting_deadline = None
+
+    def _record_highlighting_timeout(self, filename):
+        """Records that syntax highlighting took too long for the file.
+
+        The FileDiff is flagged, so that later attempts to highlight it are
+        skipped, and the timeout is counted for the file's type.
+        """
+        logging.warning('Syntax highlighting for FileDiff %s (%s) took too '
+                        'long. Falling back to plain text.',
+                        self.filediff.pk, filename)
+
+        self._highlighting_timed_out = True
+        record_syntax_highlighting_timeout(filename)
+
+        if self.filediff.pk:
+            self.filediff.extra_data['syntax_highlighting_timed_out'] = True
+            self.filediff.save(update_fields=['extra_data'])
+
+    def _get_display_filenames(self):
+        """Returns the source and destination filenames for highlighting."""
+        tool = self.diffset.repository.get_scmtool()
+
+        return (tool.normalize_path_for_display(self.filediff.source_file),
+                tool.normalize_path_for_display(self.filediff.dest_file))
+
+    def _get_equal_segments(self, num_lines, is_first, is_last,
+                            context_num_lines):
+        """Returns how a large equal region is split into chunks.
+
+        This returns a list of ``(start, end, collapsable)`` tuples, with
+        line offsets relative to the start of the region. The lines of
+        context next to changes are kept in their own chunks, and the rest
+        are collapsable.
+        """
+        last_range_start = num_lines - context_num_lines
+
+        if is_first:
+            return [
+                (0, last_range_start, True),
+                (last_range_start, num_lines, False),
+            ]
+        elif is_last:
+            return [
+                (0, context_num_lines, False),
+                (context_num_lines, num_lines, True),
+            ]
+        else:
+            return [
+                (0, context_num_lines, False),
+                (context_num_lines, last_range_start, True),
+                (last_range_start, num_lines, False),
+            ]
+
+    def _get_shown_line_ranges(self, opcodes, a_num_lines, b_num_lines,
+                               context_num_lines, collapse_threshold):
+        """Returns the ranges of lines that will be shown uncollapsed.
+
+        This returns a list of ``(start, end)`` line index ranges for each
+        of the original and modified files. These cover the changed lines
+        and their context, along with any equal regions too small to be
+        collapsed.
+        """
+        a_ranges = []
+        b_ranges = []
+
+        def _add_range(ranges, start, end):
+            if start == end:
+                return
+            elif ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+
+        for tag, i1, i2, j1, j2, meta in opcodes:
+            num_lines = max(i2 - i1, j2 - j1)
+
+            if (tag == 'equal' and num_lines > collapse_threshold and
+                    not meta.get('indentation_changes')):
+                segments = self._get_equal_segments(
+                    num_lines, i1 == 0 and j1 == 0,
+                    i2 == a_num_lines and j2 == b_num_lines,
+                    context_num_lines)
+
+                for start, end, collapsable in segments:
+                    if not collapsable:
+                        _add_range(a_ranges, i1 + start, i1 + end)
+                        _add_range(b_ranges, j1 + start, j1 + end)
+            else:
+                _add_range(a_ranges, i1, i2)
+                _add_range(b_ranges, j1, j2)
+
+        return a_ranges, b_ranges
+
     def _get_enable_syntax_highlighting(self, old, new, a, b):
         """Returns whether or not we'll be enabling syntax highlighting.
 
@@ -310,11 +904,16 @@ class DiffChunkGenerator(object):
         enough to render with syntax highlighting on.
 
         The heuristics take into account the size of the files in bytes and
-        the number of lines.
+        the number of lines, and whether highlighting the file has timed out
+        before.
         """
         if not self.enable_syntax_highlighting:
             return False
 
+        if self.filediff.extra_data.get('syntax_highlighting_timed_out'):
+            self._highlighting_timed_out = True
+            return False
+
         siteconfig = SiteConfiguration.objects.get_current()
         threshold = siteconfig.get('diffviewer_syntax_highlighting_threshold')
 
@@ -351,8 +950,16 @@ class DiffChunkGenerator(object):
                 len(old_line) <= self.STYLED_MAX_LINE_LEN and
                 len(new_line) <= self.STYLED_MAX_LINE_LEN and
                 old_line != new_line):
-            old_region, new_region = \
-                get_line_changed_regions(old_line, new_line)
+            # The same pair of lines often shows up more than once in a
+            # file, such as when a name is changed throughout it.
+            key = (old_line, new_line)
+
+            try:
+                old_region, new_region = self._changed_regions[key]
+            except KeyError:
+                old_region, new_region = \
+                    get_line_changed_regions(old_line, new_line)
+                self._changed_regions[key] = (old_region, new_region)
         else:
             old_region = new_region = []
 
@@ -536,6 +1143,12 @@ class DiffChunkGenerator(object):
         meta['left_headers'] = left_headers
         meta['right_headers'] = right_headers
 
+        if self.differ.strategy:
+            meta['diff_strategy'] = self.differ.strategy
+
+        if self._highlighting_timed_out:
+            meta['syntax_highlighting_timed_out'] = True
+
         lines = all_lines[start:end]
         num_lines = len(lines)
 
@@ -600,14 +1213,70 @@ class DiffChunkGenerator(object):
     def _apply_pygments(self, data, filename):
         """Applies Pygments syntax-highlighting to a file's contents.
 
-        The resulting HTML will be returned as a list of lines.
+        The resulting HTML will be returned as a list of lines. If there's
+        no lexer for the file, this returns None.
         """
-        lexer = get_lexer_for_filename(filename,
-                                       stripnl=False,
-                                       encoding='utf-8')
-        lexer.add_filter('codetagify')
+        lexer = get_lexer_for_file(filename)
+
+        if lexer is None:
+            return None
+
+        return self._highlight(data, lexer).splitlines()
+
+    def _apply_pygments_to_ranges(self, lines, filename, ranges):
+        """Applies Pygments syntax-highlighting to ranges of a file's lines.
+
+        Each ``(start, end)`` range of lines is highlighted separately, and
+        the rest of the lines are only escaped. The resulting HTML will be
+        returned as a list of lines. If there's no lexer for the file, this
+        returns None.
+        """
+        lexer = get_lexer_for_file(filename)
+
+        if lexer is None:
+            return None
+
+        markup = [escape(line) for line in lines]
+
+        for start, end in ranges:
+            range_markup = self._highlight(
+                ''.join('%s\n' % line for line in lines[start:end]),
+                lexer).splitlines()
+
+            if len(range_markup) == end - start:
+                markup[start:end] = range_markup
+
+        return markup
+
+    def _highlight(self, data, lexer):
+        """Highlights text, within the time limit for the file.
+
+        The time limit is checked as the lexer produces tokens, raising
+        SyntaxHighlightingTimeoutError once it's been reached. A single
+        token that takes a very long time to lex can still go over the
+        limit.
+        """
+        deadline = self._highlighting_deadline
+
+        if deadline is None:
+            return highlight(data, lexer, _formatter)
+
+        def _iter_tokens():
+            for i, token in enumerate(lexer.get_tokens(data)):
+                if (i % self.HIGHLIGHTING_TIMEOUT_CHECK_INTERVAL == 0 and
+                        time.time() > deadline):
+                    raise SyntaxHighlightingTimeoutError
+
+                yield token
+
+        return format_tokens(_iter_tokens(), _formatter)
+
+    def _unescape(self, markup):
+        """Reverses the escaping done to unhighlighted lines."""
+        for escaped, c in self.ESCAPED_CHARS:
+            markup = markup.replace(escaped, c)
 
-        return highlight(data, lexer, NoWrapperHtmlFormatter()).splitlines()
+        return markup
 
 
 def compute_chunk_last_header(lines, numlines, meta, last_header=None):
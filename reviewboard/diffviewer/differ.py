@@ -20,13 +20,22 @@ class DiffCompatVersion(object):
     # (prevents very long diff times for certain files)
     MYERS_SMS_COST_BAIL = 2
 
+    # Histogram differ, falling back on the Myers differ with bailing on a
+    # too high SMS cost. This is opt-in per repository.
+    HISTOGRAM = 3
+
     DEFAULT = MYERS_SMS_COST_BAIL
 
     MYERS_VERSIONS = (MYERS, MYERS_SMS_COST_BAIL)
 
 
 class Differ(object):
-    """Base class for differs."""
+    """Base class for differs.
+
+    Differs that can compute a diff in more than one way will set
+    ``strategy`` to the name of the approach used once the opcodes have
+    been generated.
+    """
     def __init__(self, a, b, ignore_space=False, compat_version=None):
         if type(a) is not type(b):
             raise TypeError
@@ -35,6 +44,7 @@ class Differ(object):
         self.b = b
         self.ignore_space = ignore_space
         self.compat_version = compat_version
+        self.strategy = None
         self.interesting_line_regexes = []
         self.interesting_lines = [{}, {}]
 
@@ -85,18 +95,33 @@ class Differ(object):
 
 
 def get_differ(a, b, ignore_space=False,
-               compat_version=DiffCompatVersion.DEFAULT):
+               compat_version=DiffCompatVersion.DEFAULT, cost_budget=None,
+               search_ranges=None):
     """Returns a differ for with the given settings.
 
     By default, this will return the MyersDiffer. Older differs can be used
     by specifying a compat_version, but this is only for *really* ancient
-    diffs, currently.
+    diffs, currently. DiffCompatVersion.HISTOGRAM will return the
+    HistogramDiffer.
+
+    If provided, ``cost_budget`` caps the amount of work the MyersDiffer
+    or HistogramDiffer will do before falling back on a cheaper diff, and
+    ``search_ranges`` limits which lines they search for changes (see
+    :py:class:`reviewboard.diffviewer.myersdiff.MyersDiffer`).
     """
     cls = None
+    kwargs = {}
 
     if compat_version in DiffCompatVersion.MYERS_VERSIONS:
         from reviewboard.diffviewer.myersdiff import MyersDiffer
         cls = MyersDiffer
+        kwargs['cost_budget'] = cost_budget
+        kwargs['search_ranges'] = search_ranges
+    elif compat_version == DiffCompatVersion.HISTOGRAM:
+        from reviewboard.diffviewer.histogramdiff import HistogramDiffer
+        cls = HistogramDiffer
+        kwargs['cost_budget'] = cost_budget
+        kwargs['search_ranges'] = search_ranges
     elif compat_version == DiffCompatVersion.SMDIFFER:
         from reviewboard.diffviewer.smdiff import SMDiffer
         cls = SMDiffer
@@ -105,4 +130,4 @@ def get_differ(a, b, ignore_space=False,
             'Invalid diff compatibility version (%s) passed to Differ' %
             compat_version)
 
-    return cls(a, b, ignore_space, compat_version=compat_version)
+    return cls(a, b, ignore_space, compat_version=compat_version, **kwargs)
@@ -1,19 +1,30 @@
 from __future__ import unicode_literals
 
+import bisect
+import logging
 import os
 import re
 import subprocess
+import sys
 import tempfile
+import threading
+import traceback
 from difflib import SequenceMatcher
 
-from django.utils import six
-from django.utils.translation import ugettext as _
+from django.db import connection
+from django.utils import six, translation
+from django.utils.six.moves import queue, range, zip
+from django.utils.translation import get_language, ugettext as _
 from djblets.log import log_timed
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.contextmanagers import controlled_subprocess
 
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
+from reviewboard.diffviewer.differ import DiffCompatVersion
+from reviewboard.diffviewer.errors import UserVisibleError
+from reviewboard.diffviewer.filecache import (get_patched_file_cache,
+                                              hash_file_contents)
 from reviewboard.scmtools.core import PRE_CREATION, HEAD
 
 
@@ -22,6 +33,17 @@ NEWLINE_CONVERSION_RE = re.compile(r'\r(\r?\n)?')
 ALPHANUM_RE = re.compile(r'\w')
 WHITESPACE_RE = re.compile(r'\s')
 
+# Tokens compared when finding changed regions in a line: runs of word
+# characters, runs of whitespace, and single punctuation characters.
+LINE_TOKEN_RE = re.compile(r'\w+|\s+|[^\w\s]', re.UNICODE)
+
+# The minimum similarity two lines need for their changed regions to be
+# shown.
+LINE_CHANGED_REGIONS_MIN_RATIO = 0.6
+
+UNIFIED_HUNK_RE = re.compile(
+    br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
 
 def convert_to_unicode(s, encoding_list):
     """Returns the passed string as a unicode object.
@@ -88,10 +110,263 @@ def convert_line_endings(data):
     return NEWLINE_CONVERSION_RE.sub('\n', data)
 
 
+class PatchHunk(object):
+    """A hunk parsed out of a unified diff.
+
+    This stores the lines a hunk expects to find in the original file
+    (context and removed lines) and the lines it will produce in the patched
+    file (context and inserted lines), along with the number of leading and
+    trailing lines of context, which govern where the hunk may be applied.
+    """
+    def __init__(self, orig_start, orig_len, new_start, new_len):
+        self.orig_start = orig_start
+        self.orig_len = orig_len
+        self.new_start = new_start
+        self.new_len = new_len
+        self.orig_lines = []
+        self.new_lines = []
+        self.prefix_context = 0
+        self.suffix_context = 0
+
+
+def split_lines(data):
+    """Splits data into a list of lines, keeping the newlines.
+
+    Unlike str.splitlines, this only splits on "\n", which is what patch
+    does once line endings have been normalized.
+    """
+    lines = [
+        line + b'\n'
+        for line in data.split(b'\n')
+    ]
+
+    # The last entry never really had a newline. Either drop it, if the
+    # data ended with a newline, or strip the newline we added.
+    last_line = lines.pop()[:-1]
+
+    if last_line:
+        lines.append(last_line)
+
+    return lines
+
+
+def parse_unified_hunks(diff):
+    """Parses the hunks out of a unified diff for a single file.
+
+    Anything before the first hunk (such as the file headers) is skipped.
+
+    This returns a list of PatchHunk instances, or None if the diff isn't a
+    unified diff we can reliably understand (in which case the caller
+    should fall back on running `patch`).
+    """
+    lines = split_lines(diff)
+    num_lines = len(lines)
+    hunks = []
+    i = 0
+
+    while i < num_lines:
+        m = UNIFIED_HUNK_RE.match(lines[i])
+        i += 1
+
+        if not m:
+            if hunks:
+                # There's unexpected content after the hunks. We don't know
+                # how patch would treat it, so let it decide.
+                return None
+
+            continue
+
+        orig_len = m.group(2)
+        new_len = m.group(4)
+        hunk = PatchHunk(orig_start=int(m.group(1)),
+                         orig_len=int(orig_len or 1),
+                         new_start=int(m.group(3)),
+                         new_len=int(new_len or 1))
+        orig_left = hunk.orig_len
+        new_left = hunk.new_len
+        line_type = None
+        seen_change = False
+
+        while orig_left > 0 or new_left > 0:
+            if i == num_lines:
+                # The diff was truncated.
+                return None
+
+            line = lines[i]
+            i += 1
+
+            if line.startswith(b'\\'):
+                _strip_hunk_newline(hunk, line_type)
+                continue
+
+            if line == b'\n':
+                # Some tools strip the trailing whitespace from a blank
+                # line of context. patch accepts these, so we do too.
+                line = b' \n'
+
+            line_type = line[:1]
+
+            if line_type == b' ':
+                hunk.orig_lines.append(line[1:])
+                hunk.new_lines.append(line[1:])
+                orig_left -= 1
+                new_left -= 1
+
+                if seen_change:
+                    hunk.suffix_context += 1
+                else:
+                    hunk.prefix_context += 1
+            elif line_type == b'-':
+                hunk.orig_lines.append(line[1:])
+                orig_left -= 1
+                seen_change = True
+                hunk.suffix_context = 0
+            elif line_type == b'+':
+                hunk.new_lines.append(line[1:])
+                new_left -= 1
+                seen_change = True
+                hunk.suffix_context = 0
+            else:
+                return None
+
+            if orig_left < 0 or new_left < 0:
+                return None
+
+        if i < num_lines and lines[i].startswith(b'\\'):
+            _strip_hunk_newline(hunk, line_type)
+            i += 1
+
+        hunks.append(hunk)
+
+    return hunks
+
+
+def _strip_hunk_newline(hunk, line_type):
+    """Handles a "No newline at end of file" marker in a hunk.
+
+    The marker applies to the line preceding it, which is the last line
+    added to the original and/or new lines, depending on its type.
+    """
+    if line_type in (b' ', b'-'):
+        hunk.orig_lines[-1] = hunk.orig_lines[-1][:-1]
+
+    if line_type in (b' ', b'+'):
+        hunk.new_lines[-1] = hunk.new_lines[-1][:-1]
+
+
+def apply_hunks(data, hunks):
+    """Applies a list of PatchHunks to a file's contents, in memory.
+
+    Like patch, hunks are allowed to apply at an offset from the line
+    numbers listed in the diff, and that offset carries over to subsequent
+    hunks. Hunks will not be applied with any fuzz, though.
+
+    This returns the patched data, or None if any hunk couldn't be applied
+    exactly.
+    """
+    lines = split_lines(data)
+    locations = _locate_hunks(lines, hunks)
+
+    if locations is None:
+        return None
+
+    result = []
+    pos = 0
+
+    for hunk, location in zip(hunks, locations):
+        result += lines[pos:location]
+        result += hunk.new_lines
+        pos = location + len(hunk.orig_lines)
+
+    result += lines[pos:]
+
+    return b''.join(result)
+
+
+def _locate_hunks(lines, hunks):
+    """Finds where each of a list of PatchHunks applies in a file's lines.
+
+    This returns a list of the line indexes (starting at 0) of the original
+    lines each hunk replaces, or None if any hunk couldn't be applied
+    exactly.
+    """
+    num_lines = len(lines)
+    locations = []
+    pos = 0
+    offset = 0
+
+    for hunk in hunks:
+        num_hunk_lines = len(hunk.orig_lines)
+
+        if hunk.orig_len == 0:
+            # Pure insertions reference the line they go after.
+            expected = hunk.orig_start
+        else:
+            expected = hunk.orig_start - 1
+
+        if (hunk.prefix_context < hunk.suffix_context and
+            hunk.orig_start <= 1):
+            # Without fuzz, patch only allows a hunk claiming to be at the
+            # start of the file, with less leading context than trailing
+            # context, to apply at the start of the file. Elsewhere, it's
+            # searched for like any other hunk.
+            candidates = [0]
+        elif hunk.prefix_context > hunk.suffix_context:
+            # A hunk with less trailing context than leading context only
+            # applies at the end of the file without fuzz.
+            candidates = [num_lines - num_hunk_lines]
+        else:
+            candidates = _iter_hunk_locations(expected + offset, pos,
+                                              num_lines - num_hunk_lines)
+
+        for location in candidates:
+            if (pos <= location <= num_lines - num_hunk_lines and
+                lines[location:location + num_hunk_lines] ==
+                    hunk.orig_lines):
+                break
+        else:
+            return None
+
+        if (hunk.new_lines and not hunk.new_lines[-1].endswith(b'\n') and
+            location + num_hunk_lines < num_lines):
+            # The hunk thinks it's at the end of the file, but it isn't.
+            # patch has its own ideas on how to handle that.
+            return None
+
+        offset = location - expected
+        locations.append(location)
+        pos = location + num_hunk_lines
+
+    return locations
+
+
+def _iter_hunk_locations(first_guess, min_location, max_location):
+    """Yields the locations a hunk may be applied at, in order of preference.
+
+    This mirrors patch's search order, which checks the expected location
+    first, and then alternates looking after and before it, moving further
+    out each time.
+    """
+    if min_location <= first_guess <= max_location:
+        yield first_guess
+
+    for i in range(1, max(max_location - first_guess,
+                          first_guess - min_location) + 1):
+        if first_guess + i <= max_location:
+            yield first_guess + i
+
+        if first_guess - i >= min_location:
+            yield first_guess - i
+
+
 def patch(diff, file, filename, request=None):
-    """Apply a diff to a file.  Delegates out to `patch` because noone
-       except Larry Wall knows how to patch."""
+    """Apply a diff to a file.
 
+    Unified diffs that apply cleanly (possibly at an offset) are applied in
+    memory. Anything else, such as hunks needing fuzz or diff formats we
+    don't parse, delegates out to `patch` because noone except Larry Wall
+    knows how to patch.
+    """
     log_timer = log_timed("Patching file %s" % filename,
                           request=request)
 
@@ -99,16 +374,50 @@ def patch(diff, file, filename, request=None):
         # Someone uploaded an unchanged file. Return the one we're patching.
         return file
 
+    file = convert_line_endings(file)
+    diff = convert_line_endings(diff)
+
+    data = patch_in_memory(diff, file)
+
+    if data is None:
+        try:
+            data = patch_with_subprocess(diff, file, filename)
+        finally:
+            log_timer.done()
+    else:
+        log_timer.done()
+
+    return data
+
+
+def patch_in_memory(diff, file):
+    """Applies a diff to a file without calling out to `patch`.
+
+    The diff and file are expected to have normalized line endings.
+
+    This returns None if the diff can't be applied exactly.
+    """
+    hunks = parse_unified_hunks(diff)
+
+    if not hunks:
+        return None
+
+    return apply_hunks(file, hunks)
+
+
+def patch_with_subprocess(diff, file, filename):
+    """Applies a diff to a file using the `patch` command.
+
+    The diff and file are expected to have normalized line endings.
+    """
     # Prepare the temporary directory if none is available
     tempdir = tempfile.mkdtemp(prefix='reviewboard.')
 
     (fd, oldfile) = tempfile.mkstemp(dir=tempdir)
     f = os.fdopen(fd, "w+b")
-    f.write(convert_line_endings(file))
+    f.write(file)
     f.close()
 
-    diff = convert_line_endings(diff)
-
     newfile = '%s-new' % oldfile
 
     process = subprocess.Popen(['patch', '-o', newfile, oldfile],
@@ -124,8 +433,6 @@ def patch(diff, file, filename, request=None):
         with open("%s.diff" % absolute_path, 'w') as f:
             f.write(diff)
 
-        log_timer.done()
-
         # FIXME: This doesn't provide any useful error report on why the patch
         # failed to apply, which makes it hard to debug.  We might also want to
         # have it clean up if DEBUG=False
@@ -147,8 +454,6 @@ def patch(diff, file, filename, request=None):
     os.unlink(newfile)
     os.rmdir(tempdir)
 
-    log_timer.done()
-
     return data
 
 
@@ -157,6 +462,11 @@ def get_original_file(filediff, request, encoding_list):
     Get a file either from the cache or the SCM, applying the parent diff if
     it exists.
 
+    The normalized (and parent-patched) file is stored in the patched file
+    cache, keyed off the file's contents, the parent diff and the encodings
+    used to normalize it, so the work is only done once for any FileDiffs
+    sharing the same original file.
+
     SCM exceptions are passed back to the caller.
     """
     data = b""
@@ -169,19 +479,33 @@ def get_original_file(filediff, request, encoding_list):
             base_commit_id=filediff.diffset.base_commit_id,
             request=request)
 
+    def _get_original_file():
+        return _normalize_original_file(filediff, data, request,
+                                        encoding_list)
+
+    if filediff.parent_diff64 and not filediff.parent_diff_hash_id:
+        # The parent diff hasn't been migrated to a FileDiffData, so we
+        # have nothing stable to key off of.
+        return _get_original_file()
+
+    file_cache = get_patched_file_cache()
+
+    return file_cache.get(
+        file_cache.make_key(hash_file_contents(data),
+                            parent_diff_hash=filediff.parent_diff_hash_id,
+                            encodings=encoding_list),
+        _get_original_file)
+
+
+def _normalize_original_file(filediff, data, request, encoding_list):
+    """Normalizes a file from the SCM and applies the parent diff to it."""
+    if filediff.source_revision != PRE_CREATION:
         # Convert to unicode before we do anything to manipulate the string.
         encoding, data = convert_to_unicode(data, encoding_list)
 
         # Repository.get_file doesn't know or care about how we need line
-        # endings to work. So, we'll just transform every time.
-        #
-        # This is mostly only a problem if the diff chunks aren't in the
-        # cache, though if several people are working off the same file,
-        # we'll be doing extra work to convert those line endings for each
-        # of those instead of once.
-        #
-        # Only other option is to cache the resulting file, but then we're
-        # duplicating the cached contents.
+        # endings to work. So, we'll just transform every time. The result
+        # is cached by the caller.
         data = convert_line_endings(data)
 
         # Convert back to bytes using whichever encoding we used to decode.
@@ -196,10 +520,120 @@ def get_original_file(filediff, request, encoding_list):
 
 
 def get_patched_file(buffer, filediff, request):
-    tool = filediff.diffset.repository.get_scmtool()
-    diff = tool.normalize_patch(filediff.diff, filediff.source_file,
-                                filediff.source_revision)
-    return patch(diff, buffer, filediff.dest_file, request)
+    """Returns the result of applying a FileDiff's diff to a buffer.
+
+    The patched file is stored in the patched file cache, keyed off the
+    contents of the buffer and the diff, so the work is only done once for
+    any FileDiffs sharing the same diff and original file.
+    """
+    def _get_patched_file():
+        tool = filediff.diffset.repository.get_scmtool()
+        diff = tool.normalize_patch(filediff.diff, filediff.source_file,
+                                    filediff.source_revision)
+        return patch(diff, buffer, filediff.dest_file, request)
+
+    if not filediff.diff_hash_id:
+        # The diff hasn't been migrated to a FileDiffData yet, so we have
+        # nothing stable to key off of.
+        return _get_patched_file()
+
+    file_cache = get_patched_file_cache()
+
+    return file_cache.get(
+        file_cache.make_key(hash_file_contents(buffer),
+                            diff_hash=filediff.diff_hash_id),
+        _get_patched_file)
+
+
+def filediffs_share_original(filediff, interfilediff):
+    """Returns whether two FileDiffs apply to the same original file.
+
+    This is the case when both FileDiffs have the same source file and
+    revision in the same repository, and the same parent diff. The
+    original file for one can then be used for the other.
+    """
+    diffset = filediff.diffset
+    interdiffset = interfilediff.diffset
+
+    if (diffset.repository_id != interdiffset.repository_id or
+        diffset.base_commit_id != interdiffset.base_commit_id or
+        filediff.source_file != interfilediff.source_file or
+        filediff.source_revision != interfilediff.source_revision):
+        return False
+
+    if filediff.parent_diff_hash_id or interfilediff.parent_diff_hash_id:
+        return (filediff.parent_diff_hash_id ==
+                interfilediff.parent_diff_hash_id)
+
+    # Neither parent diff (if any) has been migrated to a FileDiffData, so
+    # we have to compare the contents.
+    return filediff.parent_diff == interfilediff.parent_diff
+
+
+def get_interdiff_search_ranges(orig, filediff, interfilediff):
+    """Returns the ranges of lines that may differ in an interdiff.
+
+    ``orig`` is the original file (as returned by get_original_file) that
+    both FileDiffs apply to. Any line of the original file that neither
+    diff touches appears in both patched files, so only the regions
+    covered by the hunks of either diff need to be diffed.
+
+    This returns a list of ``(a_lower, a_upper, b_lower, b_upper)`` line
+    ranges in the files patched by ``filediff`` and ``interfilediff``,
+    suitable for passing to get_differ as ``search_ranges``. If either diff
+    can't be applied in memory, this returns None.
+    """
+    lines = split_lines(orig)
+    regions = []
+
+    for side, cur_filediff in enumerate((filediff, interfilediff)):
+        tool = cur_filediff.diffset.repository.get_scmtool()
+        diff = convert_line_endings(
+            tool.normalize_patch(cur_filediff.diff,
+                                 cur_filediff.source_file,
+                                 cur_filediff.source_revision))
+
+        if diff.strip() == b'':
+            # The file is unchanged in this revision.
+            continue
+
+        hunks = parse_unified_hunks(diff)
+
+        if not hunks:
+            return None
+
+        locations = _locate_hunks(lines, hunks)
+
+        if locations is None:
+            return None
+
+        for hunk, location in zip(hunks, locations):
+            num_orig_lines = len(hunk.orig_lines)
+            regions.append((location, location + num_orig_lines, side,
+                            len(hunk.new_lines) - num_orig_lines))
+
+    regions.sort()
+
+    # Merge the overlapping regions from both diffs, keeping track of how
+    # far each diff has shifted the lines of the original file.
+    offsets = [0, 0]
+    search_ranges = []
+    i = 0
+
+    while i < len(regions):
+        start, end = regions[i][:2]
+        a_lower = start + offsets[0]
+        b_lower = start + offsets[1]
+
+        while i < len(regions) and regions[i][0] <= end:
+            end = max(end, regions[i][1])
+            offsets[regions[i][2]] += regions[i][3]
+            i += 1
+
+        search_ranges.append((a_lower, end + offsets[0],
+                              b_lower, end + offsets[1]))
+
+    return search_ranges
 
 
 def get_revision_str(revision):
@@ -353,47 +787,308 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
     return get_sorted_filediffs(files, key=lambda f: f['filediff'])
 
 
+def _prefetch_original_files(files, request):
+    """Fetches the original versions of the files in a diff in bulk.
+
+    This fetches all the original files needed to generate chunks for the
+    given files (as returned by get_diff_files) through
+    Repository.get_files, which checks the cache for all of them at once
+    and fetches any that aren't cached together. Once fetched,
+    get_original_file will find them in the cache.
+
+    Errors are ignored here. They'll be reported when generating the chunks.
+    """
+    files_by_repository = {}
+
+    for f in files:
+        for filediff in (f['filediff'], f['interfilediff']):
+            if filediff and filediff.source_revision != PRE_CREATION:
+                diffset = filediff.diffset
+                files_by_repository.setdefault(diffset.repository, set()).add(
+                    (filediff.source_file, filediff.source_revision,
+                     diffset.base_commit_id))
+
+    for repository, repository_files in six.iteritems(files_by_repository):
+        try:
+            repository.get_files(list(repository_files), request=request)
+        except Exception as e:
+            logging.warning('Unable to prefetch original files for '
+                            'repository %s: %s',
+                            repository.pk, e, exc_info=1)
+
+
 def populate_diff_chunks(files, enable_syntax_highlighting=True,
-                         request=None):
+                         request=None, max_workers=None,
+                         highlight_collapsed=False):
     """Populates a list of diff files with chunk data.
 
     This accepts a list of files (generated by get_diff_files) and generates
     diff chunk data for each file in the list. The chunk data is stored in
     the file state.
+
+    The original files needed for any files whose chunks aren't already
+    cached are fetched from the repository together, before any chunks are
+    generated.
+
+    If ``highlight_collapsed`` is True, collapsed chunks that haven't been
+    syntax-highlighted yet (see
+    DiffChunkGenerator.highlight_pending_chunks) will be highlighted. This
+    should be used when the chunks will be shown expanded.
+
+    If ``max_workers`` (which defaults to the
+    ``diffviewer_chunk_generation_workers`` setting) is greater than 1,
+    the chunks for the files will be generated in parallel by a pool of up
+    to that many threads. The files are still populated in order.
+
+    An error generating one file won't stop the others from being generated.
+    The error is logged and recorded in that file's state as ``error`` (the
+    exception) and ``trace`` (the formatted traceback, if the error isn't a
+    UserVisibleError), and the file is left with no chunks.
     """
     from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
 
-    for diff_file in files:
-        generator = get_diff_chunk_generator(request,
-                                             diff_file['filediff'],
-                                             diff_file['interfilediff'],
-                                             diff_file['force_interdiff'],
-                                             enable_syntax_highlighting)
-        chunks = generator.get_chunks()
+    if max_workers is None:
+        siteconfig = SiteConfiguration.objects.get_current()
+        max_workers = siteconfig.get('diffviewer_chunk_generation_workers')
+
+    generators = [
+        get_diff_chunk_generator(request,
+                                 diff_file['filediff'],
+                                 diff_file['interfilediff'],
+                                 diff_file['force_interdiff'],
+                                 enable_syntax_highlighting)
+        for diff_file in files
+    ]
+
+    # Fetch the original files for everything that has to be generated
+    # together, rather than one at a time as each file is generated.
+    _prefetch_original_files(
+        [
+            diff_file
+            for diff_file, generator in zip(files, generators)
+            if not generator.is_cached()
+        ],
+        request)
+
+    def _get_chunks(generator):
+        try:
+            chunks = generator.get_chunks()
+
+            if highlight_collapsed:
+                generator.highlight_pending_chunks(chunks)
+
+            return chunks, None, None
+        except Exception as e:
+            logging.error('Unable to generate diff chunks for filediff '
+                          '%s: %s',
+                          generator.filediff.pk, e, exc_info=1)
+
+            if isinstance(e, UserVisibleError):
+                trace = None
+            else:
+                trace = traceback.format_exc()
+
+            return [], e, trace
+
+    if max_workers > 1 and len(files) > 1:
+        all_chunks = _run_in_thread_pool(_get_chunks, generators,
+                                         max_workers)
+    else:
+        all_chunks = (_get_chunks(generator) for generator in generators)
 
+    for diff_file, (chunks, error, trace) in zip(files, all_chunks):
         diff_file.update({
             'chunks': chunks,
             'num_chunks': len(chunks),
             'changed_chunk_indexes': [],
-            'whitespace_only': True,
+            'whitespace_only': error is None,
         })
 
-        for j, chunk in enumerate(chunks):
-            chunk['index'] = j
-
-            if chunk['change'] != 'equal':
-                diff_file['changed_chunk_indexes'].append(j)
-                meta = chunk.get('meta', {})
+        if error is not None:
+            diff_file.update({
+                'error': error,
+                'trace': trace,
+            })
 
-                if not meta.get('whitespace_chunk', False):
-                    diff_file['whitespace_only'] = False
+        for j, chunk in enumerate(chunks):
+            _add_chunk_to_diff_file(diff_file, j, chunk)
 
         diff_file.update({
             'num_changes': len(diff_file['changed_chunk_indexes']),
-            'chunks_loaded': True,
+            'chunks_loaded': error is None,
         })
 
 
+def populate_diff_file_chunks(diff_file, chunk_indexes,
+                              enable_syntax_highlighting=True, request=None):
+    """Populates a diff file with only some of its chunks.
+
+    This accepts a file (generated by get_diff_files) and a list of chunk
+    indexes, and loads only those chunks, leaving the rest of the file's
+    chunks in the cache. Any indexes that are out of range are ignored.
+
+    The rest of the file state (the chunk counts, the changed chunk indexes
+    and ``whitespace_only``) covers all the chunks in the file, the same as
+    populate_diff_chunks. ``chunks`` will only contain the requested chunks,
+    each of which will have its ``index`` set.
+
+    The requested chunks are meant to be shown expanded, so any of them that
+    haven't been syntax-highlighted yet will be highlighted.
+    """
+    from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
+
+    generator = get_diff_chunk_generator(request,
+                                         diff_file['filediff'],
+                                         diff_file['interfilediff'],
+                                         diff_file['force_interdiff'],
+                                         enable_syntax_highlighting)
+    summaries = generator.get_chunk_summaries()
+
+    diff_file.update({
+        'num_chunks': len(summaries),
+        'changed_chunk_indexes': [],
+        'whitespace_only': True,
+    })
+
+    for i, summary in enumerate(summaries):
+        _record_chunk_change(diff_file, i, summary['change'],
+                             summary['whitespace_chunk'])
+
+    chunk_indexes = sorted(set(
+        i
+        for i in chunk_indexes
+        if 0 <= i < len(summaries)
+    ))
+    chunks = generator.get_chunks_by_index(chunk_indexes)
+    generator.highlight_pending_chunks(chunks)
+
+    for i, chunk in zip(chunk_indexes, chunks):
+        chunk['index'] = i
+
+    diff_file.update({
+        'chunks': chunks,
+        'num_changes': len(diff_file['changed_chunk_indexes']),
+        'chunks_loaded': True,
+    })
+
+
+def iter_diff_chunks(diff_file, enable_syntax_highlighting=True,
+                     request=None, highlight_collapsed=False):
+    """Yields the chunks for a diff file as they're generated.
+
+    This is a streaming version of populate_diff_chunks for a single file
+    (generated by get_diff_files). Each chunk is yielded as soon as it's
+    available, rather than once the whole file has been processed.
+
+    The file state is kept up to date as chunks are yielded, so the chunk
+    counts and ``whitespace_only`` reflect the chunks seen so far. Once the
+    last chunk has been yielded, the file state will contain the same
+    information populate_diff_chunks provides, aside from the list of
+    chunks itself. ``highlight_collapsed`` works the same as in
+    populate_diff_chunks.
+    """
+    from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
+
+    generator = get_diff_chunk_generator(request,
+                                         diff_file['filediff'],
+                                         diff_file['interfilediff'],
+                                         diff_file['force_interdiff'],
+                                         enable_syntax_highlighting)
+
+    diff_file.update({
+        'num_chunks': 0,
+        'changed_chunk_indexes': [],
+        'whitespace_only': True,
+    })
+
+    for i, chunk in enumerate(generator.iter_chunks()):
+        diff_file['num_chunks'] = i + 1
+        _add_chunk_to_diff_file(diff_file, i, chunk)
+
+        if highlight_collapsed:
+            generator.highlight_pending_chunks([chunk])
+
+        yield chunk
+
+    diff_file.update({
+        'num_changes': len(diff_file['changed_chunk_indexes']),
+        'chunks_loaded': True,
+    })
+
+
+def _add_chunk_to_diff_file(diff_file, index, chunk):
+    """Records information on a chunk in a diff file's state."""
+    chunk['index'] = index
+    _record_chunk_change(diff_file, index, chunk['change'],
+                         chunk.get('meta', {}).get('whitespace_chunk', False))
+
+
+def _record_chunk_change(diff_file, index, change, whitespace_chunk):
+    """Records a chunk's type of change in a diff file's state."""
+    if change != 'equal':
+        diff_file['changed_chunk_indexes'].append(index)
+
+        if not whitespace_chunk:
+            diff_file['whitespace_only'] = False
+
+
+def _run_in_thread_pool(func, items, max_workers):
+    """Calls a function for each item using a pool of threads.
+
+    This returns a list of results in the same order as the items. If any
+    call raised an exception, the first one (in item order) is re-raised
+    once all items have been processed.
+
+    The calling thread's active language is used in each worker, so that
+    anything depending on it (such as cache keys) is consistent.
+    """
+    language = get_language()
+    results = [None] * len(items)
+    errors = [None] * len(items)
+    pending = queue.Queue()
+
+    for i in range(len(items)):
+        pending.put(i)
+
+    def _worker():
+        translation.activate(language)
+
+        try:
+            while True:
+                try:
+                    i = pending.get_nowait()
+                except queue.Empty:
+                    break
+
+                try:
+                    results[i] = func(items[i])
+                except Exception:
+                    errors[i] = sys.exc_info()
+        finally:
+            translation.deactivate()
+
+            # Each thread gets its own database connection, which would
+            # otherwise be left open after the thread exits.
+            connection.close()
+
+    threads = [
+        threading.Thread(target=_worker)
+        for i in range(min(max_workers, len(items)))
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    for exc_info in errors:
+        if exc_info:
+            six.reraise(*exc_info)
+
+    return results
+
+
 def get_file_chunks_in_range(context, filediff, interfilediff,
                              first_line, num_lines):
     """
@@ -432,14 +1127,26 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
       7        True if line consists of only whitespace changes
       ======== =============================================================
     """
-    def find_header(headers):
-        for header in reversed(headers):
-            if header[0] < first_line:
-                return {
-                    'line': header[0],
-                    'text': header[1],
-                }
+    for chunk in get_file_chunks_in_ranges(context, filediff, interfilediff,
+                                           [(first_line, num_lines)])[0]:
+        yield chunk
+
+
+def get_file_chunks_in_ranges(context, filediff, interfilediff, ranges):
+    """Returns the chunks within several ranges of lines in a file.
 
+    This works like get_file_chunks_in_range, but takes a list of
+    ``(first_line, num_lines)`` ranges, and returns a list containing the
+    list of chunks for each range, in the same order.
+
+    The chunks needed for all the ranges are loaded from the cache at once,
+    and the ranges are then sliced out of them in a single pass, in order
+    of their first lines. This makes it much cheaper to show many comments
+    on the same file.
+    """
+    from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
+
+    results = [[] for i in range(len(ranges))]
     interdiffset = None
 
     key = "_diff_files_%s_%s" % (filediff.diffset.id, filediff.id)
@@ -448,29 +1155,104 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
         key += "_%s" % (interfilediff.id)
         interdiffset = interfilediff.diffset
 
+    assert 'user' in context
+    request = context.get('request', None)
+
     if key in context:
         files = context[key]
     else:
-        assert 'user' in context
-
-        request = context.get('request', None)
         files = get_diff_files(filediff.diffset, filediff, interdiffset,
                                request=request)
-        populate_diff_chunks(files, get_enable_highlighting(context['user']),
-                             request=request)
         context[key] = files
 
-    if not files:
-        raise StopIteration
+    if not files or not ranges:
+        return results
 
     assert len(files) == 1
+    diff_file = files[0]
+
+    # Only the chunks covering the ranges of lines are loaded. The rest of
+    # the file is described by the chunk summaries.
+    generator = get_diff_chunk_generator(
+        request,
+        diff_file['filediff'],
+        diff_file['interfilediff'],
+        diff_file['force_interdiff'],
+        get_enable_highlighting(context['user']))
+    summaries = generator.get_chunk_summaries()
+
+    if not summaries:
+        return results
+
+    # The ranges are processed in order of their first lines, so that the
+    # chunks can be walked once, rather than once per range.
+    order = sorted(range(len(ranges)), key=lambda i: ranges[i][0])
+    chunk_first_lines = [summary['first_line'] for summary in summaries]
+    chunk_ranges = []
+    chunk_indexes = set()
+    start_index = 0
+
+    for i in order:
+        first_line, num_lines = ranges[i]
+        start_index = max(start_index,
+                          bisect.bisect_right(chunk_first_lines,
+                                              first_line) - 1, 0)
+        end_index = min(start_index + 1, len(summaries))
+        last_line = first_line + num_lines - 1
+
+        while (end_index < len(summaries) and
+               summaries[end_index]['first_line'] <= last_line):
+            end_index += 1
+
+        chunk_ranges.append((i, start_index, end_index))
+        chunk_indexes.update(range(start_index, end_index))
+
+    chunk_indexes = sorted(chunk_indexes)
+    loaded_chunks = generator.get_chunks_by_index(chunk_indexes)
+
+    # The lines in the ranges are shown, so any collapsed chunks left
+    # unhighlighted need to be highlighted now.
+    generator.highlight_pending_chunks(loaded_chunks)
+    chunks = dict(zip(chunk_indexes, loaded_chunks))
+
+    # Compute the last header seen at each of the chunks.
+    last_headers = []
     last_header = [None, None]
 
-    for chunk in files[0]['chunks']:
-        if ('headers' in chunk['meta'] and
-                (chunk['meta']['headers'][0] or chunk['meta']['headers'][1])):
-            last_header = chunk['meta']['headers']
+    for summary in summaries[:chunk_indexes[-1] + 1]:
+        headers = summary['headers']
+
+        if headers and (headers[0] or headers[1]):
+            last_header = headers
+
+        last_headers.append(last_header)
+
+    for i, start_index, end_index in chunk_ranges:
+        first_line, num_lines = ranges[i]
+        results[i] = list(_get_chunks_in_range(
+            [(chunks[j], last_headers[j])
+             for j in range(start_index, end_index)],
+            first_line, num_lines))
+
+    return results
+
+
+def _get_chunks_in_range(chunks, first_line, num_lines):
+    """Yields the parts of chunks within a range of lines.
+
+    This takes a list of ``(chunk, last_header)`` tuples, where
+    ``last_header`` is the last header seen at that chunk. The chunks
+    themselves are left unmodified.
+    """
+    def find_header(headers):
+        for header in reversed(headers):
+            if header[0] < first_line:
+                return {
+                    'line': header[0],
+                    'text': header[1],
+                }
 
+    for chunk, last_header in chunks:
         lines = chunk['lines']
 
         if lines[-1][0] >= first_line >= lines[0][0]:
@@ -485,7 +1267,7 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
                 'lines': chunk['lines'][start_index:last_index],
                 'numlines': last_index - start_index,
                 'change': chunk['change'],
-                'meta': chunk.get('meta', {}),
+                'meta': dict(chunk.get('meta', {})),
             }
 
             if 'left_headers' in chunk['meta']:
@@ -527,29 +1309,91 @@ def get_enable_highlighting(user):
             get_can_enable_syntax_highlighting())
 
 
+def get_diff_cost_budget(repository):
+    """Returns the diff cost budget for files in a repository.
+
+    This is the ``diffviewer_diff_cost_budget`` setting, unless it's been
+    overridden for the repository in the
+    ``diffviewer_repository_diff_cost_budgets`` setting, which maps
+    repository IDs to budgets. None is returned if there's no limit.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+    budgets = siteconfig.get('diffviewer_repository_diff_cost_budgets')
+
+    # Settings are stored as JSON, so the IDs are stored as strings.
+    if repository and six.text_type(repository.pk) in budgets:
+        budget = budgets[six.text_type(repository.pk)]
+    else:
+        budget = siteconfig.get('diffviewer_diff_cost_budget')
+
+    return budget or None
+
+
+def get_diff_compat_version(repository):
+    """Returns the diff compatibility version for new diffs in a repository.
+
+    Repositories whose IDs are listed in the
+    ``diffviewer_histogram_diff_repositories`` setting will use the histogram
+    differ. All others use the default differ.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+
+    # Settings are stored as JSON, so the IDs are stored as strings.
+    if (repository and
+        six.text_type(repository.pk) in
+        siteconfig.get('diffviewer_histogram_diff_repositories')):
+        return DiffCompatVersion.HISTOGRAM
+
+    return DiffCompatVersion.DEFAULT
+
+
 def get_line_changed_regions(oldline, newline):
-    """Returns regions of changes between two similar lines."""
+    """Returns regions of changes between two similar lines.
+
+    The lines are compared token by token (see LINE_TOKEN_RE), and then any
+    replaced tokens are compared character by character. This is much
+    faster than comparing the whole lines character by character, and
+    keeps changes aligned to whole words where possible.
+
+    If the lines are less similar than LINE_CHANGED_REGIONS_MIN_RATIO,
+    there are no regions to show, and (None, None) is returned. Lines that
+    can't possibly be similar enough are ruled out before comparing them.
+    """
     if oldline is None or newline is None:
         return None, None
 
-    # Use the SequenceMatcher directly. It seems to give us better results
-    # for this. We should investigate steps to move to the new differ.
-    differ = SequenceMatcher(None, oldline, newline)
-
     # This thresholds our results -- we don't want to show inter-line diffs
     # if most of the line has changed, unless those lines are very short.
-
+    #
     # FIXME: just a plain, linear threshold is pretty crummy here.  Short
     # changes in a short line get lost.  I haven't yet thought of a fancy
     # nonlinear test.
-    if differ.ratio() < 0.6:
+    min_matched = \
+        LINE_CHANGED_REGIONS_MIN_RATIO * (len(oldline) + len(newline)) / 2
+
+    # Every matched character is in both lines, so these are upper bounds on
+    # the number of characters that could be matched.
+    if min(len(oldline), len(newline)) < min_matched:
+        return None, None
+
+    max_matched = sum(
+        min(oldline.count(c), newline.count(c))
+        for c in set(oldline) & set(newline)
+    )
+
+    if max_matched < min_matched:
+        return None, None
+
+    opcodes, matched = _get_line_opcodes(oldline, newline)
+
+    if matched < min_matched:
         return None, None
 
     oldchanges = []
     newchanges = []
     back = (0, 0)
 
-    for tag, i1, i2, j1, j2 in differ.get_opcodes():
+    for tag, i1, i2, j1, j2 in opcodes:
         if tag == 'equal':
             if (i2 - i1 < 3) or (j2 - j1 < 3):
                 back = (j2 - j1, i2 - i1)
@@ -574,6 +1418,64 @@ def get_line_changed_regions(oldline, newline):
     return oldchanges, newchanges
 
 
+def _get_line_opcodes(oldline, newline):
+    """Returns character opcodes for the differences between two lines.
+
+    This returns a tuple of the opcodes (in the same form as
+    SequenceMatcher.get_opcodes) and the number of matched characters.
+    Adjacent equal ranges are merged.
+    """
+    old_tokens = LINE_TOKEN_RE.findall(oldline)
+    new_tokens = LINE_TOKEN_RE.findall(newline)
+    old_offsets = _get_token_offsets(old_tokens)
+    new_offsets = _get_token_offsets(new_tokens)
+
+    opcodes = []
+    matched = [0]
+
+    def _add_opcode(tag, i1, i2, j1, j2):
+        if tag == 'equal':
+            matched[0] += i2 - i1
+
+            if opcodes and opcodes[-1][0] == 'equal':
+                opcodes[-1] = ('equal', opcodes[-1][1], i2,
+                               opcodes[-1][3], j2)
+                return
+
+        opcodes.append((tag, i1, i2, j1, j2))
+
+    differ = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+
+    for tag, i1, i2, j1, j2 in differ.get_opcodes():
+        i1 = old_offsets[i1]
+        i2 = old_offsets[i2]
+        j1 = new_offsets[j1]
+        j2 = new_offsets[j2]
+
+        if tag == 'replace':
+            char_differ = SequenceMatcher(None, oldline[i1:i2],
+                                          newline[j1:j2])
+
+            for char_opcode in char_differ.get_opcodes():
+                _add_opcode(char_opcode[0],
+                            i1 + char_opcode[1], i1 + char_opcode[2],
+                            j1 + char_opcode[3], j1 + char_opcode[4])
+        else:
+            _add_opcode(tag, i1, i2, j1, j2)
+
+    return opcodes, matched[0]
+
+
+def _get_token_offsets(tokens):
+    """Returns the character offset of each token, and of the end."""
+    offsets = [0]
+
+    for token in tokens:
+        offsets.append(offsets[-1] + len(token))
+
+    return offsets
+
+
 def get_sorted_filediffs(filediffs, key=None):
     """Sorts a list of filediffs.
 
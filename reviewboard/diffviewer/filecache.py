@@ -0,0 +1,197 @@
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.utils import six
+from djblets.cache.backend import cache_memoize, make_cache_key
+from djblets.siteconfig.models import SiteConfiguration
+
+
+class PatchedFileCache(object):
+    """A content-addressed cache of original and patched file contents.
+
+    Files are keyed by the SHA1 of the file fetched from the repository,
+    along with the hashes of the FileDiffData for the diff and parent diff
+    applied to it, and the encodings used to normalize it. That means a file that's identical across diff revisions
+    or interdiffs is only normalized and patched once, regardless of which
+    FileDiff asked for it.
+
+    There are two levels to the cache. Recently-used files are kept in
+    memory in the process, up to the size configured in the
+    ``diffviewer_patched_file_cache_size`` setting, with the least
+    recently-used files evicted first. Everything is also stored in the
+    main cache backend, so that other processes can make use of it.
+
+    Hit, miss and eviction counts are recorded in the main cache backend,
+    so that they cover all processes serving the site. They're counted in
+    the process first, and added to the main cache backend at most every
+    ``STATS_FLUSH_INTERVAL`` seconds, so that lookups don't each cost a
+    round trip.
+    """
+    STATS_KEYS = ('hits', 'shared_hits', 'misses', 'evictions')
+    STATS_FLUSH_INTERVAL = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._pending_stats = {}
+        self._last_stats_flush = time.time()
+
+    def make_key(self, source_hash, diff_hash=None, parent_diff_hash=None,
+                 encodings=None):
+        """Returns a key for the given content hashes and encodings."""
+        return 'patched-file:%s:%s:%s:%s' % (source_hash,
+                                             diff_hash or '',
+                                             parent_diff_hash or '',
+                                             ','.join(encodings or []))
+
+    def get(self, key, lookup_callable):
+        """Returns the file contents for a key.
+
+        If the contents aren't in either level of the cache, they'll be
+        computed by calling ``lookup_callable`` and then stored.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is not None:
+                # Move it to the most recently-used end.
+                self._entries[key] = entry
+
+        if entry is not None:
+            self._increment_stat('hits')
+            return entry[0]
+
+        missed = []
+
+        def _lookup():
+            missed.append(True)
+            return lookup_callable()
+
+        data = cache_memoize(key, _lookup, large_data=True)
+
+        if missed:
+            self._increment_stat('misses')
+        else:
+            self._increment_stat('shared_hits')
+
+        self._store(key, data)
+
+        return data
+
+    def clear(self):
+        """Clears the in-memory level of the cache."""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._size = 0
+
+    def get_stats(self):
+        """Returns the hit, miss and eviction counts for the cache."""
+        self.flush_stats()
+
+        keys = dict(
+            (make_cache_key('patched-file-cache-stats:%s' % name), name)
+            for name in self.STATS_KEYS
+        )
+        values = cache.get_many(list(keys.keys()))
+        stats = dict(
+            (name, int(values.get(key) or 0))
+            for key, name in keys.items()
+        )
+
+        lookups = stats['hits'] + stats['shared_hits'] + stats['misses']
+
+        if lookups:
+            stats['hit_rate'] = \
+                100 * (stats['hits'] + stats['shared_hits']) / lookups
+        else:
+            stats['hit_rate'] = 0
+
+        stats['lookups'] = lookups
+
+        return stats
+
+    def _store(self, key, data):
+        """Stores data in the in-memory level of the cache.
+
+        Least recently-used files are evicted until the cache is back under
+        its maximum size. Files larger than the maximum size are never
+        stored.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+        max_size = siteconfig.get('diffviewer_patched_file_cache_size')
+        size = len(data)
+
+        if size > max_size:
+            return
+
+        evictions = 0
+
+        with self._lock:
+            if key in self._entries:
+                return
+
+            while self._entries and self._size + size > max_size:
+                self._size -= self._entries.popitem(last=False)[1][1]
+                evictions += 1
+
+            self._entries[key] = (data, size)
+            self._size += size
+
+        if evictions:
+            self._increment_stat('evictions', evictions)
+
+    def flush_stats(self):
+        """Adds the counts recorded in this process to the shared counters."""
+        with self._lock:
+            pending_stats = self._pending_stats
+            self._pending_stats = {}
+            self._last_stats_flush = time.time()
+
+        for name, delta in six.iteritems(pending_stats):
+            key = make_cache_key('patched-file-cache-stats:%s' % name)
+
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                # The counter doesn't exist yet.
+                cache.add(key, delta)
+            except Exception as e:
+                logging.debug('Unable to increment %s: %s', key, e)
+
+    def _increment_stat(self, name, delta=1):
+        """Increments one of the cache's counters.
+
+        The counters are flushed to the main cache backend if they haven't
+        been in the last ``STATS_FLUSH_INTERVAL`` seconds.
+        """
+        with self._lock:
+            self._pending_stats[name] = \
+                self._pending_stats.get(name, 0) + delta
+            flush = (time.time() - self._last_stats_flush >=
+                     self.STATS_FLUSH_INTERVAL)
+
+        if flush:
+            self.flush_stats()
+
+
+def hash_file_contents(data):
+    """Returns the SHA1 hex digest of a file's contents."""
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+
+    return hashlib.sha1(data).hexdigest()
+
+
+_patched_file_cache = PatchedFileCache()
+
+
+def get_patched_file_cache():
+    """Returns the cache used for original and patched file contents."""
+    return _patched_file_cache
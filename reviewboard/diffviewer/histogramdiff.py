@@ -0,0 +1,161 @@
+from __future__ import unicode_literals
+
+from django.utils.six.moves import range
+
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+class HistogramDiffer(MyersDiffer):
+    """A histogram diff, based on the algorithm used by git.
+
+    This works like a patience diff, but rather than only anchoring on lines
+    that are unique to both files, it anchors on the longest run of common
+    lines that contains the rarest lines in the old file. The ranges on
+    either side of the anchor are then diffed the same way. Common lines
+    such as blank lines or closing braces are much less likely to be used
+    as anchors, which produces fewer spurious replace chunks when code
+    has been moved or rewritten.
+
+    Ranges where every common line occurs more than ``MAX_CHAIN_LENGTH``
+    times in the old file are handed off to the Myers diff.
+
+    Everything else (line codes, interesting lines, cost budgets, search
+    ranges and the resulting opcodes) works the same as in
+    :py:class:`MyersDiffer`.
+    """
+    STRATEGY_HISTOGRAM = 'histogram'
+
+    MAX_CHAIN_LENGTH = 64
+
+    def _find_modified_lines(self):
+        a_codes = self.a_data.data
+        b_codes = self.b_data.data
+        ranges = list(self._get_search_ranges() or
+                      [(0, self.a_data.length, 0, self.b_data.length)])
+
+        while ranges:
+            a_lower, a_upper, b_lower, b_upper = ranges.pop()
+
+            # Skip past any equal lines at the start and end of the range.
+            while (a_lower < a_upper and b_lower < b_upper and
+                   a_codes[a_lower] == b_codes[b_lower]):
+                a_lower += 1
+                b_lower += 1
+
+            while (a_upper > a_lower and b_upper > b_lower and
+                   a_codes[a_upper - 1] == b_codes[b_upper - 1]):
+                a_upper -= 1
+                b_upper -= 1
+
+            if a_lower == a_upper or b_lower == b_upper:
+                self._mark_modified(a_lower, a_upper, b_lower, b_upper)
+                continue
+
+            region, has_common = self._find_lcs_region(a_lower, a_upper,
+                                                       b_lower, b_upper)
+
+            if region:
+                a_start, a_end, b_start, b_end = region
+                ranges.append((a_end, a_upper, b_end, b_upper))
+                ranges.append((a_lower, a_start, b_lower, b_start))
+            elif has_common:
+                self._myers_diff_range(a_lower, a_upper, b_lower, b_upper)
+            else:
+                self._mark_modified(a_lower, a_upper, b_lower, b_upper)
+
+        self.strategy = self.STRATEGY_HISTOGRAM
+
+    def _find_lcs_region(self, a_lower, a_upper, b_lower, b_upper):
+        """Finds the region of common lines to anchor a range on.
+
+        This returns a tuple of the region, as an ``(a_start, a_end,
+        b_start, b_end)`` tuple (or ``None`` if there isn't a suitable one),
+        and whether the range has any lines in common.
+        """
+        a_codes = self.a_data.data
+        b_codes = self.b_data.data
+        max_chain_length = self.MAX_CHAIN_LENGTH
+
+        # Build the histogram of lines in the old side of the range.
+        occurrences = {}
+
+        for i in range(a_lower, a_upper):
+            code = a_codes[i]
+
+            try:
+                occurrences[code].append(i)
+            except KeyError:
+                occurrences[code] = [i]
+
+        self.cost += a_upper - a_lower + b_upper - b_lower
+        self._check_cost_budget()
+
+        best_region = None
+        best_length = 0
+        best_count = max_chain_length
+        has_common = False
+        b_next = b_lower
+
+        for j in range(b_lower, b_upper):
+            if j < b_next:
+                continue
+
+            b_next = j + 1
+
+            try:
+                positions = occurrences[b_codes[j]]
+            except KeyError:
+                continue
+
+            has_common = True
+            count = len(positions)
+
+            if count > best_count:
+                continue
+
+            for i in positions:
+                a_start = a_end = i
+                b_start = b_end = j
+                region_count = count
+
+                while (a_start > a_lower and b_start > b_lower and
+                       a_codes[a_start - 1] == b_codes[b_start - 1]):
+                    a_start -= 1
+                    b_start -= 1
+
+                    if region_count > 1:
+                        region_count = min(
+                            region_count,
+                            len(occurrences[a_codes[a_start]]))
+
+                while (a_end + 1 < a_upper and b_end + 1 < b_upper and
+                       a_codes[a_end + 1] == b_codes[b_end + 1]):
+                    a_end += 1
+                    b_end += 1
+
+                    if region_count > 1:
+                        region_count = min(
+                            region_count,
+                            len(occurrences[a_codes[a_end]]))
+
+                if b_next <= b_end:
+                    b_next = b_end + 1
+
+                if (a_end - a_start + 1 > best_length or
+                    region_count < best_count):
+                    best_region = (a_start, a_end + 1, b_start, b_end + 1)
+                    best_length = a_end - a_start + 1
+                    best_count = region_count
+
+        return best_region, has_common
+
+    def _mark_modified(self, a_lower, a_upper, b_lower, b_upper):
+        """Marks all the lines in a range as modified."""
+        a_modified = self.a_data.modified
+        b_modified = self.b_data.modified
+
+        for i in range(a_lower, a_upper):
+            a_modified[i] = 1
+
+        for j in range(b_lower, b_upper):
+            b_modified[j] = 1
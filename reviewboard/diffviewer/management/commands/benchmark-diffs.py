@@ -0,0 +1,310 @@
+from __future__ import unicode_literals
+
+import os
+import pickle
+import time
+import traceback
+from difflib import SequenceMatcher
+from optparse import make_option
+
+try:
+    import resource
+except ImportError:
+    # Peak memory usage can't be measured on this platform.
+    resource = None
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviewboard.diffviewer.diffutils import (convert_line_endings,
+                                              get_line_changed_regions,
+                                              patch_in_memory,
+                                              patch_with_subprocess)
+from reviewboard.diffviewer.histogramdiff import HistogramDiffer
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+TESTDATA_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'testdata'))
+
+
+class Command(BaseCommand):
+    """Benchmarks parts of the diff viewer against the bundled test data.
+
+    Each benchmark is run over the files in diffviewer/testdata, and reports
+    the time taken and the number of operations per second for each of the
+    implementations being compared. Where possible, each implementation is
+    run in its own process, so that the growth in peak memory usage while
+    running it can be reported as well.
+    """
+    args = '[benchmark ...]'
+    help = ('Benchmarks diff viewer operations against the diffviewer test '
+            'data. Available benchmarks: myers, patch, regions')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--iterations', type='int', default=20,
+                    dest='iterations',
+                    help='The number of times to run each benchmark'),
+        make_option('--scale', type='int', default=1,
+                    dest='scale',
+                    help='The number of times to repeat the contents of '
+                         'each file when diffing, for benchmarking larger '
+                         'files'),
+    )
+
+    BENCHMARKS = ('myers', 'patch', 'regions')
+
+    def handle(self, *args, **options):
+        benchmarks = args or self.BENCHMARKS
+        iterations = options['iterations']
+        self.scale = options['scale']
+
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        if self.scale < 1:
+            raise CommandError('--scale must be at least 1')
+
+        for name in benchmarks:
+            if name not in self.BENCHMARKS:
+                raise CommandError('Unknown benchmark "%s". Valid benchmarks '
+                                   'are: %s'
+                                   % (name, ', '.join(self.BENCHMARKS)))
+
+        for name in benchmarks:
+            self.stdout.write('Running %s benchmark (%d iterations)...\n'
+                              % (name, iterations))
+            getattr(self, '_benchmark_%s' % name)(iterations)
+            self.stdout.write('\n')
+
+    def _benchmark_myers(self, iterations):
+        """Compares the Myers, histogram and patience fallback diffs."""
+        pairs = []
+
+        for filename in sorted(os.listdir(self._get_path('new_src'))):
+            orig_path = self._get_path('orig_src', filename)
+
+            if os.path.exists(orig_path):
+                pairs.append((
+                    self._read_lines(orig_path),
+                    self._read_lines(self._get_path('new_src', filename)),
+                ))
+
+        def run_differ(cls, cost_budget):
+            for a, b in pairs:
+                list(cls(a, b, cost_budget=cost_budget).get_opcodes())
+
+        self._report(iterations, len(pairs), [
+            ('myers', lambda: run_differ(MyersDiffer, None)),
+            ('histogram', lambda: run_differ(HistogramDiffer, None)),
+            # A budget of 1 is always exceeded, forcing the fallback.
+            ('patience', lambda: run_differ(MyersDiffer, 1)),
+        ])
+
+    def _benchmark_regions(self, iterations):
+        """Compares ways of finding changed regions in replaced lines.
+
+        This uses each pair of lines in the replace chunks of the test data.
+        """
+        pairs = []
+
+        for filename in sorted(os.listdir(self._get_path('new_src'))):
+            orig_path = self._get_path('orig_src', filename)
+
+            if not os.path.exists(orig_path):
+                continue
+
+            a = self._read_lines(orig_path)
+            b = self._read_lines(self._get_path('new_src', filename))
+
+            for tag, i1, i2, j1, j2 in MyersDiffer(a, b).get_opcodes():
+                if tag == 'replace':
+                    pairs += [
+                        (old_line, new_line)
+                        for old_line, new_line in zip(a[i1:i2], b[j1:j2])
+                        if old_line != new_line
+                    ]
+
+        self.stdout.write('  %d replaced lines\n' % len(pairs))
+
+        def run_tokens():
+            for old_line, new_line in pairs:
+                get_line_changed_regions(old_line, new_line)
+
+        def run_tokens_memoized():
+            regions = {}
+
+            for key in pairs:
+                if key not in regions:
+                    regions[key] = get_line_changed_regions(*key)
+
+        def run_sequencematcher():
+            for old_line, new_line in pairs:
+                self._get_char_changed_regions(old_line, new_line)
+
+        self._report(iterations, len(pairs), [
+            ('tokens', run_tokens),
+            ('tokens+memoized', run_tokens_memoized),
+            ('sequencematcher', run_sequencematcher),
+        ])
+
+    def _get_char_changed_regions(self, oldline, newline):
+        """Finds changed regions by comparing whole lines by character.
+
+        This is how changed regions were found before comparing lines by
+        token, and is used as the baseline for the regions benchmark.
+        """
+        differ = SequenceMatcher(None, oldline, newline)
+
+        if differ.ratio() < 0.6:
+            return None, None
+
+        oldchanges = []
+        newchanges = []
+        back = (0, 0)
+
+        for tag, i1, i2, j1, j2 in differ.get_opcodes():
+            if tag == 'equal':
+                if (i2 - i1 < 3) or (j2 - j1 < 3):
+                    back = (j2 - j1, i2 - i1)
+
+                continue
+
+            oldstart, oldend = i1 - back[0], i2
+            newstart, newend = j1 - back[1], j2
+
+            if oldchanges and oldstart <= oldchanges[-1][1] < oldend:
+                oldchanges[-1] = (oldchanges[-1][0], oldend)
+            elif not oldline[oldstart:oldend].isspace():
+                oldchanges.append((oldstart, oldend))
+
+            if newchanges and newstart <= newchanges[-1][1] < newend:
+                newchanges[-1] = (newchanges[-1][0], newend)
+            elif not newline[newstart:newend].isspace():
+                newchanges.append((newstart, newend))
+
+            back = (0, 0)
+
+        return oldchanges, newchanges
+
+    def _benchmark_patch(self, iterations):
+        """Compares in-memory patching against the patch command."""
+        pairs = []
+
+        for filename in sorted(os.listdir(self._get_path('orig_src'))):
+            diff_path = self._get_path('diffs', 'unified',
+                                       '%s.diff' % filename)
+
+            if os.path.exists(diff_path):
+                pairs.append((
+                    filename,
+                    convert_line_endings(self._read_file(diff_path)),
+                    convert_line_endings(
+                        self._read_file(self._get_path('orig_src',
+                                                       filename))),
+                ))
+
+        def run_in_memory():
+            for filename, diff, data in pairs:
+                patched = patch_in_memory(diff, data)
+
+                if patched is None:
+                    patch_with_subprocess(diff, data, filename)
+
+        def run_subprocess():
+            for filename, diff, data in pairs:
+                patch_with_subprocess(diff, data, filename)
+
+        self._report(iterations, len(pairs), [
+            ('in-memory', run_in_memory),
+            ('subprocess', run_subprocess),
+        ])
+
+    def _report(self, iterations, ops_per_iteration, funcs):
+        """Times each of the provided functions and writes a report."""
+        results = []
+
+        for label, func in funcs:
+            elapsed, rss_growth = self._run_isolated(func, iterations)
+            results.append((label, elapsed, rss_growth))
+
+        baseline = results[-1][1]
+
+        for label, elapsed, rss_growth in results:
+            ops = iterations * ops_per_iteration
+
+            if rss_growth is None:
+                rss_growth_str = 'unknown'
+            else:
+                rss_growth_str = '%.1fMB' % (rss_growth / 1024.0)
+
+            self.stdout.write(
+                '  %-16s %8.3fs  %10.1f ops/sec  %6.2fx  peak RSS growth %s\n'
+                % (label, elapsed, ops / max(elapsed, 1e-9),
+                   baseline / max(elapsed, 1e-9), rss_growth_str))
+
+    def _run_isolated(self, func, iterations):
+        """Runs a benchmark function, returning the time and peak RSS growth.
+
+        Where fork is supported, the function is run in a child process.
+        The child starts out sharing this process's memory, so the peak RSS
+        it had before running the function is subtracted from its final
+        peak RSS, leaving the growth (in KB) caused by the function.
+        Otherwise, it's run in this process, and the growth isn't reported.
+        """
+        def _run():
+            start = time.time()
+
+            for i in range(iterations):
+                func()
+
+            return time.time() - start
+
+        if resource is None or not hasattr(os, 'fork'):
+            return _run(), None
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            # The child must never return into the command, whatever
+            # happens.
+            exit_status = 1
+
+            try:
+                os.close(read_fd)
+                start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+                with os.fdopen(write_fd, 'wb') as fp:
+                    pickle.dump((_run(), start_rss), fp)
+
+                exit_status = 0
+            except:
+                traceback.print_exc()
+            finally:
+                os._exit(exit_status)
+
+        os.close(write_fd)
+
+        with os.fdopen(read_fd, 'rb') as fp:
+            data = fp.read()
+
+        status, rusage = os.wait4(pid, 0)[1:]
+
+        if status != 0 or not data:
+            raise CommandError('The benchmark process failed')
+
+        elapsed, start_rss = pickle.loads(data)
+
+        return elapsed, max(rusage.ru_maxrss - start_rss, 0)
+
+    def _get_path(self, *relative):
+        return os.path.join(TESTDATA_DIR, *relative)
+
+    def _read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _read_lines(self, path):
+        data = self._read_file(path).decode('utf-8', 'replace')
+
+        return data.splitlines() * self.scale
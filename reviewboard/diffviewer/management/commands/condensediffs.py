@@ -1,6 +1,10 @@
 from __future__ import unicode_literals
 
-from django.core.management.base import NoArgsCommand
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
 
 from reviewboard.diffviewer.models import FileDiff
 
@@ -9,11 +13,47 @@ class Command(NoArgsCommand):
     help = ('Condenses the diffs stored in the database, reducing space '
             'requirements')
 
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=1000,
+                    dest='batch_size',
+                    help='The number of diffs to migrate at a time'),
+        make_option('--processes', type='int', default=1,
+                    dest='processes',
+                    help='The number of processes to use for hashing diffs'),
+        make_option('--checkpoint-file',
+                    dest='checkpoint_file',
+                    help='A file used to record progress after each batch. '
+                         'If the file exists, the migration will resume '
+                         'where it left off. It is removed once all diffs '
+                         'are migrated'),
+    )
+
     def handle_noargs(self, **options):
-        count = FileDiff.objects.unmigrated().count()
+        batch_size = options['batch_size']
+        processes = options['processes']
+        checkpoint_file = options['checkpoint_file']
+        start_pk = None
+
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if processes < 1:
+            raise CommandError('--processes must be at least 1')
+
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            start_pk = self._read_checkpoint(checkpoint_file)
+
+        filediffs = FileDiff.objects.unmigrated()
+
+        if start_pk is not None:
+            self.stdout.write('Resuming after FileDiff ID %d.\n' % start_pk)
+            filediffs = filediffs.filter(pk__gt=start_pk)
+
+        count = filediffs.count()
 
         if count == 0:
             self.stdout.write('All diffs have already been migrated.\n')
+            self._remove_checkpoint(checkpoint_file)
             return
 
         self.stdout.write(
@@ -26,14 +66,72 @@ class Command(NoArgsCommand):
                 'count': count,
             });
 
-        info = FileDiff.objects.migrate_all()
+        start_time = time.time()
+
+        def _on_batch_migrated(info):
+            if checkpoint_file:
+                self._write_checkpoint(checkpoint_file, info['last_pk'])
+
+            migrated = info['diffs_migrated']
+            rate = migrated / max(time.time() - start_time, 1e-9)
+
+            # Diffs may have been uploaded since we started, so don't let
+            # the estimate go below 0.
+            remaining = max(count - migrated, 0)
+
+            self.stdout.write(
+                'Migrated %d of %d diffs (%.1f diffs/sec, %s remaining)\n'
+                % (migrated, count, rate,
+                   self._format_duration(remaining / rate)))
+
+        info = FileDiff.objects.migrate_all(batch_size=batch_size,
+                                            start_pk=start_pk,
+                                            processes=processes,
+                                            callback=_on_batch_migrated)
+
+        self._remove_checkpoint(checkpoint_file)
 
         old_diff_size = info['old_diff_size']
         new_diff_size = info['new_diff_size']
 
-        self.stdout.write(
-            '\n'
-            'Condensed stored diffs from %s bytes to %s bytes '
-            '(%d%% savings)\n'
-            % (old_diff_size, new_diff_size,
-               float(new_diff_size) / float(old_diff_size) * 100.0))
+        if old_diff_size:
+            self.stdout.write(
+                '\n'
+                'Condensed stored diffs from %s bytes to %s bytes '
+                '(%d%% savings)\n'
+                % (old_diff_size, new_diff_size,
+                   float(new_diff_size) / float(old_diff_size) * 100.0))
+
+    def _read_checkpoint(self, checkpoint_file):
+        """Returns the last FileDiff ID recorded in a checkpoint file."""
+        try:
+            with open(checkpoint_file, 'r') as fp:
+                return int(fp.read().strip())
+        except (IOError, ValueError) as e:
+            raise CommandError('Unable to read the checkpoint file %s: %s'
+                               % (checkpoint_file, e))
+
+    def _write_checkpoint(self, checkpoint_file, last_pk):
+        """Records the last FileDiff ID migrated in a checkpoint file.
+
+        The file is replaced atomically, so that it's never left
+        half-written if the process is killed.
+        """
+        temp_file = '%s.tmp' % checkpoint_file
+
+        with open(temp_file, 'w') as fp:
+            fp.write('%d\n' % last_pk)
+
+        os.rename(temp_file, checkpoint_file)
+
+    def _remove_checkpoint(self, checkpoint_file):
+        """Removes the checkpoint file once everything is migrated."""
+        if checkpoint_file and os.path.exists(checkpoint_file):
+            os.unlink(checkpoint_file)
+
+    def _format_duration(self, seconds):
+        """Formats a number of seconds as H:MM:SS."""
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+
+        return '%d:%02d:%02d' % (hours, minutes, seconds)
@@ -0,0 +1,74 @@
+from __future__ import unicode_literals
+
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import connection
+
+from reviewboard.diffviewer.models import DiffChunkJob
+
+
+class Command(NoArgsCommand):
+    """Generates diffs that have been queued to be generated ahead of time.
+
+    This runs as a worker, processing jobs from the queue until it's
+    stopped. Any number of workers can be run at once.
+    """
+    help = ('Generates diffs that have been queued to be generated in the '
+            'background')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--once', action='store_true', default=False,
+                    dest='once',
+                    help='Exit once the queue is empty, instead of waiting '
+                         'for new jobs'),
+        make_option('--poll-interval', type='int', default=5,
+                    dest='poll_interval',
+                    help='The number of seconds to wait before checking '
+                         'for new jobs when the queue is empty'),
+        make_option('--max-attempts', type='int', default=3,
+                    dest='max_attempts',
+                    help='The number of times to try generating a diff '
+                         'before giving up'),
+        make_option('--timeout', type='int', default=600,
+                    dest='timeout',
+                    help='The number of seconds a job may run before it is '
+                         'assumed its worker died, and is queued again'),
+    )
+
+    def handle_noargs(self, **options):
+        poll_interval = options['poll_interval']
+        max_attempts = options['max_attempts']
+        timeout = options['timeout']
+
+        if poll_interval < 1:
+            raise CommandError('--poll-interval must be at least 1')
+
+        if max_attempts < 1:
+            raise CommandError('--max-attempts must be at least 1')
+
+        while True:
+            DiffChunkJob.objects.requeue_stale(timeout, max_attempts)
+            job = DiffChunkJob.objects.claim_next()
+
+            if job is None:
+                if options['once']:
+                    break
+
+                # Don't hold on to a database connection while idle.
+                connection.close()
+                time.sleep(poll_interval)
+                continue
+
+            start = time.time()
+
+            if job.run(max_attempts):
+                self.stdout.write('Generated diff for FileDiff %s in '
+                                  '%.2fs\n'
+                                  % (job.filediff_id, time.time() - start))
+            else:
+                self.stdout.write('Failed to generate diff for FileDiff %s '
+                                  '(attempt %d of %d): %s\n'
+                                  % (job.filediff_id, job.attempts,
+                                     max_attempts, job.last_error))
@@ -1,15 +1,19 @@
 from __future__ import unicode_literals
 
+import base64
+import hashlib
+import multiprocessing
 import os
+from datetime import timedelta
 
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import six, timezone
 from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
 from djblets.db.fields import Base64DecodedValue
 from djblets.siteconfig.models import SiteConfiguration
 
-from reviewboard.diffviewer.differ import DiffCompatVersion
 from reviewboard.diffviewer.errors import DiffTooBigError, EmptyDiffError
 from reviewboard.scmtools.core import PRE_CREATION, UNKNOWN, FileNotFoundError
 
@@ -26,44 +30,160 @@ class FileDiffManager(models.Manager):
             Q(diff_hash__isnull=False) &
             (Q(parent_diff_hash__isnull=False) | Q(parent_diff64='')))
 
-    def migrate_all(self):
+    def migrate_all(self, batch_size=1000, start_pk=None, processes=1,
+                    callback=None):
         """Migrates diff content in FileDiffs to use FileDiffData for storage.
 
         This will run through all unmigrated FileDiffs and migrate them,
         condensing their storage needs and removing the content from
         FileDiffs.
 
+        FileDiffs are migrated in batches of ``batch_size``, in order of
+        their IDs, starting after ``start_pk`` (if provided). The diffs in
+        each batch are hashed (across ``processes`` worker processes, if
+        more than 1), any new FileDiffData are created in bulk, and the
+        FileDiffs are then updated with a query per unique diff, rather than
+        being saved one at a time.
+
+        If provided, ``callback`` is called after each batch with the
+        result so far. The result contains the same keys as the returned
+        dictionary. ``last_pk`` can be passed back in as ``start_pk`` to
+        resume an interrupted migration.
+
         This will return a dictionary with the result of the process.
         """
-        filediffs = self.unmigrated()
+        info = {
+            'diffs_migrated': 0,
+            'old_diff_size': 0,
+            'new_diff_size': 0,
+            'bytes_saved': 0,
+            'last_pk': start_pk,
+        }
 
-        total_diffs_migrated = 0
-        total_diff_size = 0
-        total_bytes_saved = 0
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            map_func = pool.map
+        else:
+            pool = None
+            map_func = map
 
-        for filediff in filediffs:
-            total_diffs_migrated += 1
+        try:
+            while True:
+                queryset = self.unmigrated().order_by('pk')
 
-            diff_size = len(filediff.diff64)
-            parent_diff_size = len(filediff.parent_diff64)
+                if info['last_pk'] is not None:
+                    queryset = queryset.filter(pk__gt=info['last_pk'])
 
-            total_diff_size += diff_size + parent_diff_size
+                rows = list(
+                    queryset.values_list('pk', 'diff64', 'parent_diff64',
+                                         'diff_hash', 'parent_diff_hash')
+                    [:batch_size])
 
-            diff_hash_is_new, parent_diff_hash_is_new = \
-                filediff._migrate_diff_data(recalculate_counts=False)
+                if not rows:
+                    break
 
-            if diff_size > 0 and not diff_hash_is_new:
-                total_bytes_saved += diff_size
+                self._migrate_batch(rows, map_func, info)
+                info['last_pk'] = rows[-1][0]
 
-            if parent_diff_size > 0 and not parent_diff_hash_is_new:
-                total_bytes_saved += parent_diff_size
+                if callback:
+                    callback(dict(info))
+        finally:
+            if pool:
+                pool.terminate()
 
-        return {
-            'diffs_migrated': total_diffs_migrated,
-            'old_diff_size': total_diff_size,
-            'new_diff_size': total_diff_size - total_bytes_saved,
-            'bytes_saved': total_bytes_saved,
-        }
+        return info
+
+    def _migrate_batch(self, rows, map_func, info):
+        """Migrates a batch of FileDiffs.
+
+        ``rows`` contains the ID, base64-encoded diff and parent diff, and
+        the existing FileDiffData IDs for each FileDiff. The totals in
+        ``info`` are updated with the results.
+        """
+        from reviewboard.diffviewer.models import FileDiffData
+
+        # Work out which diffs need to be migrated for each FileDiff, and
+        # hash them.
+        diffs = []
+
+        for pk, diff64, parent_diff64, diff_hash_id, parent_diff_hash_id \
+                in rows:
+            if diff_hash_id is None:
+                diffs.append((pk, 'diff_hash', diff64))
+
+            if parent_diff64 and parent_diff_hash_id is None:
+                diffs.append((pk, 'parent_diff_hash', parent_diff64))
+
+        hashes = map_func(_hash_diff_data, [diff[2] for diff in diffs])
+
+        # Create any FileDiffData that don't exist yet.
+        existing_ids = set(
+            FileDiffData.objects
+            .filter(pk__in=set(binary_hash for binary_hash, size in hashes))
+            .values_list('pk', flat=True))
+        new_data = {}
+        updates = {}
+
+        for (pk, field, diff64), (binary_hash, size) in zip(diffs, hashes):
+            if binary_hash in existing_ids or binary_hash in new_data:
+                if size > 0:
+                    info['bytes_saved'] += size
+            else:
+                # The diff is still base64-encoded, which is how it's
+                # stored in a FileDiffData that has a primary key.
+                new_data[binary_hash] = FileDiffData(binary_hash=binary_hash,
+                                                     binary=diff64)
+
+            info['old_diff_size'] += size
+            updates.setdefault(pk, {})[field] = binary_hash
+
+        if new_data:
+            try:
+                with transaction.atomic():
+                    FileDiffData.objects.bulk_create(new_data.values())
+            except IntegrityError:
+                # Some of these were created while we were working (likely
+                # by a new diff being uploaded). Fall back on creating them
+                # one at a time.
+                for binary_hash, data in six.iteritems(new_data):
+                    FileDiffData.objects.get_or_create(
+                        binary_hash=binary_hash,
+                        defaults={'binary': data.binary})
+
+        # Update all the FileDiffs sharing the same diffs at once.
+        pks_by_hashes = {}
+
+        for pk, fields in six.iteritems(updates):
+            key = (fields.get('diff_hash'), fields.get('parent_diff_hash'))
+            pks_by_hashes.setdefault(key, []).append(pk)
+
+        for (diff_hash_id, parent_diff_hash_id), pks in \
+                six.iteritems(pks_by_hashes):
+            values = {}
+
+            if diff_hash_id is not None:
+                values['diff_hash'] = diff_hash_id
+                values['diff64'] = ''
+
+            if parent_diff_hash_id is not None:
+                values['parent_diff_hash'] = parent_diff_hash_id
+                values['parent_diff64'] = ''
+
+            self.filter(pk__in=pks).update(**values)
+
+        info['diffs_migrated'] += len(rows)
+        info['new_diff_size'] = info['old_diff_size'] - info['bytes_saved']
+
+
+def _hash_diff_data(diff64):
+    """Returns the SHA1 hash and size of a base64-encoded diff.
+
+    This is used by FileDiffManager.migrate_all, and may be run in a worker
+    process.
+    """
+    diff = base64.decodestring(diff64)
+
+    return hashlib.sha1(diff).hexdigest(), len(diff)
 
 
 class FileDiffDataManager(models.Manager):
@@ -84,6 +204,102 @@ class FileDiffDataManager(models.Manager):
         return super(FileDiffDataManager, self).get_or_create(*args, **kwargs)
 
 
+class DiffChunkJobManager(models.Manager):
+    """A manager for DiffChunkJob objects.
+
+    This is the queue of FileDiffs whose diff chunks should be generated
+    ahead of time. Jobs are stored in the database, so that no separate
+    message broker is needed. They're processed by the ``precompute-diffs``
+    management command.
+    """
+    def queue_filediffs(self, filediffs, priority=0):
+        """Queues jobs to generate the diff chunks for FileDiffs.
+
+        This does nothing unless the ``diffviewer_precompute_chunks``
+        setting is enabled. Binary and deleted files, which don't have any
+        chunks to show, are skipped.
+
+        FileDiffs that already have a pending job will have the job's
+        priority raised to ``priority``, if it's lower.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if not siteconfig.get('diffviewer_precompute_chunks'):
+            return
+
+        filediff_ids = set(
+            filediff.pk
+            for filediff in filediffs
+            if not filediff.binary and not filediff.deleted
+        )
+
+        if not filediff_ids:
+            return
+
+        existing_ids = set(
+            self.filter(filediff__in=filediff_ids)
+            .values_list('filediff_id', flat=True))
+
+        self.filter(filediff__in=existing_ids,
+                    status=self.model.PENDING,
+                    priority__lt=priority).update(priority=priority)
+
+        self.bulk_create([
+            self.model(filediff_id=filediff_id, priority=priority)
+            for filediff_id in sorted(filediff_ids - existing_ids)
+        ])
+
+    def claim_next(self):
+        """Claims the next job that's ready to run.
+
+        Jobs with the highest priority are claimed first, followed by the
+        oldest. The job is marked as running and returned. If there aren't
+        any jobs ready to run, this returns None.
+
+        It's safe to call this from several worker processes at once. Only
+        one will be able to claim any given job.
+        """
+        while True:
+            now = timezone.now()
+
+            try:
+                job = self.filter(status=self.model.PENDING,
+                                  next_attempt__lte=now) \
+                    .order_by('-priority', 'pk')[0]
+            except IndexError:
+                return None
+
+            claimed = self.filter(pk=job.pk, status=self.model.PENDING) \
+                .update(status=self.model.RUNNING,
+                        attempts=F('attempts') + 1,
+                        last_updated=now)
+
+            if claimed:
+                job.status = self.model.RUNNING
+                job.attempts += 1
+                job.last_updated = now
+
+                return job
+
+    def requeue_stale(self, timeout, max_attempts):
+        """Requeues jobs that have been running for too long.
+
+        This catches jobs whose worker process died before finishing them.
+        ``timeout`` is the number of seconds a job may run. Jobs that have
+        already been attempted ``max_attempts`` times are marked as failed
+        instead. Returns the number of jobs requeued.
+        """
+        stale = self.filter(
+            status=self.model.RUNNING,
+            last_updated__lt=timezone.now() - timedelta(seconds=timeout))
+
+        stale.filter(attempts__gte=max_attempts).update(
+            status=self.model.FAILED,
+            last_error=_('The job did not finish in time.'))
+
+        return stale.update(status=self.model.PENDING)
+
+
 class DiffSetManager(models.Manager):
     """A custom manager for DiffSet objects.
 
@@ -145,8 +361,9 @@ class DiffSetManager(models.Manager):
         The diff_file_contents and parent_diff_file_contents parameters are
         strings with the actual diff contents.
         """
-        from reviewboard.diffviewer.diffutils import convert_to_unicode
-        from reviewboard.diffviewer.models import FileDiff
+        from reviewboard.diffviewer.diffutils import (convert_to_unicode,
+                                                      get_diff_compat_version)
+        from reviewboard.diffviewer.models import DiffChunkJob, FileDiff
 
         tool = repository.get_scmtool()
 
@@ -201,12 +418,14 @@ class DiffSetManager(models.Manager):
             basedir=basedir,
             history=diffset_history,
             repository=repository,
-            diffcompat=DiffCompatVersion.DEFAULT,
+            diffcompat=get_diff_compat_version(repository),
             base_commit_id=base_commit_id)
 
         if save:
             diffset.save()
 
+        filediffs = []
+
         for f in files:
             if f.origFile in parent_files:
                 parent_file = parent_files[f.origFile]
@@ -243,6 +462,10 @@ class DiffSetManager(models.Manager):
 
             if save:
                 filediff.save()
+                filediffs.append(filediff)
+
+        if filediffs:
+            DiffChunkJob.objects.queue_filediffs(filediffs)
 
         return diffset
 
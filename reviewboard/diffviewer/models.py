@@ -2,15 +2,19 @@ from __future__ import unicode_literals
 
 import hashlib
 import logging
+from datetime import timedelta
 
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.db import models
-from django.utils import six, timezone
+from django.utils import six, timezone, translation
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from djblets.db.fields import Base64Field, JSONField
 
 from reviewboard.diffviewer.errors import DiffParserError
-from reviewboard.diffviewer.managers import (FileDiffDataManager,
+from reviewboard.diffviewer.managers import (DiffChunkJobManager,
+                                             FileDiffDataManager,
                                              FileDiffManager,
                                              DiffSetManager)
 from reviewboard.scmtools.core import PRE_CREATION
@@ -447,3 +451,112 @@ class DiffSetHistory(models.Model):
 
     class Meta:
         verbose_name_plural = "Diff set histories"
+
+
+@python_2_unicode_compatible
+class DiffChunkJob(models.Model):
+    """A queued job for generating the diff chunks for a FileDiff.
+
+    Jobs are queued when diffs are uploaded and published, and processed by
+    the ``precompute-diffs`` management command, so that the first person
+    to view a diff doesn't have to wait for it to be generated. Jobs that
+    fail are retried, waiting longer between each attempt.
+    """
+    PENDING = 'P'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+
+    STATUSES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    STATUS_NAMES = {
+        PENDING: 'pending',
+        RUNNING: 'running',
+        DONE: 'done',
+        FAILED: 'failed',
+    }
+
+    # Jobs for published diffs are run before jobs for diffs that have only
+    # been uploaded.
+    PRIORITY_UPLOAD = 0
+    PRIORITY_PUBLISH = 10
+
+    # The number of seconds to wait before the first retry. This doubles
+    # for each attempt after that.
+    RETRY_DELAY = 60
+
+    filediff = models.OneToOneField(FileDiff,
+                                    related_name='chunk_job',
+                                    verbose_name=_('file diff'))
+    status = models.CharField(_('status'), max_length=1, choices=STATUSES,
+                              default=PENDING, db_index=True)
+    priority = models.IntegerField(_('priority'), default=PRIORITY_UPLOAD)
+    attempts = models.IntegerField(_('attempts'), default=0)
+    last_error = models.TextField(_('last error'), blank=True)
+    timestamp = models.DateTimeField(_('timestamp'), default=timezone.now)
+    last_updated = models.DateTimeField(_('last updated'),
+                                        default=timezone.now)
+    next_attempt = models.DateTimeField(_('next attempt'),
+                                        default=timezone.now)
+
+    objects = DiffChunkJobManager()
+
+    @property
+    def status_name(self):
+        """The name of the job's status, for use in the API."""
+        return self.STATUS_NAMES[self.status]
+
+    def run(self, max_attempts):
+        """Generates and caches the diff chunks for the FileDiff.
+
+        The chunks are generated the way they would be for an anonymous
+        user in the site's default language, which is how most people will
+        see them.
+
+        If this fails, the job will be queued to run again, unless it's
+        already been attempted ``max_attempts`` times. Returns whether the
+        chunks were generated.
+        """
+        from reviewboard.diffviewer.chunk_generator import \
+            get_diff_chunk_generator
+        from reviewboard.diffviewer.diffutils import get_enable_highlighting
+
+        try:
+            with translation.override(settings.LANGUAGE_CODE):
+                generator = get_diff_chunk_generator(
+                    None, self.filediff,
+                    enable_syntax_highlighting=get_enable_highlighting(
+                        AnonymousUser()))
+                generator.get_chunks()
+        except Exception as e:
+            logging.exception('Unable to generate diff chunks for '
+                              'FileDiff %s (attempt %d): %s',
+                              self.filediff_id, self.attempts, e)
+            self.last_error = six.text_type(e)
+
+            if self.attempts >= max_attempts:
+                self.status = self.FAILED
+            else:
+                self.status = self.PENDING
+                self.next_attempt = timezone.now() + timedelta(
+                    seconds=self.RETRY_DELAY * 2 ** (self.attempts - 1))
+        else:
+            self.status = self.DONE
+            self.last_error = ''
+
+        self.last_updated = timezone.now()
+        self.save()
+
+        return self.status == self.DONE
+
+    def __str__(self):
+        return 'Diff chunk job for FileDiff %s (%s)' % (self.filediff_id,
+                                                         self.status_name)
+
+    class Meta:
+        ordering = ['-priority', 'timestamp']
@@ -1,14 +1,40 @@
 from __future__ import unicode_literals
 
+import bisect
+from array import array
+
 from django.utils.six.moves import range
 
 from reviewboard.diffviewer.differ import Differ, DiffCompatVersion
 
 
+class CostBudgetExceeded(Exception):
+    """Raised when a diff has exceeded its cost budget."""
+    pass
+
+
 class MyersDiffer(Differ):
     """
     An implementation of Eugene Myers's O(ND) Diff algorithm based on GNU diff.
+
+    The amount of work the differ will do can be capped by passing a
+    ``cost_budget``, similar to GNU diff's ``--speed-large-files``. This is
+    roughly the number of diagonals the search may visit, and each line in
+    the files counts toward it. If the budget would be exceeded, the differ
+    switches to a cheaper patience-style diff that anchors on lines that
+    are unique to both files. The ``strategy`` attribute says which was
+    used.
+
+    If the caller already knows which parts of the files may differ (such
+    as when both files were patched from the same original), it can pass
+    them as ``search_ranges``, a list of ``(a_lower, a_upper, b_lower,
+    b_upper)`` tuples. Only those ranges are searched, and everything
+    between them is taken to be equal. If the lines between the ranges
+    turn out not to be equal, the ranges are ignored.
     """
+    STRATEGY_MYERS = 'myers'
+    STRATEGY_PATIENCE = 'patience'
+
     SNAKE_LIMIT = 20
 
     DISCARD_NONE = 0
@@ -19,15 +45,25 @@ class MyersDiffer(Differ):
     # search.  It works by finding the "shortest middle snake," which
 
     class DiffData:
+        """The state for one side of the diff.
+
+        The line codes and the vectors derived from them are stored in
+        compact arrays, rather than lists of Python objects.
+
+        ``modified`` holds a flag for each line.
+        """
         def __init__(self, data):
             self.data = data
             self.length = len(data)
-            self.modified = {}
-            self.undiscarded = []
+            self.modified = bytearray(self.length)
+            self.undiscarded = None
             self.undiscarded_lines = 0
-            self.real_indexes = []
+            self.real_indexes = None
 
     def __init__(self, *args, **kwargs):
+        self.cost_budget = kwargs.pop('cost_budget', None)
+        self.search_ranges = kwargs.pop('search_ranges', None)
+
         super(MyersDiffer, self).__init__(*args, **kwargs)
 
         self.code_table = {}
@@ -40,11 +76,12 @@ class MyersDiffer(Differ):
         self.max_lines = 0
         self.fdiag = None
         self.bdiag = None
+        self.cost = 0
 
     def ratio(self):
         self._gen_diff_data()
-        a_equals = self.a_data.length - len(self.a_data.modified)
-        b_equals = self.b_data.length - len(self.b_data.modified)
+        a_equals = self.a_data.length - sum(self.a_data.modified)
+        b_equals = self.b_data.length - sum(self.b_data.modified)
 
         return 1.0 * (a_equals + b_equals) / \
                      (self.a_data.length + self.b_data.length)
@@ -68,9 +105,9 @@ class MyersDiffer(Differ):
             b_start = b_line
 
             if a_line < self.a_data.length and \
-               not self.a_data.modified.get(a_line, False) and \
+               not self.a_data.modified[a_line] and \
                b_line < self.b_data.length and \
-               not self.b_data.modified.get(b_line, False):
+               not self.b_data.modified[b_line]:
                 # Equal
                 a_changed = b_changed = 1
                 tag = "equal"
@@ -84,7 +121,7 @@ class MyersDiffer(Differ):
                 # file.
                 while (a_line < self.a_data.length and
                        (b_line >= self.b_data.length or
-                        self.a_data.modified.get(a_line, False))):
+                        self.a_data.modified[a_line])):
                     a_line += 1
 
                 # Count every new line that's been modified, and the
@@ -92,7 +129,7 @@ class MyersDiffer(Differ):
                 # file.
                 while (b_line < self.b_data.length and
                        (a_line >= self.a_data.length or
-                        self.b_data.modified.get(b_line, False))):
+                        self.b_data.modified[b_line])):
                     b_line += 1
 
                 a_changed = a_line - a_start
@@ -141,82 +178,178 @@ class MyersDiffer(Differ):
         if self.a_data and self.b_data:
             return
 
-        self.a_data = self.DiffData(self._gen_diff_codes(self.a, False))
-        self.b_data = self.DiffData(self._gen_diff_codes(self.b, True))
+        a_codes, b_codes = self._gen_diff_codes()
+        self.a_data = self.DiffData(a_codes)
+        self.b_data = self.DiffData(b_codes)
+        self.cost = self.a_data.length + self.b_data.length
+
+        try:
+            self._check_cost_budget()
+            self._find_modified_lines()
+        except CostBudgetExceeded:
+            # Throw away anything the search found and start over with
+            # the cheaper diff.
+            self.fdiag = self.bdiag = None
+
+            for data in (self.a_data, self.b_data):
+                data.undiscarded = data.real_indexes = None
+                data.modified = bytearray(data.length)
+
+            self._patience_diff()
+            self.strategy = self.STRATEGY_PATIENCE
+
+        self._shift_chunks(self.a_data, self.b_data)
+        self._shift_chunks(self.b_data, self.a_data)
+
+    def _find_modified_lines(self):
+        """Marks the lines that differ between the two files.
+
+        Subclasses can override this to use a different algorithm. It must
+        set ``strategy`` to the name of the approach used.
+        """
+        search_ranges = self._get_search_ranges()
+
+        if search_ranges is not None:
+            for a_lower, a_upper, b_lower, b_upper in search_ranges:
+                self._myers_diff_range(a_lower, a_upper, b_lower, b_upper)
+
+            self.strategy = self.STRATEGY_MYERS
+            return
 
         self._discard_confusing_lines()
+        self._prepare_search()
+
+        self._lcs(0, self.a_data.undiscarded_lines,
+                  0, self.b_data.undiscarded_lines,
+                  self.minimal_diff)
+        self.strategy = self.STRATEGY_MYERS
 
+    def _get_search_ranges(self):
+        """Returns the ranges of lines to search for changes.
+
+        This returns the ``search_ranges`` passed to the differ, if the lines
+        outside of them are equal in both files. Otherwise, this returns
+        None, and the files must be searched in full.
+        """
+        if self.search_ranges is None:
+            return None
+
+        a_codes = self.a_data.data
+        b_codes = self.b_data.data
+        a_pos = b_pos = 0
+
+        for a_lower, a_upper, b_lower, b_upper in self.search_ranges:
+            if (a_lower < a_pos or b_lower < b_pos or
+                a_upper < a_lower or b_upper < b_lower or
+                a_codes[a_pos:a_lower] != b_codes[b_pos:b_lower]):
+                return None
+
+            a_pos = a_upper
+            b_pos = b_upper
+
+        if (a_pos > self.a_data.length or b_pos > self.b_data.length or
+            a_codes[a_pos:] != b_codes[b_pos:]):
+            return None
+
+        return self.search_ranges
+
+    def _myers_diff_range(self, a_lower, a_upper, b_lower, b_upper):
+        """Marks the modified lines in a range using the Myers diff.
+
+        The Myers search state is set up the first time this is needed. No
+        lines are discarded, so the search covers the lines as-is.
+        """
+        if self.fdiag is None:
+            for data in (self.a_data, self.b_data):
+                data.undiscarded = data.data
+                data.undiscarded_lines = data.length
+                data.real_indexes = array(str('l'), range(data.length))
+
+            self._prepare_search()
+
+        self._lcs(a_lower, a_upper, b_lower, b_upper, self.minimal_diff)
+
+    def _prepare_search(self):
+        """Allocates the diagonal vectors used by the Myers search.
+
+        This must be called once the undiscarded lines for both files have
+        been computed.
+        """
         self.max_lines = (self.a_data.undiscarded_lines +
                           self.b_data.undiscarded_lines + 3)
 
         vector_size = (self.a_data.undiscarded_lines +
                        self.b_data.undiscarded_lines + 3)
-        self.fdiag = [0] * vector_size
-        self.bdiag = [0] * vector_size
+        self.fdiag = array(str('l'), [0]) * vector_size
+        self.bdiag = array(str('l'), [0]) * vector_size
         self.downoff = self.upoff = self.b_data.undiscarded_lines + 1
 
-        self._lcs(0, self.a_data.undiscarded_lines,
-                  0, self.b_data.undiscarded_lines,
-                  self.minimal_diff)
-        self._shift_chunks(self.a_data, self.b_data)
-        self._shift_chunks(self.b_data, self.a_data)
+    def _check_cost_budget(self):
+        """Raises CostBudgetExceeded if the cost budget has been exceeded."""
+        if self.cost_budget and self.cost > self.cost_budget:
+            raise CostBudgetExceeded
 
-    def _gen_diff_codes(self, lines, is_modified_file):
+    def _gen_diff_codes(self):
         """
-        Converts all unique lines of text into unique numbers. Comparing
-        lists of numbers is faster than comparing lists of strings.
+        Converts all unique lines of text in both files into unique numbers.
+        Comparing lists of numbers is faster than comparing lists of strings.
+
+        This is done in a single pass over both files, so that identical
+        lines in either file share a code. The codes are returned as a pair
+        of arrays.
         """
-        codes = []
+        code_table = self.code_table
+        interesting_line_table = self.interesting_line_table
+        interesting_line_regexes = self.interesting_line_regexes
+        ignore_space = self.ignore_space
+        result = []
 
-        linenum = 0
+        for lines, interesting_lines in ((self.a, self.interesting_lines[0]),
+                                         (self.b, self.interesting_lines[1])):
+            codes = array(str('l'))
+            append = codes.append
 
-        if is_modified_file:
-            interesting_lines = self.interesting_lines[1]
-        else:
-            interesting_lines = self.interesting_lines[0]
-
-        for line in lines:
-            # TODO: Handle ignoring/triming spaces, ignoring casing, and
-            #       special hooks
-
-            raw_line = line
-            stripped_line = line.lstrip()
-
-            if self.ignore_space:
-                # We still want to show lines that contain only whitespace.
-                if len(stripped_line) > 0:
-                    line = stripped_line
-
-            interesting_line_name = None
-
-            try:
-                code = self.code_table[line]
-                interesting_line_name = \
-                    self.interesting_line_table.get(code, None)
-            except KeyError:
-                # This is a new, unrecorded line, so mark it and store it.
-                self.last_code += 1
-                code = self.last_code
-                self.code_table[line] = code
-
-                # Check to see if this is an interesting line that the caller
-                # wants recorded.
-                if stripped_line:
-                    for name, regex in self.interesting_line_regexes:
-                        if regex.match(raw_line):
-                            interesting_line_name = name
-                            self.interesting_line_table[code] = name
-                            break
+            for linenum, raw_line in enumerate(lines):
+                # TODO: Handle ignoring/triming spaces, ignoring casing, and
+                #       special hooks
+                line = raw_line
+
+                if ignore_space:
+                    # We still want to show lines that contain only
+                    # whitespace.
+                    stripped_line = line.lstrip()
+
+                    if stripped_line:
+                        line = stripped_line
 
-            if interesting_line_name:
-                interesting_lines[interesting_line_name].append((linenum,
-                                                                 raw_line))
+                code = code_table.get(line)
 
-            codes.append(code)
+                if code is None:
+                    # This is a new, unrecorded line, so mark it and store it.
+                    self.last_code += 1
+                    code = self.last_code
+                    code_table[line] = code
 
-            linenum += 1
+                    # Check to see if this is an interesting line that the
+                    # caller wants recorded.
+                    if interesting_line_regexes and raw_line.strip():
+                        for name, regex in interesting_line_regexes:
+                            if regex.match(raw_line):
+                                interesting_line_table[code] = name
+                                break
 
-        return codes
+                if interesting_line_table:
+                    interesting_line_name = interesting_line_table.get(code)
+
+                    if interesting_line_name:
+                        interesting_lines[interesting_line_name].append(
+                            (linenum, raw_line))
+
+                append(code)
+
+            result.append(codes)
+
+        return result
 
     def _find_sms(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
         """
@@ -224,13 +357,17 @@ class MyersDiffer(Differ):
         """
         down_vector = self.fdiag  # The vector for the (0, 0) to (x, y) search
         up_vector = self.bdiag    # The vector for the (u, v) to (N, M) search
+        a_codes = self.a_data.undiscarded
+        b_codes = self.b_data.undiscarded
+        downoff = self.downoff
+        upoff = self.upoff
 
         down_k = a_lower - b_lower  # The k-line to start the forward search
         up_k = a_upper - b_upper    # The k-line to start the reverse search
         odd_delta = (down_k - up_k) % 2 != 0
 
-        down_vector[self.downoff + down_k] = a_lower
-        up_vector[self.upoff + up_k] = a_upper
+        down_vector[downoff + down_k] = a_lower
+        up_vector[upoff + up_k] = a_upper
 
         dmin = a_lower - b_upper
         dmax = a_upper - b_lower
@@ -247,20 +384,20 @@ class MyersDiffer(Differ):
 
             if down_min > dmin:
                 down_min -= 1
-                down_vector[self.downoff + down_min - 1] = -1
+                down_vector[downoff + down_min - 1] = -1
             else:
                 down_min += 1
 
             if down_max < dmax:
                 down_max += 1
-                down_vector[self.downoff + down_max + 1] = -1
+                down_vector[downoff + down_max + 1] = -1
             else:
                 down_max -= 1
 
             # Extend the forward path
             for k in range(down_max, down_min - 1, -2):
-                tlo = down_vector[self.downoff + k - 1]
-                thi = down_vector[self.downoff + k + 1]
+                tlo = down_vector[downoff + k - 1]
+                thi = down_vector[downoff + k + 1]
 
                 if tlo >= thi:
                     x = tlo + 1
@@ -273,36 +410,37 @@ class MyersDiffer(Differ):
                 # Find the end of the furthest reaching forward D-path in
                 # diagonal k
                 while (x < a_upper and y < b_upper and
-                       (self.a_data.undiscarded[x] ==
-                        self.b_data.undiscarded[y])):
+                       a_codes[x] == b_codes[y]):
                     x += 1
                     y += 1
 
                 if odd_delta and up_min <= k <= up_max and \
-                   up_vector[self.upoff + k] <= x:
+                   up_vector[upoff + k] <= x:
                     return x, y, True, True
 
                 if x - old_x > self.SNAKE_LIMIT:
                     big_snake = True
 
-                down_vector[self.downoff + k] = x
+                down_vector[downoff + k] = x
+
+            self.cost += (down_max - down_min) // 2 + 1
 
             # Extend the reverse path
             if up_min > dmin:
                 up_min -= 1
-                up_vector[self.upoff + up_min - 1] = self.max_lines
+                up_vector[upoff + up_min - 1] = self.max_lines
             else:
                 up_min += 1
 
             if up_max < dmax:
                 up_max += 1
-                up_vector[self.upoff + up_max + 1] = self.max_lines
+                up_vector[upoff + up_max + 1] = self.max_lines
             else:
                 up_max -= 1
 
             for k in range(up_max, up_min - 1, -2):
-                tlo = up_vector[self.upoff + k - 1]
-                thi = up_vector[self.upoff + k + 1]
+                tlo = up_vector[upoff + k - 1]
+                thi = up_vector[upoff + k + 1]
 
                 if tlo < thi:
                     x = tlo
@@ -313,19 +451,21 @@ class MyersDiffer(Differ):
                 old_x = x
 
                 while (x > a_lower and y > b_lower and
-                       (self.a_data.undiscarded[x - 1] ==
-                        self.b_data.undiscarded[y - 1])):
+                       a_codes[x - 1] == b_codes[y - 1]):
                     x -= 1
                     y -= 1
 
                 if (not odd_delta and down_min <= k <= down_max and
-                        x <= down_vector[self.downoff + k]):
+                        x <= down_vector[downoff + k]):
                     return x, y, True, True
 
                 if old_x - x > self.SNAKE_LIMIT:
                     big_snake = True
 
-                up_vector[self.upoff + k] = x
+                up_vector[upoff + k] = x
+
+            self.cost += (up_max - up_min) // 2 + 1
+            self._check_cost_budget()
 
             if find_minimal:
                 continue
@@ -343,7 +483,7 @@ class MyersDiffer(Differ):
             if cost > 200 and big_snake:
                 ret_x, ret_y, best = self._find_diagonal(
                     down_min, down_max, down_k, 0,
-                    self.downoff, down_vector,
+                    downoff, down_vector,
                     lambda x: x - a_lower,
                     lambda x: a_lower + self.SNAKE_LIMIT <= x < a_upper,
                     lambda y: b_lower + self.SNAKE_LIMIT <= y < b_upper,
@@ -354,7 +494,7 @@ class MyersDiffer(Differ):
                     return ret_x, ret_y, True, False
 
                 ret_x, ret_y, best = self._find_diagonal(
-                    up_min, up_max, up_k, best, self.upoff,
+                    up_min, up_max, up_k, best, upoff,
                     up_vector,
                     lambda x: a_upper - x,
                     lambda x: a_lower < x <= a_upper - self.SNAKE_LIMIT,
@@ -374,7 +514,7 @@ class MyersDiffer(Differ):
                 # Find the forward diagonal that maximized x + y
                 fxy_best = -1
                 for d in range(down_max, down_min - 1, -2):
-                    x = min(down_vector[self.downoff + d], a_upper)
+                    x = min(down_vector[downoff + d], a_upper)
                     y = x - d
 
                     if b_upper < y:
@@ -388,7 +528,7 @@ class MyersDiffer(Differ):
                 # Find the backward diagonal that minimizes x + y
                 bxy_best = self.max_lines
                 for d in range(up_max, up_min - 1, -2):
-                    x = max(a_lower, up_vector[self.upoff + d])
+                    x = max(a_lower, up_vector[upoff + d])
                     y = x - d
 
                     if y < b_lower:
@@ -438,28 +578,29 @@ class MyersDiffer(Differ):
         The divide-and-conquer implementation of the Longest Common
         Subsequence (LCS) algorithm.
         """
+        a_codes = self.a_data.undiscarded
+        b_codes = self.b_data.undiscarded
+
         # Fast walkthrough equal lines at the start
         while (a_lower < a_upper and b_lower < b_upper and
-               (self.a_data.undiscarded[a_lower] ==
-                self.b_data.undiscarded[b_lower])):
+               a_codes[a_lower] == b_codes[b_lower]):
             a_lower += 1
             b_lower += 1
 
         while (a_upper > a_lower and b_upper > b_lower and
-               (self.a_data.undiscarded[a_upper - 1] ==
-                self.b_data.undiscarded[b_upper - 1])):
+               a_codes[a_upper - 1] == b_codes[b_upper - 1]):
             a_upper -= 1
             b_upper -= 1
 
         if a_lower == a_upper:
             # Inserted lines.
             while b_lower < b_upper:
-                self.b_data.modified[self.b_data.real_indexes[b_lower]] = True
+                self.b_data.modified[self.b_data.real_indexes[b_lower]] = 1
                 b_lower += 1
         elif b_lower == b_upper:
             # Deleted lines
             while a_lower < a_upper:
-                self.a_data.modified[self.a_data.real_indexes[a_lower]] = True
+                self.a_data.modified[self.a_data.real_indexes[a_lower]] = 1
                 a_lower += 1
         else:
             # Find the middle snake and length of an optimal path for A and B
@@ -470,6 +611,128 @@ class MyersDiffer(Differ):
             self._lcs(a_lower, x, b_lower, y, low_minimal)
             self._lcs(x, a_upper, y, b_upper, high_minimal)
 
+    def _patience_diff(self):
+        """Marks the modified lines using a patience-style diff.
+
+        This is used in place of the Myers diff when a diff would exceed
+        its cost budget. Lines that appear exactly once in each file are
+        used as anchors, keeping the longest run of them that appears in the
+        same order in both files. The ranges between the anchors are then
+        diffed the same way. Any range without unique lines in common is
+        treated as entirely changed.
+
+        This runs in roughly O(N log N) time per level of anchors, rather
+        than O(ND), at the cost of a less minimal diff.
+        """
+        a = self.a_data.data
+        b = self.b_data.data
+        a_modified = self.a_data.modified
+        b_modified = self.b_data.modified
+        ranges = [(0, len(a), 0, len(b))]
+
+        while ranges:
+            a_lower, a_upper, b_lower, b_upper = ranges.pop()
+
+            while (a_lower < a_upper and b_lower < b_upper and
+                   a[a_lower] == b[b_lower]):
+                a_lower += 1
+                b_lower += 1
+
+            while (a_upper > a_lower and b_upper > b_lower and
+                   a[a_upper - 1] == b[b_upper - 1]):
+                a_upper -= 1
+                b_upper -= 1
+
+            if a_lower < a_upper and b_lower < b_upper:
+                anchors = self._find_unique_anchors(a_lower, a_upper,
+                                                    b_lower, b_upper)
+            else:
+                anchors = None
+
+            if not anchors:
+                for i in range(a_lower, a_upper):
+                    a_modified[i] = 1
+
+                for j in range(b_lower, b_upper):
+                    b_modified[j] = 1
+
+                continue
+
+            for i, j in anchors:
+                ranges.append((a_lower, i, b_lower, j))
+                a_lower = i + 1
+                b_lower = j + 1
+
+            ranges.append((a_lower, a_upper, b_lower, b_upper))
+
+    def _find_unique_anchors(self, a_lower, a_upper, b_lower, b_upper):
+        """Returns matching lines to anchor a patience diff on.
+
+        This finds the lines that appear exactly once in each range, and
+        returns the longest sequence of them that's in the same order in
+        both, as a list of (a index, b index) tuples.
+        """
+        a = self.a_data.data
+        b = self.b_data.data
+        a_counts = {}
+        b_counts = {}
+
+        for i in range(a_lower, a_upper):
+            code = a[i]
+
+            if code in a_counts:
+                a_counts[code] = None
+            else:
+                a_counts[code] = i
+
+        for j in range(b_lower, b_upper):
+            code = b[j]
+
+            if code in b_counts:
+                b_counts[code] = None
+            elif a_counts.get(code) is not None:
+                b_counts[code] = j
+
+        # Find the longest increasing sequence of b indexes, in order of
+        # the a indexes, using patience sorting.
+        pile_tops = []
+        pile_items = []
+        backrefs = {}
+
+        for i in range(a_lower, a_upper):
+            code = a[i]
+            j = b_counts.get(code)
+
+            if j is None or a_counts[code] != i:
+                continue
+
+            pile = bisect.bisect_left(pile_tops, j)
+
+            if pile > 0:
+                backrefs[i] = pile_items[pile - 1]
+            else:
+                backrefs[i] = None
+
+            if pile == len(pile_tops):
+                pile_tops.append(j)
+                pile_items.append((i, j))
+            else:
+                pile_tops[pile] = j
+                pile_items[pile] = (i, j)
+
+        anchors = []
+
+        if pile_items:
+            item = pile_items[-1]
+
+            while item is not None:
+                anchors.append(item)
+                item = backrefs[item[0]]
+
+            anchors.reverse()
+
+        return anchors
+
     def _shift_chunks(self, data, other_data):
         """
         Shifts the inserts/deletes of identical lines in order to join
@@ -485,13 +748,21 @@ class MyersDiffer(Differ):
         """
         i = j = 0
         i_end = data.length
+        modified = data.modified
+        other_modified = other_data.modified
+        other_end = other_data.length
+
+        # The indexes may run past either end of the other file, where no
+        # lines are modified.
+        def is_other_modified(j):
+            return 0 <= j < other_end and other_modified[j]
 
         while True:
             # Scan forward in order to find the start of a run of changes.
-            while i < i_end and not data.modified.get(i, False):
+            while i < i_end and not modified[i]:
                 i += 1
 
-                while other_data.modified.get(j, False):
+                while is_other_modified(j):
                     j += 1
 
             if i == i_end:
@@ -501,10 +772,10 @@ class MyersDiffer(Differ):
 
             # Find the end of these changes
             i += 1
-            while data.modified.get(i, False):
+            while i < i_end and modified[i]:
                 i += 1
 
-            while other_data.modified.get(j, False):
+            while is_other_modified(j):
                 j += 1
 
             while True:
@@ -517,21 +788,21 @@ class MyersDiffer(Differ):
                     start -= 1
                     i -= 1
 
-                    data.modified[start] = True
-                    data.modified[i] = False
+                    modified[start] = 1
+                    modified[i] = 0
 
-                    while data.modified.get(start - 1, False):
+                    while start > 0 and modified[start - 1]:
                         start -= 1
 
                     j -= 1
-                    while other_data.modified.get(j, False):
+                    while is_other_modified(j):
                         j -= 1
 
                 # The end of the changed run at the last point where it
                 # corresponds to the changed run in the other data set.
                 # If it's equal to i_end, then we didn't find a corresponding
                 # point.
-                if other_data.modified.get(j - 1, False):
+                if is_other_modified(j - 1):
                     corresponding = i
                 else:
                     corresponding = i_end
@@ -539,17 +810,17 @@ class MyersDiffer(Differ):
                 # Move the changed region forward as long as the first
                 # changed line is the same as the following unchanged line.
                 while i != i_end and data.data[start] == data.data[i]:
-                    data.modified[start] = False
-                    data.modified[i] = True
+                    modified[start] = 0
+                    modified[i] = 1
 
                     start += 1
                     i += 1
 
-                    while data.modified.get(i, False):
+                    while i < i_end and modified[i]:
                         i += 1
 
                     j += 1
-                    while other_data.modified.get(j, False):
+                    while is_other_modified(j):
                         j += 1
                         corresponding = i
 
@@ -562,11 +833,11 @@ class MyersDiffer(Differ):
                 start -= 1
                 i -= 1
 
-                data.modified[start] = True
-                data.modified[i] = False
+                modified[start] = 1
+                modified[i] = 0
 
                 j -= 1
-                while other_data.modified.get(j, False):
+                while is_other_modified(j):
                     j -= 1
 
     def _discard_confusing_lines(self):
@@ -670,18 +941,20 @@ class MyersDiffer(Differ):
                     data.real_indexes[j] = i
                     j += 1
                 else:
-                    data.modified[i] = True
+                    data.modified[i] = 1
 
             data.undiscarded_lines = j
 
-        self.a_data.undiscarded = [0] * self.a_data.length
-        self.b_data.undiscarded = [0] * self.b_data.length
-        self.a_data.real_indexes = [0] * self.a_data.length
-        self.b_data.real_indexes = [0] * self.b_data.length
-        a_discarded = [0] * self.a_data.length
-        b_discarded = [0] * self.b_data.length
-        a_code_counts = [0] * (1 + self.last_code)
-        b_code_counts = [0] * (1 + self.last_code)
+        zeros = array(str('l'), [0])
+
+        self.a_data.undiscarded = zeros * self.a_data.length
+        self.b_data.undiscarded = zeros * self.b_data.length
+        self.a_data.real_indexes = zeros * self.a_data.length
+        self.b_data.real_indexes = zeros * self.b_data.length
+        a_discarded = bytearray(self.a_data.length)
+        b_discarded = bytearray(self.b_data.length)
+        a_code_counts = zeros * (1 + self.last_code)
+        b_code_counts = zeros * (1 + self.last_code)
 
         for item in self.a_data.data:
             a_code_counts[item] += 1
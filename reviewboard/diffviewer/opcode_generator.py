@@ -5,6 +5,7 @@ import re
 
 from django.utils import six
 from django.utils.six.moves import range
+from djblets.siteconfig.models import SiteConfiguration
 
 from reviewboard.diffviewer.processors import (filter_interdiff_opcodes,
                                                post_process_filtered_equals)
@@ -37,6 +38,8 @@ class DiffOpcodeGenerator(object):
         self.groups = []
         self.removes = {}
         self.inserts = []
+        self.move_work = 0
+        self.move_budget_exceeded = False
 
         # Run the opcodes through the chain.
         opcodes = self.differ.get_opcodes()
@@ -126,12 +129,22 @@ class DiffOpcodeGenerator(object):
             #
             # Later, we will loop through the keys and attempt to find insert
             # keys/groups that match remove keys/groups.
+            #
+            # Only the first matching line in each group is stored. The rest
+            # of a move range is found by checking the lines that follow it,
+            # so later matches in the same group are never needed to start
+            # a range.
             if tag in ('delete', 'replace'):
+                group_key = (i1, i2, j1, j2)
+
                 for i in range(i1, i2):
                     line = self.differ.a[i].strip()
 
                     if line:
-                        self.removes.setdefault(line, []).append((i, group))
+                        matches = self.removes.setdefault(line, [])
+
+                        if not matches or matches[-1][2] != group_key:
+                            matches.append((i, group, group_key))
 
             if tag in ('insert', 'replace'):
                 self.inserts.append(group)
@@ -261,10 +274,19 @@ class DiffOpcodeGenerator(object):
         #
         # The algorithm will be documented as we go in the code.
         #
+        # The amount of work done is capped by the
+        # diffviewer_move_detection_budget setting. Once that's reached, we
+        # stop looking for moves, and keep any we've already found.
+        siteconfig = SiteConfiguration.objects.get_current()
+        self.move_budget = siteconfig.get('diffviewer_move_detection_budget')
+
         # We start by looping through all the inserted groups.
         for insert in self.inserts:
             self._compute_move_for_insert(*insert)
 
+            if self.move_budget_exceeded:
+                break
+
     def _compute_move_for_insert(self, itag, ii1, ii2, ij1, ij2, imeta):
         # Store some state on the range we'll be working with inside this
         # insert group.
@@ -277,7 +299,7 @@ class DiffOpcodeGenerator(object):
         # corresponding consecutive delete line.
         #
         # r_move_ranges represents deleted move ranges. The key is a
-        # string in the form of "{i1}-{i2}-{j1}-{j2}", with those
+        # tuple in the form of (i1, i2, j1, j2), with those
         # positions taken from the remove group for the line. The value
         # is a tuple of (r_start, r_end, r_group). These values are used to
         # quickly locate deleted lines we've found that match the inserted
@@ -305,24 +327,36 @@ class DiffOpcodeGenerator(object):
                 # for this particular move block we're processing then we'll
                 # update the range.
                 #
-                # The way we do that is to find each removed line that matches
-                # this inserted line, and for each of those find out if there's
-                # an existing move range that the found removed line
-                # immediately follows. If there is, we update the existing
+                # The way we do that is to find each remove group with a line
+                # matching this inserted line, and for each of those find out
+                # if there's an existing move range in that group which the
+                # matching line immediately follows. That's a matter of
+                # checking the removed line after the range, so this only
+                # looks at each group once, no matter how many times the
+                # line appears in it. If there is, we update the existing
                 # range.
                 #
                 # If there isn't any move information for this line, we'll
                 # simply add it to the move ranges.
-                for ri, rgroup in self.removes.get(iline, []):
-                    key = '%s-%s-%s-%s' % rgroup[1:5]
-                    prev_key = key
+                matches = self.removes[iline]
+                prev_key = matches[-1][2]
+
+                self.move_work += len(matches)
 
+                if self.move_budget and self.move_work > self.move_budget:
+                    self.move_budget_exceeded = True
+                    return
+
+                for ri, rgroup, key in matches:
                     r_move_range = r_move_ranges.get(key)
 
                     if r_move_range:
-                        # If the remove information for the line is next in
-                        # the sequence for this calculated move range...
-                        if ri == r_move_range[1] + 1:
+                        # If the removed line after this calculated move range
+                        # is part of the group and matches the line...
+                        ri = r_move_range[1] + 1
+
+                        if (ri < key[1] and
+                            self.differ.a[ri].strip() == iline):
                             # This is part of the current range, so update
                             # the end of the range to include it.
                             r_move_ranges[key] = (r_move_range[0], ri, rgroup)
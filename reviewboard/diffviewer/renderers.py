@@ -1,14 +1,19 @@
 from __future__ import unicode_literals
 
+import itertools
+
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
 from django.template import Context
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.utils import six
 from django.utils.translation import ugettext as _, get_language
-from djblets.cache.backend import cache_memoize
+from djblets.cache.backend import (CACHE_CHUNK_SIZE, cache_memoize,
+                                   make_cache_key)
 
 from reviewboard.diffviewer.chunk_generator import compute_chunk_last_header
+from reviewboard.diffviewer.diffutils import get_diff_cost_budget
 from reviewboard.diffviewer.errors import UserVisibleError
 
 
@@ -29,7 +34,16 @@ class DiffRenderer(object):
     Note that any of the render functions are meant to be called only once per
     DiffRenderer. It will alter the state of the renderer, possibly
     disrupting future render calls.
+
+    A whole file's diff can also be streamed using
+    render_to_streaming_response. This renders the header, each chunk and
+    the footer separately, using the templates that make up the main
+    diff fragment template.
     """
+    header_template_name = 'diffviewer/diff_file_fragment_header.html'
+    chunk_template_name = 'diffviewer/diff_file_fragment_chunk.html'
+    footer_template_name = 'diffviewer/diff_file_fragment_footer.html'
+
     def __init__(self, diff_file, chunk_index=None, highlighting=False,
                  collapse_all=True, lines_of_context=None, extra_context=None,
                  allow_caching=True,
@@ -51,7 +65,10 @@ class DiffRenderer(object):
         if self.chunk_index is not None:
             assert not self.lines_of_context or self.collapse_all
 
-            self.num_chunks = len(self.diff_file['chunks'])
+            # The diff file may only contain the chunk being rendered,
+            # in which case it knows how many chunks there are in total.
+            self.num_chunks = self.diff_file.get('num_chunks',
+                                                 len(self.diff_file['chunks']))
 
             if self.chunk_index < 0 or self.chunk_index >= self.num_chunks:
                 raise UserVisibleError(
@@ -61,6 +78,19 @@ class DiffRenderer(object):
         """Renders the diff to an HttpResponse."""
         return HttpResponse(self.render_to_string())
 
+    def render_to_streaming_response(self):
+        """Renders the diff to a StreamingHttpResponse.
+
+        The diff is sent to the client in pieces as it's rendered (see
+        iter_render). The first piece is rendered before the response is
+        returned, so that any errors in loading the file are raised here
+        rather than partway through the response.
+        """
+        content = self.iter_render()
+        first = next(content)
+
+        return StreamingHttpResponse(itertools.chain([first], content))
+
     def render_to_string(self):
         """Returns the diff as a string.
 
@@ -89,6 +119,112 @@ class DiffRenderer(object):
         return render_to_string(self.template_name,
                                 Context(self.make_context()))
 
+    def iter_render(self):
+        """Renders a whole file's diff, yielding the HTML in pieces.
+
+        The file's chunks may be provided as an iterator (such as one from
+        iter_diff_chunks), in which case each chunk is rendered as soon as
+        it's generated, and the list of chunks in the diff file is filled in
+        as they're rendered. Each chunk is rendered once the next one is
+        available, since collapsed chunks need to know if they're the last
+        in the file. The header is held back until there's a change that
+        isn't whitespace-only (or the file ends), since it depends on
+        whether the file only contains whitespace changes.
+
+        As with render_to_string, the diff will be pulled from the cache if
+        it's there. Otherwise, it will be stored in the cache once rendered,
+        so long as it fits in a single cache entry. Only the rendered HTML
+        under that size is held in memory while rendering.
+        """
+        assert self.chunk_index is None and not self.lines_of_context
+
+        cache_key = None
+
+        if self.allow_caching:
+            cache_key = self.make_cache_key()
+            content = cache.get(make_cache_key(cache_key))
+
+            if content is not None:
+                yield content
+                return
+
+        chunks = iter(self.diff_file['chunks'])
+
+        if self.diff_file.get('moved'):
+            # Moved files are shown differently when there are no changes,
+            # which isn't known until all the chunks have been generated.
+            self.diff_file['chunks'] = list(chunks)
+            content = self.render_to_string_uncached()
+
+            if cache_key:
+                cache_memoize(cache_key, lambda: content,
+                              force_overwrite=True)
+
+            yield content
+            return
+
+        self.diff_file['chunks'] = []
+        context = Context(self.make_context())
+        cached_parts = []
+        cache_state = {
+            'size': 0,
+            'enabled': cache_key is not None,
+        }
+
+        def _render(template_name, chunk=None):
+            if chunk is None:
+                content = get_template(template_name).render(context)
+            else:
+                context.update({'chunk': chunk})
+                content = get_template(template_name).render(context)
+                context.pop()
+
+            if cache_state['enabled']:
+                cache_state['size'] += len(content)
+
+                if cache_state['size'] < CACHE_CHUNK_SIZE:
+                    cached_parts.append(content)
+                else:
+                    cache_state['enabled'] = False
+                    del cached_parts[:]
+
+            return content
+
+        pending = []
+        header_rendered = False
+
+        for chunk in chunks:
+            self.diff_file['chunks'].append(chunk)
+            pending.append(chunk)
+
+            if not header_rendered:
+                if self.diff_file['whitespace_only']:
+                    continue
+
+                yield _render(self.header_template_name)
+                header_rendered = True
+
+            while len(pending) > 1:
+                yield _render(self.chunk_template_name, pending.pop(0))
+
+        if not header_rendered:
+            yield _render(self.header_template_name)
+
+        for chunk in pending:
+            yield _render(self.chunk_template_name, chunk)
+
+        context['equal_lines'] = sum(
+            chunk['numlines']
+            for chunk in self.diff_file['chunks']
+            if chunk['change'] == 'equal'
+        )
+
+        yield _render(self.footer_template_name)
+
+        if cache_state['enabled']:
+            content = ''.join(cached_parts)
+            cache_memoize(cache_key, lambda: content, force_overwrite=True)
+
     def make_cache_key(self):
         """Creates and returns a cache key representing the diff to render."""
         filediff = self.diff_file['filediff']
@@ -117,6 +253,9 @@ class DiffRenderer(object):
         if self.highlighting:
             key += '-highlighting'
 
+        # Files diffed under a different cost budget may render differently.
+        key += '-budget%s' % get_diff_cost_budget(filediff.diffset.repository)
+
         key += '-%s-%s' % (get_language(), settings.AJAX_SERIAL)
 
         return key
@@ -128,8 +267,7 @@ class DiffRenderer(object):
         if self.chunk_index is not None:
             # We're rendering a specific chunk within a file's diff, rather
             # than the whole diff.
-            self.diff_file['chunks'] = \
-                [self.diff_file['chunks'][self.chunk_index]]
+            self.diff_file['chunks'] = [self._get_chunk(self.chunk_index)]
 
             if self.lines_of_context:
                 # We're rendering a specific range of lines within this chunk,
@@ -231,6 +369,24 @@ class DiffRenderer(object):
 
         return context
 
+    def _get_chunk(self, index):
+        """Returns the chunk with the given index.
+
+        This handles diff files containing all their chunks, and those
+        containing only some of them.
+        """
+        chunks = self.diff_file['chunks']
+
+        if len(chunks) == self.num_chunks:
+            return chunks[index]
+
+        for chunk in chunks:
+            if chunk.get('index') == index:
+                return chunk
+
+        raise UserVisibleError(
+            _('Invalid chunk index %s specified.') % index)
+
 
 _diff_renderer_class = DiffRenderer
 
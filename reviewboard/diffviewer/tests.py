@@ -2,9 +2,16 @@ from __future__ import unicode_literals
 
 import imp
 import os
+import re
+import time
 
+from datetime import timedelta
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.utils.six.moves import zip_longest
 from djblets.cache.backend import cache_memoize
 from djblets.siteconfig.models import SiteConfiguration
@@ -13,10 +20,20 @@ import nose
 
 import reviewboard.diffviewer.diffutils as diffutils
 import reviewboard.diffviewer.parser as diffparser
-from reviewboard.diffviewer.chunk_generator import DiffChunkGenerator
+from reviewboard.diffviewer.chunk_generator import (
+    DiffChunkGenerator,
+    get_diff_chunk_generator_class,
+    get_lexer_for_file,
+    get_syntax_highlighting_timeouts,
+    set_diff_chunk_generator_class)
+from reviewboard.diffviewer.differ import DiffCompatVersion, get_differ
 from reviewboard.diffviewer.errors import UserVisibleError
+from reviewboard.diffviewer.filecache import (get_patched_file_cache,
+                                              PatchedFileCache)
 from reviewboard.diffviewer.forms import UploadDiffForm
-from reviewboard.diffviewer.models import DiffSet, FileDiff
+from reviewboard.diffviewer.histogramdiff import HistogramDiffer
+from reviewboard.diffviewer.models import (DiffChunkJob, DiffSet, FileDiff,
+                                          FileDiffData)
 from reviewboard.diffviewer.myersdiff import MyersDiffer
 from reviewboard.diffviewer.opcode_generator import get_diff_opcode_generator
 from reviewboard.diffviewer.renderers import DiffRenderer
@@ -25,6 +42,7 @@ from reviewboard.diffviewer.processors import (filter_interdiff_opcodes,
 from reviewboard.diffviewer.templatetags.difftags import highlightregion
 from reviewboard.scmtools.models import Repository, Tool
 from reviewboard.testing import TestCase
+from reviewboard.webapi.resources import resources
 
 
 class MyersDifferTest(TestCase):
@@ -50,11 +68,163 @@ class MyersDifferTest(TestCase):
                           ("insert", 5, 5, 5, 9),
                           ("equal", 5, 8, 9, 12)])
 
+    def test_diff_within_cost_budget(self):
+        """Testing MyersDiffer with a diff within its cost budget"""
+        differ = MyersDiffer(['1', '2', '3', '7'],
+                             ['1', '2', '4', '5', '6', '7'],
+                             cost_budget=100)
+
+        self.assertEqual(list(differ.get_opcodes()), [
+            ('equal', 0, 2, 0, 2),
+            ('replace', 2, 3, 2, 3),
+            ('insert', 3, 3, 3, 5),
+            ('equal', 3, 4, 5, 6),
+        ])
+        self.assertEqual(differ.strategy, MyersDiffer.STRATEGY_MYERS)
+
+    def test_diff_exceeding_cost_budget(self):
+        """Testing MyersDiffer falls back when exceeding its cost budget"""
+        a = ['a', 'x', 'y', 'x', 'y', 'b', 'x', 'y', 'x', 'y', 'c']
+        b = ['a', 'y', 'x', 'y', 'x', 'c', 'y', 'x', 'y', 'x', 'b']
+
+        differ = MyersDiffer(a, b, cost_budget=25)
+
+        # The lines unique to both files ("a" and "c") anchor the diff.
+        self.assertEqual(list(differ.get_opcodes()), [
+            ('equal', 0, 1, 0, 1),
+            ('replace', 1, 5, 1, 5),
+            ('delete', 5, 10, 5, 5),
+            ('equal', 10, 11, 5, 6),
+            ('insert', 11, 11, 6, 11),
+        ])
+        self.assertEqual(differ.strategy, MyersDiffer.STRATEGY_PATIENCE)
+
+    def test_diff_with_files_larger_than_cost_budget(self):
+        """Testing MyersDiffer falls back when the files are larger than
+        its cost budget
+        """
+        differ = MyersDiffer(['1', '2', '3'], ['1', '3'], cost_budget=4)
+
+        self.assertEqual(list(differ.get_opcodes()), [
+            ('equal', 0, 1, 0, 1),
+            ('delete', 1, 2, 1, 1),
+            ('equal', 2, 3, 1, 2),
+        ])
+        self.assertEqual(differ.strategy, MyersDiffer.STRATEGY_PATIENCE)
+        self.assertEqual(differ.fdiag, None)
+
+    def test_line_codes(self):
+        """Testing MyersDiffer assigns shared codes to lines in both files"""
+        differ = MyersDiffer(['a', 'b', '  a'], ['b', 'c', 'a'],
+                             ignore_space=True)
+        list(differ.get_opcodes())
+
+        self.assertEqual(list(differ.a_data.data), [1, 2, 1])
+        self.assertEqual(list(differ.b_data.data), [2, 3, 1])
+        self.assertEqual(list(differ.a_data.modified), [1, 0, 0])
+        self.assertEqual(list(differ.b_data.modified), [0, 1, 0])
+
+    def test_diff_with_search_ranges(self):
+        """Testing MyersDiffer only searching the given ranges"""
+        a = ['1', '2', '3', '4', '5', '6', '7', '8']
+        b = ['1', '2', '2.5', '3', '4', '5', '7', '8']
+
+        differ = MyersDiffer(a, b, search_ranges=[(1, 3, 1, 4),
+                                                  (5, 7, 6, 7)])
+
+        self.assertEqual(list(differ.get_opcodes()),
+                         list(MyersDiffer(a, b).get_opcodes()))
+        self.assertEqual(differ.strategy, MyersDiffer.STRATEGY_MYERS)
+
+        # Lines outside of the ranges that differ cause a full search.
+        differ = MyersDiffer(a, b, search_ranges=[(1, 3, 1, 4)])
+
+        self.assertEqual(list(differ.get_opcodes()),
+                         list(MyersDiffer(a, b).get_opcodes()))
+        self.assertEqual(differ.search_ranges, [(1, 3, 1, 4)])
+        self.assertEqual(differ._get_search_ranges(), None)
+
     def __test_diff(self, a, b, expected):
         opcodes = list(MyersDiffer(a, b).get_opcodes())
         self.assertEquals(opcodes, expected)
 
 
+class HistogramDifferTest(TestCase):
+    def test_diff(self):
+        """Testing HistogramDiffer"""
+        self.assertEqual(
+            list(HistogramDiffer(['1', '2', '3'], ['1', '2', '3'])
+                 .get_opcodes()),
+            [('equal', 0, 3, 0, 3)])
+        self.assertEqual(
+            list(HistogramDiffer(['1', '2', '3'], []).get_opcodes()),
+            [('delete', 0, 3, 0, 0)])
+        self.assertEqual(
+            list(HistogramDiffer(['1', '2', '3', '7'],
+                                 ['1', '2', '4', '5', '6', '7'])
+                 .get_opcodes()),
+            [('equal', 0, 2, 0, 2),
+             ('replace', 2, 3, 2, 3),
+             ('insert', 3, 3, 3, 5),
+             ('equal', 3, 4, 5, 6)])
+
+    def test_diff_anchors_on_rare_lines(self):
+        """Testing HistogramDiffer anchors on the rarest common lines"""
+        a = ['old();', '}', 'keep();', '}', '}']
+        b = ['new();', '}', '}', 'added();', 'keep();', '}']
+
+        differ = HistogramDiffer(a, b)
+
+        self.assertEqual(list(differ.get_opcodes()), [
+            ('replace', 0, 1, 0, 1),
+            ('equal', 1, 2, 1, 2),
+            ('insert', 2, 2, 2, 4),
+            ('equal', 2, 4, 4, 6),
+            ('delete', 4, 5, 6, 6),
+        ])
+        self.assertEqual(differ.strategy, HistogramDiffer.STRATEGY_HISTOGRAM)
+
+        # The Myers diff keeps the closing braces, and loses "keep();".
+        self.assertNotIn(('equal', 2, 3, 4, 5),
+                         list(MyersDiffer(a, b).get_opcodes()))
+
+    def test_diff_with_common_lines(self):
+        """Testing HistogramDiffer falls back on the Myers diff for lines
+        that are too common
+        """
+        count = HistogramDiffer.MAX_CHAIN_LENGTH + 1
+        a = ['a'] + ['}'] * count + ['x']
+        b = ['b'] + ['}'] * 5 + ['y'] + ['}'] * (count - 5) + ['z']
+
+        differ = HistogramDiffer(a, b)
+
+        self.assertEqual(list(differ.get_opcodes()),
+                         list(MyersDiffer(a, b).get_opcodes()))
+        self.assertNotEqual(differ.fdiag, None)
+
+    def test_diff_exceeding_cost_budget(self):
+        """Testing HistogramDiffer falls back when exceeding its cost
+        budget
+        """
+        differ = HistogramDiffer(['1', '2', '3'], ['1', '3'], cost_budget=4)
+
+        self.assertEqual(list(differ.get_opcodes()), [
+            ('equal', 0, 1, 0, 1),
+            ('delete', 1, 2, 1, 1),
+            ('equal', 2, 3, 1, 2),
+        ])
+        self.assertEqual(differ.strategy, MyersDiffer.STRATEGY_PATIENCE)
+
+    def test_get_differ(self):
+        """Testing get_differ with DiffCompatVersion.HISTOGRAM"""
+        differ = get_differ(['a'], ['b'],
+                            compat_version=DiffCompatVersion.HISTOGRAM,
+                            cost_budget=100)
+
+        self.assertTrue(isinstance(differ, HistogramDiffer))
+        self.assertEqual(differ.cost_budget, 100)
+
+
 class InterestingLinesTest(TestCase):
     PREFIX = os.path.join(os.path.dirname(__file__), 'testdata')
 
@@ -276,6 +446,113 @@ class DiffParserTest(TestCase):
         self.assertEqual(diff, files[0].data)
         self.assertEqual(patched, new)
 
+    def test_patch_in_memory(self):
+        """Testing patching in memory matches the patch command"""
+        for filename in os.listdir(os.path.join(self.PREFIX, 'orig_src')):
+            diff_path = os.path.join(self.PREFIX, 'diffs', 'unified',
+                                     '%s.diff' % filename)
+
+            if not os.path.exists(diff_path):
+                continue
+
+            old = diffutils.convert_line_endings(
+                self._get_file('orig_src', filename))
+            diff = diffutils.convert_line_endings(
+                self._get_file('diffs', 'unified', '%s.diff' % filename))
+
+            patched = diffutils.patch_in_memory(diff, old)
+            self.assertNotEqual(patched, None)
+            self.assertEqual(patched,
+                             diffutils.patch_with_subprocess(diff, old,
+                                                             filename))
+
+    def test_patch_in_memory_with_offset(self):
+        """Testing patching in memory with hunks at an offset"""
+        old = self._get_file('orig_src', 'foo.c')
+        new = self._get_file('new_src', 'foo.c')
+        diff = self._get_file('diffs', 'unified', 'foo.c.diff')
+
+        # Hunks with context on both sides can be moved.
+        diff = diff.replace(b'-1,5 +1,8', b'-2,5 +2,8')
+        patched = diffutils.patch_in_memory(diff, old)
+        self.assertEqual(patched, new)
+
+    def test_patch_in_memory_with_fuzz(self):
+        """Testing patching in memory with hunks requiring fuzz"""
+        old = b'a\nb\nc\nd\n'
+        diff = (
+            b'--- a\n'
+            b'+++ a\n'
+            b'@@ -1,3 +1,3 @@\n'
+            b' a\n'
+            b'-x\n'
+            b'+y\n'
+            b' c\n'
+        )
+
+        self.assertEqual(diffutils.patch_in_memory(diff, old), None)
+
+    def test_patch_in_memory_matches_patch_command(self):
+        """Testing patching in memory with offsets and asymmetric context
+        matches the patch command, falling back on it for fuzz
+        """
+        old = b''.join(b'%d\n' % i for i in range(1, 21))
+        header = b'--- f\n+++ f\n'
+
+        # Each is a hunk, and whether it can be applied without fuzz.
+        hunks = [
+            # Symmetric context, at an offset.
+            (b'@@ -2,7 +2,7 @@\n 5\n 6\n 7\n-8\n+eight\n 9\n 10\n 11\n',
+             True),
+
+            # Less leading context, away from the start of the file.
+            (b'@@ -7,5 +7,5 @@\n 7\n-8\n+eight\n 9\n 10\n 11\n', True),
+
+            # Less leading context, away from the start of the file and at
+            # an offset.
+            (b'@@ -4,5 +4,5 @@\n 7\n-8\n+eight\n 9\n 10\n 11\n', True),
+
+            # Less leading context, at the start of the file.
+            (b'@@ -1,4 +1,4 @@\n-1\n+one\n 2\n 3\n 4\n', True),
+
+            # Less trailing context, at the end of the file and at an
+            # offset.
+            (b'@@ -10,4 +10,4 @@\n 17\n 18\n 19\n-20\n+twenty\n', True),
+
+            # Less leading context, claiming to be at the start of the
+            # file, but found later on.
+            (b'@@ -1,5 +1,5 @@\n 7\n-8\n+eight\n 9\n 10\n 11\n', False),
+
+            # Less trailing context, away from the end of the file.
+            (b'@@ -5,5 +5,5 @@\n 5\n 6\n 7\n-8\n+eight\n 9\n', False),
+
+            # Mismatched context.
+            (b'@@ -5,7 +5,7 @@\n X\n 6\n 7\n-8\n+eight\n 9\n 10\n 11\n',
+             False),
+        ]
+
+        for hunk, applies_in_memory in hunks:
+            diff = header + hunk
+            expected = diffutils.patch_with_subprocess(diff, old, 'f')
+            patched = diffutils.patch_in_memory(diff, old)
+
+            if applies_in_memory:
+                self.assertEqual(patched, expected)
+            else:
+                self.assertEqual(patched, None)
+
+            self.assertEqual(diffutils.patch(diff, old, 'f'), expected)
+
+    def test_patch_in_memory_with_context_diff(self):
+        """Testing patching in memory with a context diff"""
+        old = self._get_file('orig_src', 'foo.c')
+        diff = self._get_file('diffs', 'context', 'foo.c.diff')
+
+        self.assertEqual(diffutils.patch_in_memory(diff, old), None)
+
+        patched = diffutils.patch(diff, old, 'foo.c')
+        self.assertEqual(patched, self._get_file('new_src', 'foo.c'))
+
     def test_move_detection(self):
         """Testing diff viewer move detection"""
         # movetest1 has two blocks of code that would appear to be moves:
@@ -487,6 +764,36 @@ class DiffParserTest(TestCase):
         with open(path, 'rb') as f:
             return f.read()
 
+    def test_move_detection_with_budget(self):
+        """Testing diff viewer move detection with a move detection budget"""
+        a = [
+            'this is line 1, and it is sufficiently long',
+            '-------------------------------------------',
+            '-------------------------------------------',
+            'this is line 2, and it is sufficiently long',
+        ]
+        b = [
+            'this is line 2, and it is sufficiently long',
+            '-------------------------------------------',
+            '-------------------------------------------',
+            'this is line 1, and it is sufficiently long',
+        ]
+
+        siteconfig = SiteConfiguration.objects.get_current()
+        old_budget = siteconfig.get('diffviewer_move_detection_budget')
+
+        try:
+            # Only the first move should be found before the budget is
+            # exceeded.
+            siteconfig.set('diffviewer_move_detection_budget', 1)
+            self._test_move_detection(a, b, [{1: 4}], [{4: 1}])
+
+            siteconfig.set('diffviewer_move_detection_budget', 2)
+            self._test_move_detection(a, b, [{1: 4}, {4: 1}],
+                                      [{1: 4}, {4: 1}])
+        finally:
+            siteconfig.set('diffviewer_move_detection_budget', old_budget)
+
     def _test_move_detection(self, a, b, expected_i_moves, expected_r_moves):
         differ = MyersDiffer(a, b)
         opcode_generator = get_diff_opcode_generator(differ)
@@ -697,6 +1004,81 @@ class FileDiffMigrationTests(TestCase):
         self.assertEqual(self.filediff.diff_hash.insert_count, 10)
         self.assertEqual(self.filediff.diff_hash.delete_count, 20)
 
+    def test_migrate_all(self):
+        """Testing FileDiffManager.migrate_all"""
+        FileDiffData.objects.get_or_create(
+            binary_hash=self.filediff._hash_hexdigest(self.parent_diff),
+            defaults={'binary': self.parent_diff})
+
+        filediffs = self._create_filediffs([
+            (self.diff, ''),
+            (self.diff, self.parent_diff),
+            (self.parent_diff, ''),
+            (self.diff, ''),
+        ])
+
+        results = []
+        info = FileDiff.objects.migrate_all(batch_size=2,
+                                            callback=results.append)
+
+        self.assertEqual([result['diffs_migrated'] for result in results],
+                         [2, 4])
+        self.assertEqual([result['last_pk'] for result in results],
+                         [filediffs[1].pk, filediffs[3].pk])
+
+        diff_size = len(self.diff)
+        parent_diff_size = len(self.parent_diff)
+
+        self.assertEqual(info['diffs_migrated'], 4)
+        self.assertEqual(info['old_diff_size'],
+                         3 * diff_size + 2 * parent_diff_size)
+        self.assertEqual(info['bytes_saved'],
+                         2 * diff_size + 2 * parent_diff_size)
+        self.assertEqual(info['new_diff_size'], diff_size)
+
+        self.assertEqual(FileDiffData.objects.count(), 2)
+        self.assertFalse(FileDiff.objects.unmigrated().exists())
+
+        filediffs = FileDiff.objects.filter(pk__in=[
+            filediff.pk for filediff in filediffs
+        ]).order_by('pk')
+
+        self.assertEqual(
+            [(filediff.diff64, filediff.parent_diff64)
+             for filediff in filediffs],
+            [('', '')] * 4)
+        self.assertEqual(
+            [(filediff.diff, filediff.parent_diff) for filediff in filediffs],
+            [(self.diff, None),
+             (self.diff, self.parent_diff),
+             (self.parent_diff, None),
+             (self.diff, None)])
+
+    def test_migrate_all_with_start_pk(self):
+        """Testing FileDiffManager.migrate_all with start_pk"""
+        filediffs = self._create_filediffs([
+            (self.diff, ''),
+            (self.parent_diff, ''),
+        ])
+
+        info = FileDiff.objects.migrate_all(start_pk=filediffs[0].pk)
+
+        self.assertEqual(info['diffs_migrated'], 1)
+        self.assertEqual(info['last_pk'], filediffs[1].pk)
+        self.assertEqual(
+            list(FileDiff.objects.unmigrated().values_list('pk', flat=True)),
+            [filediffs[0].pk])
+
+    def _create_filediffs(self, diffs):
+        return [
+            FileDiff.objects.create(source_file='README',
+                                    dest_file='README',
+                                    diffset=self.filediff.diffset,
+                                    diff64=diff,
+                                    parent_diff64=parent_diff)
+            for diff, parent_diff in diffs
+        ]
+
 
 class HighlightRegionTest(TestCase):
     def setUp(self):
@@ -832,6 +1214,41 @@ class DiffSetManagerTests(SpyAgency, TestCase):
             repository, 'diff', diff, None, None, None, '/', None)
 
         self.assertEqual(diffset.files.count(), 1)
+        self.assertEqual(DiffChunkJob.objects.count(), 0)
+
+    def test_creating_with_diff_data_queues_chunk_jobs(self):
+        """Test creating a DiffSet from diff file data queues jobs to
+        generate its chunks
+        """
+        diff = (
+            b'diff --git a/README b/README\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- README\n'
+            b'+++ README\n'
+            b'@ -1,1 +1,1 @@\n'
+            b'-blah..\n'
+            b'+blah blah\n'
+        )
+
+        repository = self.create_repository(tool_name='Test')
+
+        self.spy_on(repository.get_file_exists,
+                    call_fake=lambda *args, **kwargs: True)
+
+        siteconfig = SiteConfiguration.objects.get_current()
+        siteconfig.set('diffviewer_precompute_chunks', True)
+        siteconfig.save()
+
+        try:
+            diffset = DiffSet.objects.create_from_data(
+                repository, 'diff', diff, None, None, None, '/', None)
+        finally:
+            siteconfig.set('diffviewer_precompute_chunks', False)
+            siteconfig.save()
+
+        job = DiffChunkJob.objects.get()
+        self.assertEqual(job.filediff, diffset.files.get())
+        self.assertEqual(job.priority, DiffChunkJob.PRIORITY_UPLOAD)
 
 
 class UploadDiffFormTests(SpyAgency, TestCase):
@@ -1571,6 +1988,8 @@ class DiffOpcodeGeneratorTests(TestCase):
 
 class DiffRendererTests(SpyAgency, TestCase):
     """Unit tests for DiffRenderer."""
+    fixtures = ['test_scmtools']
+
     def test_construction_with_invalid_chunks(self):
         """Testing DiffRenderer construction with invalid chunks"""
         diff_file = {
@@ -1650,6 +2069,39 @@ class DiffRendererTests(SpyAgency, TestCase):
         self.assertFalse(renderer.make_cache_key.called)
         self.assertFalse(cache_memoize.spy.called)
 
+    def test_make_cache_key_with_changed_cost_budget(self):
+        """Testing DiffRenderer.make_cache_key with a changed diff cost
+        budget
+        """
+        repository = self.create_repository()
+        diffset = self.create_diffset(repository=repository)
+        diff_file = {
+            'chunks': [{}],
+            'filediff': self.create_filediff(diffset),
+            'interfilediff': None,
+            'force_interdiff': False,
+            'index': 0,
+        }
+
+        siteconfig = SiteConfiguration.objects.get_current()
+        old_budgets = \
+            siteconfig.get('diffviewer_repository_diff_cost_budgets')
+
+        # The serial is normally set up by the extension manager.
+        try:
+            with self.settings(AJAX_SERIAL=1):
+                key = DiffRenderer(diff_file).make_cache_key()
+
+                siteconfig.set('diffviewer_repository_diff_cost_budgets', {
+                    '%s' % repository.pk: 50,
+                })
+
+                self.assertNotEqual(
+                    DiffRenderer(diff_file).make_cache_key(), key)
+        finally:
+            siteconfig.set('diffviewer_repository_diff_cost_budgets',
+                           old_budgets)
+
     def test_make_context_with_chunk_index(self):
         """Testing DiffRenderer.make_context with chunk_index"""
         diff_file = {
@@ -1687,9 +2139,698 @@ class DiffRendererTests(SpyAgency, TestCase):
         chunk = diff_file['chunks'][0]
         self.assertEqual(chunk['change'], 'replace')
 
+    def test_iter_render(self):
+        """Testing DiffRenderer.iter_render matches render_to_string"""
+        cache.clear()
+
+        orig = b''.join(b'line %d\n' % i for i in range(1, 41))
+        diff = (
+            b'diff --git a/README b/README\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- README\n'
+            b'+++ README\n'
+            b'@@ -17,7 +17,7 @@\n'
+            b' line 17\n'
+            b' line 18\n'
+            b' line 19\n'
+            b'-line 20\n'
+            b'+line twenty\n'
+            b' line 21\n'
+            b' line 22\n'
+            b' line 23\n'
+        )
+
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        diffset.diffcompat = DiffCompatVersion.DEFAULT
+        filediff = self.create_filediff(diffset, source_file='README',
+                                        dest_file='README', diff=diff)
+
+        self.spy_on(repository.get_file,
+                    call_fake=lambda *args, **kwargs: orig)
+        self.spy_on(DiffRenderer.make_cache_key,
+                    call_fake=lambda self: 'my-cache-key')
+
+        files = diffutils.get_diff_files(diffset, filediff)
+        diffutils.populate_diff_chunks(files, False)
+        expected = DiffRenderer(files[0]).render_to_string_uncached()
+
+        diff_file = diffutils.get_diff_files(diffset, filediff)[0]
+        diff_file['chunks'] = diffutils.iter_diff_chunks(diff_file, False)
+        renderer = DiffRenderer(diff_file)
+        parts = list(renderer.iter_render())
+
+        # The header, each chunk and the footer.
+        self.assertEqual(diff_file['num_chunks'], 5)
+        self.assertEqual(diff_file['num_changes'], 1)
+        self.assertEqual(len(diff_file['chunks']), 5)
+        self.assertEqual(len(parts), 7)
+        self.assertEqual(self._normalize_html(''.join(parts)),
+                         self._normalize_html(expected))
+        self.assertIn('data-lines-equal="39"', expected)
+
+        # The rendered diff should now be in the cache.
+        diff_file = diffutils.get_diff_files(diffset, filediff)[0]
+        diff_file['chunks'] = diffutils.iter_diff_chunks(diff_file, False)
+        self.spy_on(DiffRenderer.render_to_string_uncached)
+
+        self.assertEqual(self._normalize_html(
+                             DiffRenderer(diff_file).render_to_string()),
+                         self._normalize_html(''.join(parts)))
+        self.assertFalse(DiffRenderer.render_to_string_uncached.spy.called)
+
+    def test_render_to_streaming_response(self):
+        """Testing DiffRenderer.render_to_streaming_response"""
+        diff_file = {
+            'chunks': iter([]),
+        }
+
+        renderer = DiffRenderer(diff_file)
+        self.spy_on(renderer.iter_render,
+                    call_fake=lambda self: iter(['Foo', 'Bar']))
+
+        response = renderer.render_to_streaming_response()
+
+        self.assertTrue(renderer.iter_render.called)
+        self.assertTrue(isinstance(response, StreamingHttpResponse))
+        self.assertEqual(b''.join(response.streaming_content), b'FooBar')
+
+    def _normalize_html(self, html):
+        return re.sub(r'\s+', ' ', html).replace('> <', '><').strip()
+
+
+class DiffChunkCacheTests(SpyAgency, TestCase):
+    """Unit tests for the chunk-level caching of diff chunks."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(DiffChunkCacheTests, self).setUp()
+
+        cache.clear()
+
+        orig = b''.join(b'line %d\n' % i for i in range(1, 41))
+        diff = (
+            b'diff --git a/README b/README\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- README\n'
+            b'+++ README\n'
+            b'@@ -17,7 +17,7 @@\n'
+            b' line 17\n'
+            b' line 18\n'
+            b' line 19\n'
+            b'-line 20\n'
+            b'+line twenty\n'
+            b' line 21\n'
+            b' line 22\n'
+            b' line 23\n'
+        )
+
+        self.repository = self.create_repository(tool_name='Test')
+        self.diffset = self.create_diffset(repository=self.repository)
+        self.diffset.diffcompat = DiffCompatVersion.DEFAULT
+        self.filediff = self.create_filediff(self.diffset,
+                                             source_file='README',
+                                             dest_file='README',
+                                             diff=diff)
+
+        self.spy_on(self.repository.get_file,
+                    call_fake=lambda *args, **kwargs: orig)
+
+    def test_get_chunks(self):
+        """Testing DiffChunkGenerator.get_chunks with cached chunks"""
+        chunks = DiffChunkGenerator(None, self.filediff).get_chunks()
+        self.assertEqual(len(self.repository.get_file.calls), 1)
+
+        generator = DiffChunkGenerator(None, self.filediff)
+        self.assertEqual(generator.get_chunks(), chunks)
+        self.assertEqual(generator.get_chunks_by_index([2]), [chunks[2]])
+        self.assertEqual(len(self.repository.get_file.calls), 1)
+
+        summaries = generator.get_chunk_summaries()
+        self.assertEqual(len(summaries), len(chunks))
+
+        for summary, chunk in zip(summaries, chunks):
+            self.assertEqual(summary['change'], chunk['change'])
+            self.assertEqual(summary['numlines'], chunk['numlines'])
+            self.assertEqual(summary['first_line'], chunk['lines'][0][0])
+            self.assertEqual(summary['last_line'], chunk['lines'][-1][0])
+
+    def test_get_chunks_with_changed_cost_budget(self):
+        """Testing DiffChunkGenerator.get_chunks with the repository's diff
+        cost budget changed since the chunks were cached
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+        old_budgets = \
+            siteconfig.get('diffviewer_repository_diff_cost_budgets')
+
+        DiffChunkGenerator(None, self.filediff).get_chunks()
+        self.assertEqual(len(self.repository.get_file.calls), 1)
+
+        try:
+            siteconfig.set('diffviewer_repository_diff_cost_budgets', {
+                '%s' % self.repository.pk: 50,
+            })
+
+            DiffChunkGenerator(None, self.filediff).get_chunks()
+            self.assertEqual(len(self.repository.get_file.calls), 2)
+        finally:
+            siteconfig.set('diffviewer_repository_diff_cost_budgets',
+                           old_budgets)
+
+    def test_get_chunks_by_index_with_missing_chunks(self):
+        """Testing DiffChunkGenerator.get_chunks_by_index with chunks
+        missing from the cache
+        """
+        generator = DiffChunkGenerator(None, self.filediff)
+        chunks = generator.get_chunks()
+
+        # Only the requested chunks should be needed.
+        cache.delete(generator._make_chunk_cache_key(0, 0))
+        self.assertEqual(generator.get_chunks_by_index([2, 3]), chunks[2:4])
+        self.assertEqual(len(self.repository.get_file.calls), 1)
+
+        # A missing chunk should cause them all to be regenerated.
+        self.assertEqual(generator.get_chunks_by_index([0]), chunks[:1])
+        self.assertEqual(len(self.repository.get_file.calls), 2)
+
+    def test_populate_diff_chunks_prefetches_original_files(self):
+        """Testing populate_diff_chunks fetches original files together,
+        skipping files with cached chunks
+        """
+        filediff2 = self.create_filediff(self.diffset,
+                                         source_file='README2',
+                                         dest_file='README2',
+                                         diff=self.filediff.diff)
+        filediff3 = self.create_filediff(self.diffset,
+                                         source_file='README3',
+                                         dest_file='README3',
+                                         diff=self.filediff.diff)
+
+        DiffChunkGenerator(None, self.filediff).get_chunks()
+        self.spy_on(self.repository.get_files,
+                    call_fake=lambda *args, **kwargs: {})
+
+        files = [
+            {
+                'filediff': filediff,
+                'interfilediff': None,
+                'force_interdiff': False,
+            }
+            for filediff in (self.filediff, filediff2, filediff3)
+        ]
+        diffutils.populate_diff_chunks(files, max_workers=1)
+
+        self.assertEqual(len(self.repository.get_files.calls), 1)
+        self.assertEqual(
+            sorted(self.repository.get_files.calls[0].args[0]),
+            [('README2', filediff2.source_revision, None),
+             ('README3', filediff3.source_revision, None)])
+
+        for diff_file in files:
+            self.assertTrue(diff_file['chunks_loaded'])
+
+        # Once everything is cached, there's nothing to fetch.
+        diffutils.populate_diff_chunks(files, max_workers=1)
+        self.assertEqual(len(self.repository.get_files.calls), 1)
+
+    def test_populate_diff_file_chunks(self):
+        """Testing populate_diff_file_chunks"""
+        files = diffutils.get_diff_files(self.diffset, self.filediff)
+        diffutils.populate_diff_chunks(files, False)
+        expected = files[0]
+
+        diff_file = diffutils.get_diff_files(self.diffset, self.filediff)[0]
+        diffutils.populate_diff_file_chunks(diff_file, [2, 100], False)
+
+        self.assertEqual(diff_file['num_chunks'], expected['num_chunks'])
+        self.assertEqual(diff_file['num_changes'], expected['num_changes'])
+        self.assertEqual(diff_file['changed_chunk_indexes'],
+                         expected['changed_chunk_indexes'])
+        self.assertEqual(diff_file['chunks'], [expected['chunks'][2]])
+        self.assertEqual(diff_file['chunks'][0]['index'], 2)
+
+        # The renderer should find the chunk by its index.
+        renderer = DiffRenderer(diff_file, chunk_index=2)
+        self.assertEqual(renderer.num_chunks, expected['num_chunks'])
+        self.assertEqual(renderer.make_context()['file']['chunks'],
+                         [expected['chunks'][2]])
+
+    def test_get_file_chunks_in_range(self):
+        """Testing get_file_chunks_in_range loads only the chunks in range"""
+        context = {'user': AnonymousUser()}
+        generator = DiffChunkGenerator(
+            None, self.filediff,
+            enable_syntax_highlighting=diffutils.get_enable_highlighting(
+                context['user']))
+        generator.get_chunks()
+        cache.delete(generator._make_chunk_cache_key(0, 0))
+
+        chunks = list(diffutils.get_file_chunks_in_range(
+            context, self.filediff, None, 19, 3))
+
+        self.assertEqual(
+            [line[0] for chunk in chunks for line in chunk['lines']],
+            [19, 20, 21])
+        self.assertEqual([chunk['change'] for chunk in chunks],
+                         ['equal', 'replace', 'equal'])
+        self.assertEqual(len(self.repository.get_file.calls), 1)
+
+    def test_get_file_chunks_in_ranges(self):
+        """Testing get_file_chunks_in_ranges"""
+        context = {'user': AnonymousUser()}
+        ranges = [(20, 1), (2, 3), (19, 3), (38, 10)]
+
+        expected = [
+            list(diffutils.get_file_chunks_in_range(
+                context, self.filediff, None, first_line, num_lines))
+            for first_line, num_lines in ranges
+        ]
+
+        self.spy_on(cache.get_many)
+        results = diffutils.get_file_chunks_in_ranges(
+            context, self.filediff, None, ranges)
+
+        self.assertEqual(results, expected)
+        self.assertEqual(len(cache.get_many.spy.calls), 1)
+        self.assertEqual(
+            [line[0] for chunk in results[1] for line in chunk['lines']],
+            [2, 3, 4])
+        self.assertEqual(
+            [line[0] for chunk in results[3] for line in chunk['lines']],
+            [38, 39, 40])
+
+
+class SyntaxHighlightingTests(SpyAgency, TestCase):
+    """Unit tests for syntax highlighting in DiffChunkGenerator."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(SyntaxHighlightingTests, self).setUp()
+
+        cache.clear()
+
+        orig = b''.join(b'x%d = "<%d>"\n' % (i, i) for i in range(1, 41))
+        diff = (
+            b'diff --git a/test.py b/test.py\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- test.py\n'
+            b'+++ test.py\n'
+            b'@@ -17,7 +17,7 @@\n'
+            b' x17 = "<17>"\n'
+            b' x18 = "<18>"\n'
+            b' x19 = "<19>"\n'
+            b'-x20 = "<20>"\n'
+            b'+x20 = "<twenty>"\n'
+            b' x21 = "<21>"\n'
+            b' x22 = "<22>"\n'
+            b' x23 = "<23>"\n'
+        )
+
+        self.repository = self.create_repository(tool_name='Test')
+        self.diffset = self.create_diffset(repository=self.repository)
+        self.diffset.diffcompat = DiffCompatVersion.DEFAULT
+        self.filediff = self.create_filediff(self.diffset,
+                                             source_file='test.py',
+                                             dest_file='test.py',
+                                             diff=diff)
+
+        self.spy_on(self.repository.get_file,
+                    call_fake=lambda *args, **kwargs: orig)
+
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.siteconfig.set('diffviewer_highlight_shown_lines_only', True)
+        self.siteconfig.save()
+
+    def tearDown(self):
+        super(SyntaxHighlightingTests, self).tearDown()
+
+        self.siteconfig.set('diffviewer_highlight_shown_lines_only', False)
+        self.siteconfig.save()
+
+    def test_get_lexer_for_file(self):
+        """Testing get_lexer_for_file"""
+        lexer = get_lexer_for_file('foo.py')
+        self.assertEqual(lexer.name, 'Python')
+        self.assertTrue(get_lexer_for_file('/path/to/bar.py') is lexer)
+
+        self.assertEqual(get_lexer_for_file('/path/to/Makefile').name,
+                         'Makefile')
+        self.assertEqual(get_lexer_for_file('CMakeLists.txt').name, 'CMake')
+        self.assertNotEqual(get_lexer_for_file('notes.txt').name, 'CMake')
+        self.assertEqual(get_lexer_for_file('foo.unknown-ext'), None)
+
+    def test_highlight_shown_lines_only(self):
+        """Testing DiffChunkGenerator only highlighting shown lines"""
+        chunks = DiffChunkGenerator(None, self.filediff).get_chunks()
+
+        self.siteconfig.set('diffviewer_highlight_shown_lines_only', False)
+        self.siteconfig.save()
+        cache.clear()
+        expected = DiffChunkGenerator(None, self.filediff).get_chunks()
+
+        self.assertEqual([chunk['collapsable'] for chunk in chunks],
+                         [True, False, False, False, True])
+
+        for chunk, expected_chunk in zip(chunks, expected):
+            if chunk['collapsable']:
+                self.assertTrue(chunk['meta']['highlight_pending'])
+
+                for line in chunk['lines']:
+                    self.assertEqual(line[2], 'x%d = &quot;&lt;%d&gt;&quot;'
+                                              % (line[1], line[1]))
+            else:
+                self.assertFalse('highlight_pending' in chunk['meta'])
+                self.assertEqual(chunk['lines'], expected_chunk['lines'])
+
+        # Once highlighted, the collapsed chunks should be the same as
+        # those highlighted up-front.
+        DiffChunkGenerator(None, self.filediff).highlight_pending_chunks(
+            chunks)
+
+        for chunk, expected_chunk in zip(chunks, expected):
+            self.assertFalse('highlight_pending' in chunk['meta'])
+            self.assertEqual(chunk['lines'], expected_chunk['lines'])
+
+    def test_populate_diff_file_chunks_highlights_pending(self):
+        """Testing populate_diff_file_chunks highlighting collapsed chunks"""
+        diff_file = diffutils.get_diff_files(self.diffset, self.filediff)[0]
+        diffutils.populate_diff_file_chunks(diff_file, [0])
+
+        chunk = diff_file['chunks'][0]
+        self.assertTrue(chunk['collapsable'])
+        self.assertFalse('highlight_pending' in chunk['meta'])
+        self.assertTrue('<span' in chunk['lines'][0][2])
+        self.assertTrue('<span' in chunk['lines'][0][5])
+
+        # The cached chunk should still be left for highlighting on demand.
+        generator = DiffChunkGenerator(None, self.filediff)
+        self.assertTrue(
+            generator.get_chunks_by_index([0])[0]['meta']['highlight_pending'])
+
+    def test_get_file_chunks_in_ranges_highlights_pending(self):
+        """Testing get_file_chunks_in_ranges highlighting collapsed chunks"""
+        context = {'user': AnonymousUser()}
+        ranges = [(2, 3), (19, 3)]
+        results = diffutils.get_file_chunks_in_ranges(
+            context, self.filediff, None, ranges)
+
+        self.siteconfig.set('diffviewer_highlight_shown_lines_only', False)
+        self.siteconfig.save()
+        cache.clear()
+        expected = diffutils.get_file_chunks_in_ranges(
+            {'user': AnonymousUser()}, self.filediff, None, ranges)
+
+        self.assertEqual(results, expected)
+        self.assertTrue('<span' in results[0][0]['lines'][0][2])
+
+        for chunks in results:
+            for chunk in chunks:
+                self.assertFalse('highlight_pending' in chunk['meta'])
+
+    def test_highlighting_timeout(self):
+        """Testing DiffChunkGenerator falling back to plain text when
+        syntax highlighting takes too long
+        """
+        class SlowDiffChunkGenerator(DiffChunkGenerator):
+            def _start_highlighting_timer(self):
+                self._highlighting_deadline = time.time() - 1
+
+        chunks = SlowDiffChunkGenerator(None, self.filediff).get_chunks()
+
+        for chunk in chunks:
+            self.assertTrue(chunk['meta']['syntax_highlighting_timed_out'])
+            self.assertFalse('highlight_pending' in chunk['meta'])
+
+            for line in chunk['lines']:
+                self.assertFalse('<span' in line[2])
+                self.assertFalse('<span' in line[5])
+
+        filediff = FileDiff.objects.get(pk=self.filediff.pk)
+        self.assertTrue(filediff.extra_data['syntax_highlighting_timed_out'])
+        self.assertEqual(get_syntax_highlighting_timeouts(), [('.py', 1)])
+
+        # Later attempts shouldn't try highlighting the file again.
+        cache.clear()
+        chunks = DiffChunkGenerator(None, self.filediff).get_chunks()
+
+        self.assertEqual(get_syntax_highlighting_timeouts(), [])
+        self.assertTrue(chunks[0]['meta']['syntax_highlighting_timed_out'])
+        self.assertFalse('<span' in chunks[0]['lines'][0][2])
+
+
+class InterdiffTests(SpyAgency, TestCase):
+    """Unit tests for generating interdiffs."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(InterdiffTests, self).setUp()
+
+        cache.clear()
+        get_patched_file_cache().clear()
+
+        orig = b''.join(b'line %d\n' % i for i in range(1, 61))
+
+        self.repository = self.create_repository(tool_name='Test')
+        self.spy_on(self.repository.get_file,
+                    call_fake=lambda *args, **kwargs: orig)
+
+        # The first revision changes lines 10 and 40, and the second changes
+        # lines 10 and 20 (adding a line after it).
+        self.filediff = self._create_filediff(
+            b'@@ -7,7 +7,7 @@\n'
+            b' line 7\n line 8\n line 9\n'
+            b'-line 10\n'
+            b'+line ten\n'
+            b' line 11\n line 12\n line 13\n'
+            b'@@ -37,7 +37,7 @@\n'
+            b' line 37\n line 38\n line 39\n'
+            b'-line 40\n'
+            b'+line forty\n'
+            b' line 41\n line 42\n line 43\n')
+        self.interfilediff = self._create_filediff(
+            b'@@ -7,7 +7,7 @@\n'
+            b' line 7\n line 8\n line 9\n'
+            b'-line 10\n'
+            b'+line 10.0\n'
+            b' line 11\n line 12\n line 13\n'
+            b'@@ -17,7 +17,8 @@\n'
+            b' line 17\n line 18\n line 19\n'
+            b'-line 20\n'
+            b'+line 20.0\n'
+            b'+line 20.5\n'
+            b' line 21\n line 22\n line 23\n')
+
+    def test_get_interdiff_search_ranges(self):
+        """Testing get_interdiff_search_ranges"""
+        orig = diffutils.get_original_file(self.filediff, None, ['ascii'])
+
+        self.assertTrue(diffutils.filediffs_share_original(
+            self.filediff, self.interfilediff))
+        self.assertEqual(
+            diffutils.get_interdiff_search_ranges(orig, self.filediff,
+                                                  self.interfilediff),
+            [(6, 13, 6, 13), (16, 23, 16, 24), (36, 43, 37, 44)])
+
+    def test_get_chunks_with_shared_original(self):
+        """Testing DiffChunkGenerator with an interdiff sharing the
+        original file
+        """
+        chunks = DiffChunkGenerator(None, self.filediff,
+                                    self.interfilediff).get_chunks()
+
+        self.assertEqual(len(self.repository.get_file.calls), 1)
+        self.assertEqual(
+            [(chunk['change'], chunk['lines'][0][1], chunk['lines'][0][4])
+             for chunk in chunks
+             if chunk['change'] != 'equal'],
+            [('replace', 10, 10), ('replace', 20, 20), ('insert', '', 21),
+             ('replace', 40, 41)])
+
+        # The result should match a search of the entire files.
+        self.spy_on(diffutils.filediffs_share_original,
+                    call_fake=lambda *args: False)
+        cache.clear()
+
+        expected = DiffChunkGenerator(None, self.filediff,
+                                      self.interfilediff).get_chunks()
+
+        self.assertEqual(len(self.repository.get_file.calls), 3)
+        self.assertEqual(chunks, expected)
+
+    def _create_filediff(self, diff):
+        diffset = self.create_diffset(repository=self.repository)
+        diffset.diffcompat = DiffCompatVersion.DEFAULT
+
+        return self.create_filediff(
+            diffset,
+            source_file='test.txt',
+            dest_file='test.txt',
+            diff=b'--- test.txt\n+++ test.txt\n' + diff)
+
 
 class DiffUtilsTests(TestCase):
     """Unit tests for diffutils."""
+    def test_populate_diff_chunks_with_workers(self):
+        """Testing populate_diff_chunks with multiple workers"""
+        calls = []
+
+        class FakeChunkGenerator(DiffChunkGenerator):
+            def get_chunks(self):
+                calls.append(self.filediff.source_file)
+
+                if self.filediff.source_file == 'bad':
+                    raise ValueError('Bad file')
+
+                return [{
+                    'change': 'insert',
+                    'lines': [],
+                    'meta': {'file': self.filediff.source_file},
+                }]
+
+        diffset = DiffSet()
+        files = [
+            {
+                'filediff': FileDiff(diffset=diffset,
+                                     source_file='file%d' % i),
+                'interfilediff': None,
+                'force_interdiff': False,
+            }
+            for i in range(10)
+        ]
+
+        old_generator_class = get_diff_chunk_generator_class()
+        set_diff_chunk_generator_class(FakeChunkGenerator)
+
+        try:
+            diffutils.populate_diff_chunks(files, max_workers=4)
+
+            for i, diff_file in enumerate(files):
+                self.assertTrue(diff_file['chunks_loaded'])
+                self.assertEqual(diff_file['num_changes'], 1)
+                self.assertEqual(diff_file['chunks'][0]['meta']['file'],
+                                 'file%d' % i)
+
+            # An error in one file should still let the others load.
+            files.insert(3, {
+                'filediff': FileDiff(diffset=diffset, source_file='bad'),
+                'interfilediff': None,
+                'force_interdiff': False,
+            })
+
+            diffutils.populate_diff_chunks(files, max_workers=4)
+            self.assertEqual(len(calls), 21)
+
+            bad_file = files.pop(3)
+            self.assertFalse(bad_file['chunks_loaded'])
+            self.assertEqual(bad_file['chunks'], [])
+            self.assertEqual(bad_file['num_changes'], 0)
+            self.assertTrue(isinstance(bad_file['error'], ValueError))
+            self.assertTrue('Bad file' in bad_file['trace'])
+
+            for i, diff_file in enumerate(files):
+                self.assertTrue(diff_file['chunks_loaded'])
+                self.assertFalse('error' in diff_file)
+                self.assertEqual(diff_file['chunks'][0]['meta']['file'],
+                                 'file%d' % i)
+        finally:
+            set_diff_chunk_generator_class(old_generator_class)
+
+    def test_populate_diff_chunks_with_error(self):
+        """Testing populate_diff_chunks records an error generating one
+        file and continues with the others"""
+        class FakeChunkGenerator(DiffChunkGenerator):
+            def get_chunks(self):
+                if self.filediff.source_file == 'bad':
+                    raise UserVisibleError('Bad file')
+
+                return [{
+                    'change': 'insert',
+                    'lines': [],
+                    'meta': {},
+                }]
+
+        diffset = DiffSet()
+        files = [
+            {
+                'filediff': FileDiff(diffset=diffset, source_file=name),
+                'interfilediff': None,
+                'force_interdiff': False,
+            }
+            for name in ('file1', 'bad', 'file2')
+        ]
+
+        old_generator_class = get_diff_chunk_generator_class()
+        set_diff_chunk_generator_class(FakeChunkGenerator)
+
+        try:
+            diffutils.populate_diff_chunks(files, max_workers=1)
+        finally:
+            set_diff_chunk_generator_class(old_generator_class)
+
+        self.assertTrue(files[0]['chunks_loaded'])
+        self.assertEqual(files[0]['num_changes'], 1)
+        self.assertTrue(files[2]['chunks_loaded'])
+        self.assertEqual(files[2]['num_changes'], 1)
+
+        self.assertFalse(files[1]['chunks_loaded'])
+        self.assertEqual(files[1]['num_chunks'], 0)
+        self.assertEqual('%s' % files[1]['error'], 'Bad file')
+
+        # User-visible errors don't show a traceback.
+        self.assertEqual(files[1]['trace'], None)
+
+    def test_get_diff_compat_version(self):
+        """Testing get_diff_compat_version"""
+        siteconfig = SiteConfiguration.objects.get_current()
+        old_repositories = \
+            siteconfig.get('diffviewer_histogram_diff_repositories')
+
+        try:
+            siteconfig.set('diffviewer_histogram_diff_repositories', ['2'])
+
+            self.assertEqual(
+                diffutils.get_diff_compat_version(
+                    Repository(pk=1, name='Repo')),
+                DiffCompatVersion.DEFAULT)
+            self.assertEqual(
+                diffutils.get_diff_compat_version(
+                    Repository(pk=2, name='Repo')),
+                DiffCompatVersion.HISTOGRAM)
+            self.assertEqual(diffutils.get_diff_compat_version(None),
+                             DiffCompatVersion.DEFAULT)
+        finally:
+            siteconfig.set('diffviewer_histogram_diff_repositories',
+                           old_repositories)
+
+    def test_get_diff_cost_budget(self):
+        """Testing get_diff_cost_budget"""
+        siteconfig = SiteConfiguration.objects.get_current()
+        old_budget = siteconfig.get('diffviewer_diff_cost_budget')
+        old_budgets = \
+            siteconfig.get('diffviewer_repository_diff_cost_budgets')
+
+        try:
+            siteconfig.set('diffviewer_diff_cost_budget', 1000)
+            siteconfig.set('diffviewer_repository_diff_cost_budgets', {
+                '2': 50,
+                '3': 0,
+            })
+
+            self.assertEqual(
+                diffutils.get_diff_cost_budget(Repository(pk=1, name='Repo')),
+                1000)
+            self.assertEqual(
+                diffutils.get_diff_cost_budget(Repository(pk=2, name='Repo')),
+                50)
+            self.assertEqual(
+                diffutils.get_diff_cost_budget(Repository(pk=3, name='Repo')),
+                None)
+            self.assertEqual(diffutils.get_diff_cost_budget(None), 1000)
+        finally:
+            siteconfig.set('diffviewer_diff_cost_budget', old_budget)
+            siteconfig.set('diffviewer_repository_diff_cost_budgets',
+                           old_budgets)
+
     def test_get_line_changed_regions(self):
         """Testing DiffChunkGenerator._get_line_changed_regions"""
         def deep_equal(A, B):
@@ -1720,3 +2861,298 @@ class DiffUtilsTests(TestCase):
         new = 'nopqrstuvwxyz'
         regions = diffutils.get_line_changed_regions(old, new)
         deep_equal(regions, (None, None))
+
+        # Changes within a word should still be found.
+        old = 'result = compute_total(values, 10)'
+        new = 'result = compute_totals(values, 12)'
+        regions = diffutils.get_line_changed_regions(old, new)
+        deep_equal(regions, ([(22, 22), (32, 33)], [(22, 23), (33, 34)]))
+
+        old = 'if (foo_bar) {'
+        new = 'if (foo_baz) {'
+        regions = diffutils.get_line_changed_regions(old, new)
+        deep_equal(regions, ([(10, 11)], [(10, 11)]))
+
+        # Lines that can't be similar enough should be skipped early.
+        old = 'x'
+        new = 'x = some_function_call(argument)'
+        regions = diffutils.get_line_changed_regions(old, new)
+        deep_equal(regions, (None, None))
+
+
+class PatchedFileCacheTests(SpyAgency, TestCase):
+    """Unit tests for PatchedFileCache."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(PatchedFileCacheTests, self).setUp()
+
+        cache.clear()
+        get_patched_file_cache().clear()
+
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.old_cache_size = \
+            self.siteconfig.get('diffviewer_patched_file_cache_size')
+
+    def tearDown(self):
+        super(PatchedFileCacheTests, self).tearDown()
+
+        self.siteconfig.set('diffviewer_patched_file_cache_size',
+                            self.old_cache_size)
+        self.siteconfig.save()
+
+    def test_get(self):
+        """Testing PatchedFileCache.get"""
+        file_cache = PatchedFileCache()
+        key = file_cache.make_key('abc123', 'def456')
+
+        self.assertEqual(file_cache.get(key, lambda: b'data'), b'data')
+        self.assertEqual(file_cache.get(key, lambda: b'other'), b'data')
+
+        stats = file_cache.get_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['shared_hits'], 0)
+
+        # A new process would find it in the main cache.
+        file_cache = PatchedFileCache()
+        self.assertEqual(file_cache.get(key, lambda: b'other'), b'data')
+        self.assertEqual(file_cache.get_stats()['shared_hits'], 1)
+
+    def test_get_stats_flushed_periodically(self):
+        """Testing PatchedFileCache.get only updating the shared counters
+        periodically
+        """
+        file_cache = PatchedFileCache()
+        key = file_cache.make_key('abc123', 'def456')
+        self.spy_on(cache.incr)
+        self.spy_on(cache.add)
+
+        for i in range(10):
+            file_cache.get(key, lambda: b'data')
+
+        self.assertEqual(len(cache.incr.spy.calls), 0)
+        self.assertEqual(len(cache.add.spy.calls), 0)
+
+        # The counts are flushed once the interval has passed.
+        file_cache._last_stats_flush -= file_cache.STATS_FLUSH_INTERVAL
+        file_cache.get(key, lambda: b'data')
+
+        stats = PatchedFileCache().get_stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 10)
+
+    def test_make_key_with_encodings(self):
+        """Testing PatchedFileCache.make_key with encodings"""
+        file_cache = PatchedFileCache()
+
+        self.assertNotEqual(
+            file_cache.make_key('abc123', encodings=['utf-8']),
+            file_cache.make_key('abc123', encodings=['iso-8859-15']))
+        self.assertEqual(file_cache.make_key('abc123', encodings=[]),
+                         file_cache.make_key('abc123'))
+
+    def test_get_with_eviction(self):
+        """Testing PatchedFileCache.get evicts least recently-used files"""
+        self.siteconfig.set('diffviewer_patched_file_cache_size', 10)
+        self.siteconfig.save()
+
+        file_cache = PatchedFileCache()
+        key1 = file_cache.make_key('1')
+        key2 = file_cache.make_key('2')
+        key3 = file_cache.make_key('3')
+
+        file_cache.get(key1, lambda: b'1111')
+        file_cache.get(key2, lambda: b'2222')
+        file_cache.get(key1, lambda: b'1111')
+        file_cache.get(key3, lambda: b'3333')
+
+        self.assertIn(key1, file_cache._entries)
+        self.assertNotIn(key2, file_cache._entries)
+        self.assertIn(key3, file_cache._entries)
+        self.assertEqual(file_cache._size, 8)
+        self.assertEqual(file_cache.get_stats()['evictions'], 1)
+
+    def test_shared_across_filediffs(self):
+        """Testing get_patched_file with FileDiffs sharing the same diff"""
+        diff = (
+            b'diff --git a/README b/README\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- README\n'
+            b'+++ README\n'
+            b'@@ -1 +1 @@\n'
+            b'-blah blah\n'
+            b'+blah!\n'
+        )
+
+        repository = self.create_repository(tool_name='Test')
+        filediffs = [
+            self.create_filediff(
+                self.create_diffset(repository=repository, revision=i),
+                source_file='README',
+                dest_file='README',
+                diff=diff)
+            for i in (1, 2)
+        ]
+
+        self.spy_on(repository.get_file,
+                    call_fake=lambda *args, **kwargs: b'blah blah\n')
+        self.spy_on(diffutils.patch)
+
+        for filediff in filediffs:
+            orig = diffutils.get_original_file(filediff, None, [])
+            patched = diffutils.get_patched_file(orig, filediff, None)
+
+            self.assertEqual(orig, b'blah blah\n')
+            self.assertEqual(patched, b'blah!\n')
+
+        self.assertEqual(len(diffutils.patch.spy.calls), 1)
+
+
+class DiffChunkJobTests(TestCase):
+    """Unit tests for DiffChunkJob."""
+    fixtures = ['test_users', 'test_scmtools']
+
+    def setUp(self):
+        super(DiffChunkJobTests, self).setUp()
+
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.siteconfig.set('diffviewer_precompute_chunks', True)
+        self.siteconfig.save()
+
+        repository = self.create_repository(tool_name='Test')
+        self.diffset = self.create_diffset(repository=repository)
+        self.filediffs = [
+            self.create_filediff(self.diffset, source_file='file%d' % i)
+            for i in range(3)
+        ]
+
+    def tearDown(self):
+        super(DiffChunkJobTests, self).tearDown()
+
+        self.siteconfig.set('diffviewer_precompute_chunks', False)
+        self.siteconfig.save()
+
+    def test_filediff_resource_fetches_chunk_jobs(self):
+        """Testing FileDiffResource fetches chunk jobs along with the
+        FileDiffs
+        """
+        review_request = self.create_review_request(create_repository=True)
+        diffset = self.create_diffset(review_request)
+        filediffs = [
+            self.create_filediff(diffset, source_file='file%d' % i)
+            for i in range(3)
+        ]
+        DiffChunkJob.objects.queue_filediffs(filediffs[:2])
+
+        with self.assertNumQueries(1):
+            statuses = [
+                resources.filediff.serialize_chunks_status_field(filediff)
+                for filediff in resources.filediff.get_queryset(
+                    None, review_request.pk, diffset.revision)
+            ]
+
+        self.assertEqual(sorted(statuses, key=lambda status: status or ''),
+                         [None, 'pending', 'pending'])
+
+    def test_queue_filediffs(self):
+        """Testing DiffChunkJobManager.queue_filediffs"""
+        self.filediffs[1].binary = True
+
+        DiffChunkJob.objects.queue_filediffs(self.filediffs)
+
+        jobs = DiffChunkJob.objects.order_by('filediff')
+        self.assertEqual([job.filediff for job in jobs],
+                         [self.filediffs[0], self.filediffs[2]])
+        self.assertEqual(jobs[0].status, DiffChunkJob.PENDING)
+        self.assertEqual(jobs[0].priority, DiffChunkJob.PRIORITY_UPLOAD)
+
+        # Queuing again should only raise the priority.
+        DiffChunkJob.objects.queue_filediffs(
+            self.filediffs[:1], priority=DiffChunkJob.PRIORITY_PUBLISH)
+
+        self.assertEqual(DiffChunkJob.objects.count(), 2)
+        self.assertEqual(
+            DiffChunkJob.objects.get(filediff=self.filediffs[0]).priority,
+            DiffChunkJob.PRIORITY_PUBLISH)
+
+    def test_queue_filediffs_when_disabled(self):
+        """Testing DiffChunkJobManager.queue_filediffs with
+        diffviewer_precompute_chunks disabled
+        """
+        self.siteconfig.set('diffviewer_precompute_chunks', False)
+        self.siteconfig.save()
+
+        DiffChunkJob.objects.queue_filediffs(self.filediffs)
+
+        self.assertEqual(DiffChunkJob.objects.count(), 0)
+
+    def test_claim_next(self):
+        """Testing DiffChunkJobManager.claim_next"""
+        DiffChunkJob.objects.queue_filediffs(self.filediffs[:2])
+        DiffChunkJob.objects.queue_filediffs(
+            self.filediffs[2:], priority=DiffChunkJob.PRIORITY_PUBLISH)
+        DiffChunkJob.objects.filter(filediff=self.filediffs[1]).update(
+            next_attempt=timezone.now() + timedelta(hours=1))
+
+        job = DiffChunkJob.objects.claim_next()
+        self.assertEqual(job.filediff, self.filediffs[2])
+        self.assertEqual(job.status, DiffChunkJob.RUNNING)
+        self.assertEqual(job.attempts, 1)
+
+        job = DiffChunkJob.objects.claim_next()
+        self.assertEqual(job.filediff, self.filediffs[0])
+
+        # The remaining job isn't ready to be retried yet.
+        self.assertEqual(DiffChunkJob.objects.claim_next(), None)
+
+    def test_requeue_stale(self):
+        """Testing DiffChunkJobManager.requeue_stale"""
+        DiffChunkJob.objects.queue_filediffs(self.filediffs)
+        DiffChunkJob.objects.update(
+            status=DiffChunkJob.RUNNING,
+            last_updated=timezone.now() - timedelta(hours=1))
+        DiffChunkJob.objects.filter(filediff=self.filediffs[0]).update(
+            attempts=3)
+        DiffChunkJob.objects.filter(filediff=self.filediffs[1]).update(
+            last_updated=timezone.now())
+
+        self.assertEqual(DiffChunkJob.objects.requeue_stale(600, 3), 1)
+        self.assertEqual(
+            [job.status for job in DiffChunkJob.objects.order_by('filediff')],
+            [DiffChunkJob.FAILED, DiffChunkJob.RUNNING, DiffChunkJob.PENDING])
+
+    def test_run(self):
+        """Testing DiffChunkJob.run"""
+        class FakeChunkGenerator(DiffChunkGenerator):
+            def get_chunks(self):
+                if self.filediff.source_file == 'file1':
+                    raise ValueError('Bad file')
+
+                return []
+
+        DiffChunkJob.objects.queue_filediffs(self.filediffs[:2])
+
+        old_generator_class = get_diff_chunk_generator_class()
+        set_diff_chunk_generator_class(FakeChunkGenerator)
+
+        try:
+            job = DiffChunkJob.objects.claim_next()
+            self.assertTrue(job.run(max_attempts=2))
+            self.assertEqual(job.status, DiffChunkJob.DONE)
+
+            # The first failure should be retried later.
+            job = DiffChunkJob.objects.claim_next()
+            self.assertFalse(job.run(max_attempts=2))
+            self.assertEqual(job.status, DiffChunkJob.PENDING)
+            self.assertEqual(job.last_error, 'Bad file')
+            self.assertTrue(job.next_attempt > timezone.now())
+
+            # The last failure should give up.
+            DiffChunkJob.objects.update(next_attempt=timezone.now())
+            job = DiffChunkJob.objects.claim_next()
+            self.assertFalse(job.run(max_attempts=2))
+            self.assertEqual(job.status, DiffChunkJob.FAILED)
+            self.assertEqual(job.status_name, 'failed')
+        finally:
+            set_diff_chunk_generator_class(old_generator_class)
@@ -13,7 +13,9 @@ from django.views.generic.base import TemplateView, View
 from djblets.siteconfig.models import SiteConfiguration
 
 from reviewboard.diffviewer.diffutils import (get_diff_files,
+                                              iter_diff_chunks,
                                               populate_diff_chunks,
+                                              populate_diff_file_chunks,
                                               get_enable_highlighting)
 from reviewboard.diffviewer.errors import UserVisibleError
 from reviewboard.diffviewer.models import DiffSet, FileDiff
@@ -217,6 +219,10 @@ class DiffFragmentView(View):
     The caller may also pass ``?lines-of-context=`` as a query parameter to
     the URL to indicate how many lines of context should be provided around
     the chunk.
+
+    If the ``diffviewer_stream_fragments`` setting is enabled, a whole file's
+    diff will be streamed to the client as its chunks are generated, rather
+    than being sent once the entire file has been rendered.
     """
     template_name = 'diffviewer/diff_file_fragment.html'
     error_template_name = 'diffviewer/diff_fragment_error.html'
@@ -235,13 +241,25 @@ class DiffFragmentView(View):
         try:
             renderer = self.create_renderer(context, *args, **kwargs)
 
-            return renderer.render_to_response()
+            if self.streaming:
+                return renderer.render_to_streaming_response()
+            else:
+                return renderer.render_to_response()
         except Exception as e:
+            extra_context = {
+                'file': self._get_requested_diff_file(False),
+            }
+
+            diff_file = getattr(self, 'diff_file', None)
+
+            if diff_file and diff_file.get('error') is e:
+                # The error was recorded while generating the chunks, so
+                # show where it happened rather than where it was re-raised.
+                extra_context['trace'] = diff_file['trace']
+
             return exception_traceback(
                 self.request, e, self.error_template_name,
-                extra_context={
-                    'file': self._get_requested_diff_file(False),
-                })
+                extra_context=extra_context)
 
     def create_renderer(self, context, diffset_or_id, filediff_id,
                         interdiffset_or_id=None, chunkindex=None,
@@ -323,7 +341,14 @@ class DiffFragmentView(View):
         else:
             collapseall = get_collapse_diff(self.request)
 
-        self.diff_file = self._get_requested_diff_file()
+        siteconfig = SiteConfiguration.objects.get_current()
+        self.streaming = (chunkindex is None and
+                          not lines_of_context and
+                          siteconfig.get('diffviewer_stream_fragments'))
+
+        self.diff_file = self._get_requested_diff_file(
+            get_chunks=not self.streaming, chunk_index=chunkindex,
+            highlight_collapsed=not collapseall)
 
         if not self.diff_file:
             raise UserVisibleError(
@@ -331,6 +356,14 @@ class DiffFragmentView(View):
                   'filediff %s')
                 % self.filediff.pk)
 
+        if self.diff_file.get('error'):
+            raise self.diff_file['error']
+
+        if self.streaming:
+            self.diff_file['chunks'] = iter_diff_chunks(
+                self.diff_file, self.highlighting, request=self.request,
+                highlight_collapsed=not collapseall)
+
         return get_diff_renderer(
             self.diff_file,
             chunk_index=chunkindex,
@@ -348,7 +381,8 @@ class DiffFragmentView(View):
         """
         return {}
 
-    def _get_requested_diff_file(self, get_chunks=True):
+    def _get_requested_diff_file(self, get_chunks=True, chunk_index=None,
+                                 highlight_collapsed=False):
         """Fetches information on the requested diff.
 
         This will look up information on the diff that's to be rendered
@@ -357,14 +391,23 @@ class DiffFragmentView(View):
 
         If get_chunks is True, the diff file information will include chunks
         for rendering. Otherwise, it will just contain generic information
-        from the database.
+        from the database. If chunk_index is also provided, only that chunk
+        will be included. If highlight_collapsed is True, collapsed chunks
+        will be syntax-highlighted if they haven't been already.
         """
         files = get_diff_files(self.diffset, self.filediff, self.interdiffset,
                                request=self.request)
 
         if get_chunks:
-            populate_diff_chunks(files, self.highlighting,
-                                 request=self.request)
+            if chunk_index is not None:
+                for diff_file in files:
+                    populate_diff_file_chunks(diff_file, [chunk_index],
+                                              self.highlighting,
+                                              request=self.request)
+            else:
+                populate_diff_chunks(files, self.highlighting,
+                                     request=self.request,
+                                     highlight_collapsed=highlight_collapsed)
 
         if files:
             assert len(files) == 1
@@ -381,7 +424,7 @@ class DiffFragmentView(View):
 def exception_traceback_string(request, e, template_name, extra_context={}):
     context = {'error': e}
     context.update(extra_context)
-    if e.__class__ is not UserVisibleError:
+    if 'trace' not in context and e.__class__ is not UserVisibleError:
         context['trace'] = traceback.format_exc()
 
     if request:
@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 
 import json
 import logging
+import sys
+import threading
 
 from django import forms
 from django.conf import settings
@@ -11,6 +13,7 @@ from django.utils import six
 from django.utils.six.moves import http_client
 from django.utils.six.moves.urllib.error import HTTPError, URLError
 from django.utils.translation import ugettext_lazy as _
+from djblets.cache.backend import cache_memoize
 from djblets.siteconfig.models import SiteConfiguration
 
 from reviewboard.hostingsvcs.errors import (AuthorizationError,
@@ -166,6 +169,18 @@ class GitHub(HostingService):
 
     RAW_MIMETYPE = 'application/vnd.github.v3.raw'
 
+    # The number of API requests that get_change makes at once.
+    max_concurrent_api_requests = 4
+
+    # Below this many API requests remaining, requests are made one at a
+    # time and a warning is logged.
+    RATE_LIMIT_LOW = 100
+
+    def __init__(self, account):
+        super(GitHub, self).__init__(account)
+
+        self._rate_limit_remaining = None
+
     def get_api_url(self, hosting_url):
         """Returns the API URL for GitHub.
 
@@ -376,11 +391,13 @@ class GitHub(HostingService):
 
     def get_change(self, repository, revision):
         repo_api_url = self._get_repo_api_url(repository)
+        cache_key = repository.get_commit_cache_key(revision)
 
         # Step 1: fetch the commit itself that we want to review, to get
         # the parent SHA and the commit message. Hopefully this information
         # is still in cache so we don't have to fetch it again.
-        commit = cache.get(repository.get_commit_cache_key(revision))
+        commit = cache.get(cache_key)
+
         if commit:
             author_name = commit.author_name
             date = commit.date
@@ -396,35 +413,63 @@ class GitHub(HostingService):
                 raise SCMError(six.text_type(e))
 
             author_name = commit['commit']['author']['name']
-            date = commit['commit']['committer']['date'],
+            date = commit['commit']['committer']['date']
             parent_revision = commit['parents'][0]['sha']
             message = commit['commit']['message']
 
+            cache.set(cache_key,
+                      Commit(author_name, revision, date, message,
+                             parent_revision),
+                      repository.COMMITS_CACHE_PERIOD)
+
+        # Diffs can be larger than the cache backend allows for a single
+        # item, so they're stored in chunks, under their own key. The commit
+        # key is also set by Repository.get_commits, without a diff.
+        diff = cache_memoize(
+            '%s:diff' % cache_key,
+            lambda: self._get_change_diff(repo_api_url, revision,
+                                          parent_revision),
+            expiration=repository.COMMITS_CACHE_PERIOD,
+            large_data=True)
+
+        return Commit(author_name, revision, date, message, parent_revision,
+                      diff=diff)
+
+    def _get_change_diff(self, repo_api_url, revision, parent_revision):
+        """Returns the diff of a commit against its parent."""
         # Step 2: fetch the "compare two commits" API to get the diff if the
         # commit has a parent commit. Otherwise, fetch the commit itself.
+        #
+        # At the same time, fetch the tree for the parent commit, so that we
+        # can get full blob SHAs for each of the modified and removed files
+        # in the diff. A commit without a parent only adds files, so there's
+        # no tree to fetch.
         if parent_revision:
-            url = self._build_api_url(
-                repo_api_url, 'compare/%s...%s' % (parent_revision, revision))
+            urls = [
+                self._build_api_url(
+                    repo_api_url,
+                    'compare/%s...%s' % (parent_revision, revision)),
+                self._build_api_url(
+                    repo_api_url,
+                    'git/trees/%s' % parent_revision) + '&recursive=1',
+            ]
         else:
-            url = self._build_api_url(repo_api_url, 'commits/%s' % revision)
+            urls = [
+                self._build_api_url(repo_api_url, 'commits/%s' % revision),
+            ]
 
         try:
-            comparison = self._api_get(url)
+            results = self._api_get_many(urls)
         except Exception as e:
             raise SCMError(six.text_type(e))
 
-        if parent_revision:
-            tree_sha = comparison['base_commit']['commit']['tree']['sha']
-        else:
-            tree_sha = comparison['commit']['tree']['sha']
-
+        comparison = results[0]
         files = comparison['files']
 
-        # Step 3: fetch the tree for the original commit, so that we can get
-        # full blob SHAs for each of the files in the diff.
-        url = self._build_api_url(repo_api_url, 'git/trees/%s' % tree_sha)
-        url += '&recursive=1'
-        tree = self._api_get(url)
+        if parent_revision:
+            tree = results[1]
+        else:
+            tree = {'tree': []}
 
         file_shas = {}
         for file in tree['tree']:
@@ -471,8 +516,7 @@ class GitHub(HostingService):
         if not diff.endswith('\n'):
             diff += '\n'
 
-        return Commit(author_name, revision, date, message, parent_revision,
-                      diff=diff)
+        return diff
 
     def _get_api_error_message(self, rsp, status_code):
         """Return the error(s) reported by the GitHub API, as a string
@@ -503,10 +547,13 @@ class GitHub(HostingService):
         rate_limit_remaining = headers.get('X-RateLimit-Remaining', None)
 
         try:
-            if (rate_limit_remaining is not None and
-                int(rate_limit_remaining) <= 100):
-                logging.warning('GitHub rate limit for %s is down to %s',
-                                self.account.username, rate_limit_remaining)
+            if rate_limit_remaining is not None:
+                self._rate_limit_remaining = int(rate_limit_remaining)
+
+                if self._rate_limit_remaining <= self.RATE_LIMIT_LOW:
+                    logging.warning('GitHub rate limit for %s is down to %s',
+                                    self.account.username,
+                                    rate_limit_remaining)
         except ValueError:
             pass
 
@@ -541,9 +588,66 @@ class GitHub(HostingService):
         return self._api_get(self._build_api_url(
             self._get_repo_api_url_raw(owner, repo_name)))
 
+    def _api_get_many(self, urls):
+        """Fetches several API URLs at once.
+
+        Up to ``max_concurrent_api_requests`` requests are made at a time,
+        each in its own thread. If the account is running low on API
+        requests, they're made one at a time instead.
+
+        This returns a list of the decoded responses, in the same order as
+        the URLs. If any request fails, the first error (in URL order) is
+        raised once all requests have finished.
+        """
+        if (self._rate_limit_remaining is not None and
+            self._rate_limit_remaining <= self.RATE_LIMIT_LOW):
+            max_workers = 1
+        else:
+            max_workers = self.max_concurrent_api_requests
+
+        if max_workers == 1 or len(urls) == 1:
+            return [self._api_get(url) for url in urls]
+
+        results = [None] * len(urls)
+        errors = [None] * len(urls)
+        pending = list(enumerate(urls))
+        lock = threading.Lock()
+
+        def _worker():
+            while True:
+                with lock:
+                    if not pending:
+                        break
+
+                    i, url = pending.pop(0)
+
+                try:
+                    results[i] = self._api_get(url)
+                except Exception:
+                    errors[i] = sys.exc_info()
+
+        threads = [
+            threading.Thread(target=_worker)
+            for i in range(min(max_workers, len(urls)))
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        for exc_info in errors:
+            if exc_info:
+                six.reraise(*exc_info)
+
+        return results
+
     def _api_get(self, url):
         try:
-            data, headers = self._http_get(url)
+            # Conditional requests don't count against the rate limit, so
+            # responses are revalidated rather than downloaded again.
+            data, headers = self._http_get(url, cache_response=True)
             return json.loads(data)
         except (URLError, HTTPError) as e:
             data = e.read()
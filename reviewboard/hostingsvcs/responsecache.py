@@ -0,0 +1,176 @@
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.cache import cache
+from django.utils import six
+from django.utils.encoding import force_bytes, force_str
+from django.utils.six.moves import http_client
+from djblets.cache.backend import cache_memoize, make_cache_key
+
+from reviewboard.scmtools.http import HTTPResponse, http_request
+
+
+class _EntryMissing(Exception):
+    pass
+
+
+class ResponseCache(object):
+    """A cache of hosting service API responses, revalidated on each use.
+
+    Responses that come with an ETag or Last-Modified header are stored in
+    the main cache backend, along with those validators. Later requests for
+    the same URL are made as conditional requests. If the service responds
+    with 304 Not Modified, the stored body is used instead of downloading
+    it again. Most services, including GitHub, don't count these requests
+    against their rate limits.
+
+    Responses are stored per URL and per set of request headers, so that
+    responses for different users or formats are never mixed up.
+
+    Hit and miss counts are recorded in the main cache backend, so that
+    they cover all processes serving the site.
+    """
+    STATS_KEYS = ('hits', 'misses')
+
+    # Entries are revalidated on every use, so they can be kept around
+    # for as long as the cache backend has room for them.
+    expiration = 60 * 60 * 24 * 7
+
+    def make_key(self, url, headers={}):
+        """Returns a key for a URL and request headers."""
+        key_data = [url] + sorted(
+            '%s: %s' % (name.lower(), value)
+            for name, value in six.iteritems(headers)
+        )
+
+        # URLs and headers may contain credentials, so they're not stored
+        # in the key as-is.
+        return 'hosting-service-response:%s' % hashlib.sha1(
+            force_bytes('\n'.join(key_data))).hexdigest()
+
+    def request(self, url, headers={}):
+        """Makes a GET request, using a stored response if it's unchanged.
+
+        This returns an HTTPResponse. See
+        reviewboard.scmtools.http.http_request.
+        """
+        key = self.make_key(url, headers)
+        entry = self._get_entry(key)
+        request_headers = dict(headers)
+
+        if entry is not None:
+            if entry['etag']:
+                request_headers['If-None-Match'] = entry['etag']
+
+            if entry['last_modified']:
+                request_headers['If-Modified-Since'] = entry['last_modified']
+
+        response = http_request(url, headers=request_headers)
+
+        if response.not_modified:
+            if entry is None:
+                # The caller made its own conditional request.
+                return response
+
+            self._increment_stat('hits')
+
+            # The 304 response carries up-to-date headers, such as the rate
+            # limits, which take precedence over the stored ones.
+            response_headers = self._build_headers(entry['headers'])
+
+            for name, value in response.headers.items():
+                if name.lower() not in ('content-length', 'content-type'):
+                    response_headers[name] = value
+
+            return HTTPResponse(url, 200, response_headers, entry['data'])
+
+        self._increment_stat('misses')
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        if etag or last_modified:
+            entry = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'headers': list(response.headers.items()),
+                'data': response.data,
+            }
+
+            try:
+                cache_memoize(key, lambda: entry, expiration=self.expiration,
+                              force_overwrite=True, large_data=True)
+            except Exception as e:
+                logging.warning('Unable to store the response for %s: %s',
+                                url, e)
+
+        return response
+
+    def get_stats(self):
+        """Returns the hit and miss counts for the cache."""
+        keys = dict(
+            (make_cache_key('hosting-service-response-cache-stats:%s' % name),
+             name)
+            for name in self.STATS_KEYS
+        )
+        values = cache.get_many(list(keys.keys()))
+        stats = dict(
+            (name, int(values.get(key) or 0))
+            for key, name in keys.items()
+        )
+
+        requests = stats['hits'] + stats['misses']
+
+        if requests:
+            stats['hit_rate'] = 100 * stats['hits'] / requests
+        else:
+            stats['hit_rate'] = 0
+
+        stats['requests'] = requests
+
+        return stats
+
+    def _get_entry(self, key):
+        """Returns the stored entry for a key, or None."""
+        if make_cache_key(key) not in cache:
+            return None
+
+        def _missing():
+            raise _EntryMissing
+
+        try:
+            return cache_memoize(key, _missing, large_data=True)
+        except _EntryMissing:
+            return None
+
+    def _build_headers(self, items):
+        """Returns a response headers message with the given headers."""
+        headers = http_client.HTTPMessage(BytesIO())
+
+        for name, value in items:
+            headers[force_str(name)] = force_str(value)
+
+        return headers
+
+    def _increment_stat(self, name, delta=1):
+        """Increments one of the cache's counters."""
+        key = make_cache_key('hosting-service-response-cache-stats:%s' % name)
+
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # The counter doesn't exist yet.
+            cache.add(key, delta)
+        except Exception as e:
+            logging.debug('Unable to increment %s: %s', key, e)
+
+
+_response_cache = ResponseCache()
+
+
+def get_response_cache():
+    """Returns the cache used for hosting service API responses."""
+    return _response_cache
@@ -7,12 +7,12 @@ import mimetools
 
 from django.utils import six
 from django.utils.six.moves.urllib.parse import urlparse
-from django.utils.six.moves.urllib.request import (Request as URLRequest,
-                                                   HTTPBasicAuthHandler,
-                                                   urlopen)
 from django.utils.translation import ugettext_lazy as _
 from pkg_resources import iter_entry_points
 
+from reviewboard.hostingsvcs.responsecache import get_response_cache
+from reviewboard.scmtools.http import http_request
+
 
 class HostingService(object):
     """An interface to a hosting service for repositories and bug trackers.
@@ -117,6 +117,32 @@ class HostingService(object):
 
         return repository.get_scmtool().get_file(path, revision)
 
+    def get_files(self, repository, files):
+        """Returns the contents of several files in a repository.
+
+        ``files`` is a list of (path, revision, base_commit_id) tuples. This
+        returns a dictionary mapping each of those tuples to the contents of
+        the file. Files that can't be fetched are left out, so that the
+        errors can be reported when fetching them through get_file.
+
+        By default, this fetches each file with get_file. Subclasses that
+        can fetch many files at once should override this.
+        """
+        if not self.supports_repositories:
+            raise NotImplementedError
+
+        results = {}
+
+        for path, revision, base_commit_id in files:
+            try:
+                results[(path, revision, base_commit_id)] = self.get_file(
+                    repository, path, revision, base_commit_id=base_commit_id)
+            except Exception as e:
+                logging.debug('Unable to fetch %s (revision %s) in a batch: '
+                              '%s', path, revision, e)
+
+        return results
+
     def get_file_exists(self, repository, path, revision, *args, **kwargs):
         if not self.supports_repositories:
             raise NotImplementedError
@@ -269,23 +295,39 @@ class HostingService(object):
 
         return self._http_request(url, body, headers, **kwargs)
 
-    def _build_request(self, url, body=None, headers={}, username=None,
-                       password=None):
-        r = URLRequest(url, body, headers)
+    def _build_request_headers(self, headers={}, username=None,
+                               password=None):
+        headers = headers.copy()
 
         if username is not None and password is not None:
             auth_key = username + ':' + password
-            r.add_header(HTTPBasicAuthHandler.auth_header,
-                         'Basic %s' %
-                         base64.b64encode(auth_key.encode('utf-8')))
+            headers['Authorization'] = \
+                'Basic %s' % base64.b64encode(auth_key.encode('utf-8'))
 
-        return r
+        return headers
+
+    def _http_request(self, url, body=None, headers={}, cache_response=False,
+                      **kwargs):
+        """Makes an HTTP request to the service.
+
+        Requests are made through a pool of keep-alive connections shared
+        with other requests to the same host. See
+        reviewboard.scmtools.http.http_request.
+
+        If ``cache_response`` is set for a GET request, the response is
+        stored, and later requests for it only download it again if it has
+        changed. See reviewboard.hostingsvcs.responsecache.ResponseCache.
+
+        This returns a tuple of the response body and headers.
+        """
+        headers = self._build_request_headers(headers, **kwargs)
 
-    def _http_request(self, url, body=None, headers={}, **kwargs):
-        r = self._build_request(url, body, headers, **kwargs)
-        u = urlopen(r)
+        if cache_response and body is None:
+            response = get_response_cache().request(url, headers)
+        else:
+            response = http_request(url, body, headers)
 
-        return u.read(), u.headers
+        return response.data, response.headers
 
     def _build_form_data(self, fields, files):
         """Encodes data for use in an HTTP POST."""
@@ -1,9 +1,11 @@
 from __future__ import print_function, unicode_literals
 
 import json
+import threading
 from hashlib import md5
 from textwrap import dedent
 
+from django.core.cache import cache
 from django.utils import six
 from django.utils.six.moves import cStringIO as StringIO
 from django.utils.six.moves.urllib.error import HTTPError
@@ -12,12 +14,16 @@ from kgb import SpyAgency
 
 from reviewboard.hostingsvcs.errors import RepositoryError
 from reviewboard.hostingsvcs.models import HostingServiceAccount
-from reviewboard.hostingsvcs.service import get_hosting_service
-from reviewboard.scmtools.core import Branch
+from reviewboard.hostingsvcs.responsecache import get_response_cache
+from reviewboard.hostingsvcs.service import (HostingService,
+                                             get_hosting_service)
+from reviewboard.scmtools.core import Branch, Commit
 from reviewboard.scmtools.crypto_utils import encrypt_password
 from reviewboard.scmtools.errors import FileNotFoundError, SCMError
+from reviewboard.scmtools.http import HTTPConnectionPool
 from reviewboard.scmtools.models import Repository, Tool
 from reviewboard.testing import TestCase
+from reviewboard.testing.httpserver import LocalHTTPServer
 
 
 class ServiceTests(SpyAgency, TestCase):
@@ -39,6 +45,8 @@ class ServiceTests(SpyAgency, TestCase):
     def tearDown(self):
         super(ServiceTests, self).tearDown()
 
+        cache.clear()
+
         self.service_class._http_post = self._old_http_post
         self.service_class._http_get = self._old_http_get
 
@@ -1202,23 +1210,23 @@ class GitHubTests(ServiceTests):
             ],
         })
 
-        # This has to be a list to avoid python's hinky treatment of scope of
-        # variables assigned within a closure.
-        step = [1]
+        # The compare and tree APIs are fetched at the same time, once the
+        # commit has been fetched.
+        fetched = []
 
         def _http_get(service, url, *args, **kwargs):
             parsed = urlparse(url)
             if parsed.path == '/repos/myuser/myrepo/commits':
-                self.assertEqual(step[0], 1)
-                step[0] += 1
+                self.assertEqual(fetched, [])
+                fetched.append('commits')
 
                 query = parsed.query.split('&')
                 self.assertTrue(('sha=%s' % commit_sha) in query)
 
                 return commits_api_response, None
             elif parsed.path.startswith('/repos/myuser/myrepo/compare/'):
-                self.assertEqual(step[0], 2)
-                step[0] += 1
+                self.assertEqual(fetched[0], 'commits')
+                fetched.append('compare')
 
                 revs = parsed.path.split('/')[-1].split('...')
                 self.assertEqual(revs[0], parent_sha)
@@ -1226,10 +1234,11 @@ class GitHubTests(ServiceTests):
 
                 return compare_api_response, None
             elif parsed.path.startswith('/repos/myuser/myrepo/git/trees/'):
-                self.assertEqual(step[0], 3)
-                step[0] += 1
+                self.assertEqual(fetched[0], 'commits')
+                fetched.append('tree')
 
-                self.assertEqual(parsed.path.split('/')[-1], tree_sha)
+                self.assertEqual(parsed.path.split('/')[-1], parent_sha)
+                self.assertTrue('recursive=1' in parsed.query.split('&'))
 
                 return trees_api_response, None
             else:
@@ -1250,7 +1259,31 @@ class GitHubTests(ServiceTests):
         service = account.service
         change = service.get_change(repository, commit_sha)
 
+        self.assertEqual(sorted(fetched), ['commits', 'compare', 'tree'])
         self.assertEqual(change.message, 'Move .clearfix to defs.less')
+        self.assertEqual(change.parent, parent_sha)
+        self.assertEqual(change.date, '2013-06-25T23:31:22Z')
+        self.assertEqual(md5(change.diff.encode('utf-8')).hexdigest(),
+                         '5f63bd4f1cd8c4d8b46f2f72ea8d33bc')
+
+        # The change is cached, so fetching it again doesn't need any
+        # requests.
+        del fetched[:]
+        change = service.get_change(repository, commit_sha)
+
+        self.assertEqual(fetched, [])
+        self.assertEqual(md5(change.diff.encode('utf-8')).hexdigest(),
+                         '5f63bd4f1cd8c4d8b46f2f72ea8d33bc')
+
+        # Listing commits caches them without diffs. The cached diff is
+        # still used.
+        cache.set(repository.get_commit_cache_key(commit_sha),
+                  Commit('David Trowbridge', commit_sha,
+                         '2013-06-25T23:31:22Z',
+                         'Move .clearfix to defs.less', parent_sha))
+        change = service.get_change(repository, commit_sha)
+
+        self.assertEqual(fetched, [])
         self.assertEqual(md5(change.diff.encode('utf-8')).hexdigest(),
                          '5f63bd4f1cd8c4d8b46f2f72ea8d33bc')
 
@@ -1276,6 +1309,52 @@ class GitHubTests(ServiceTests):
             SCMError, 'Not Found',
             lambda: service.get_change(repository, commit_sha))
 
+    def test_api_get_many(self):
+        """Testing GitHub._api_get_many"""
+        threads = set()
+
+        def _http_get(service, url, *args, **kwargs):
+            threads.add(threading.current_thread())
+
+            if url == 'bad':
+                raise HTTPError(url, 404, '', {},
+                                StringIO(b'{"message": "Not Found"}'))
+
+            return json.dumps({'url': url}), {}
+
+        self.service_class._http_get = _http_get
+
+        service = self._get_hosting_account().service
+        urls = ['url%d' % i for i in range(10)]
+
+        self.assertEqual(service._api_get_many(urls),
+                         [{'url': url} for url in urls])
+        self.assertTrue(len(threads) <= service.max_concurrent_api_requests)
+        self.assertNotIn(threading.current_thread(), threads)
+
+        self.assertRaisesMessage(
+            Exception, 'Not Found',
+            lambda: service._api_get_many(['url1', 'bad', 'url2']))
+
+    def test_api_get_many_with_rate_limit_low(self):
+        """Testing GitHub._api_get_many with the rate limit running low"""
+        threads = set()
+
+        def _http_get(service, url, *args, **kwargs):
+            threads.add(threading.current_thread())
+
+            return json.dumps({'url': url}), {}
+
+        self.service_class._http_get = _http_get
+
+        service = self._get_hosting_account().service
+        service._check_rate_limits({'X-RateLimit-Remaining': '50'})
+        urls = ['url%d' % i for i in range(10)]
+
+        self.assertEqual(service._api_get_many(urls),
+                         [{'url': url} for url in urls])
+        self.assertEqual(threads, set([threading.current_thread()]))
+
     def _test_check_repository(self, expected_user='myuser', **kwargs):
         def _http_get(service, url, *args, **kwargs):
             self.assertEqual(
@@ -1927,3 +2006,135 @@ class VersionOneTests(ServiceTests):
                 'versionone_url': 'http://versionone.example.com',
             }),
             'http://versionone.example.com/assetdetail.v1?Number=%s')
+
+
+class HTTPRequestTests(TestCase):
+    """Unit tests for HostingService's HTTP requests."""
+    def setUp(self):
+        super(HTTPRequestTests, self).setUp()
+
+        self.service = HostingService(HostingServiceAccount())
+
+        self.server = LocalHTTPServer()
+        self.server.start()
+
+    def tearDown(self):
+        super(HTTPRequestTests, self).tearDown()
+
+        cache.clear()
+        HTTPConnectionPool.close_all()
+        self.server.stop()
+
+    def test_json_get(self):
+        """Testing HostingService._json_get"""
+        self.server.add_response('/api/repos', b'{"name": "myrepo"}',
+                                 headers={'Link': '<next>; rel="next"'},
+                                 gzip_body=True)
+
+        for i in range(2):
+            data, headers = self.service._json_get(
+                self.server.url + '/api/repos',
+                username='myuser', password='mypass')
+
+            self.assertEqual(data, {'name': 'myrepo'})
+            self.assertEqual(headers['Link'], '<next>; rel="next"')
+
+        request = self.server.requests[0]
+        self.assertEqual(request['method'], 'GET')
+        self.assertEqual(request['headers']['authorization'],
+                         'Basic bXl1c2VyOm15cGFzcw==')
+
+        # Both requests were made over the same connection.
+        self.assertEqual(self.server.num_connections, 1)
+
+    def test_http_post(self):
+        """Testing HostingService._http_post"""
+        self.server.add_response('/api/keys', b'{}', status=201)
+
+        self.service._http_post(self.server.url + '/api/keys',
+                                body='{"key": "abc"}',
+                                content_type='application/json')
+
+        request = self.server.requests[0]
+        self.assertEqual(request['method'], 'POST')
+        self.assertEqual(request['body'], b'{"key": "abc"}')
+        self.assertEqual(request['headers']['content-type'],
+                         'application/json')
+
+    def test_http_get_with_error(self):
+        """Testing HostingService._http_get with HTTP errors"""
+        with self.assertRaises(HTTPError) as cm:
+            self.service._http_get(self.server.url + '/api/missing')
+
+        self.assertEqual(cm.exception.code, 404)
+
+    def test_http_get_with_cache_response(self):
+        """Testing HostingService._http_get with cache_response"""
+        cache.clear()
+
+        self.server.add_response('/api/repos', b'{"name": "myrepo"}',
+                                 headers={'X-RateLimit-Remaining': '10'},
+                                 etag='"abc123"')
+        url = self.server.url + '/api/repos'
+
+        for i in range(3):
+            data, headers = self.service._http_get(url, cache_response=True)
+            self.assertEqual(data, b'{"name": "myrepo"}')
+            self.assertEqual(headers['ETag'], '"abc123"')
+            self.assertEqual(headers['X-RateLimit-Remaining'], '10')
+
+        requests = self.server.requests
+        self.assertEqual(len(requests), 3)
+        self.assertNotIn('if-none-match', requests[0]['headers'])
+        self.assertEqual(requests[1]['headers']['if-none-match'], '"abc123"')
+        self.assertEqual(requests[2]['headers']['if-none-match'], '"abc123"')
+
+        stats = get_response_cache().get_stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 66)
+
+    def test_http_get_with_cache_response_changed(self):
+        """Testing HostingService._http_get with cache_response and changed
+        responses
+        """
+        cache.clear()
+
+        url = self.server.url + '/api/repos'
+
+        self.server.add_response('/api/repos', b'{"name": "old"}',
+                                 etag='"abc123"')
+        self.assertEqual(self.service._http_get(url, cache_response=True)[0],
+                         b'{"name": "old"}')
+
+        self.server.add_response('/api/repos', b'{"name": "new"}',
+                                 etag='"def456"')
+        self.assertEqual(self.service._http_get(url, cache_response=True)[0],
+                         b'{"name": "new"}')
+        self.assertEqual(self.service._http_get(url, cache_response=True)[0],
+                         b'{"name": "new"}')
+
+        requests = self.server.requests
+        self.assertEqual(requests[1]['headers']['if-none-match'], '"abc123"')
+        self.assertEqual(requests[2]['headers']['if-none-match'], '"def456"')
+
+        stats = get_response_cache().get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+
+    def test_http_get_with_cache_response_per_user(self):
+        """Testing HostingService._http_get with cache_response stores
+        responses per user
+        """
+        cache.clear()
+
+        self.server.add_response('/api/repos', b'{}', etag='"abc123"')
+        url = self.server.url + '/api/repos'
+
+        self.service._http_get(url, cache_response=True,
+                               username='user1', password='pass')
+        self.service._http_get(url, cache_response=True,
+                               username='user2', password='pass')
+
+        for request in self.server.requests:
+            self.assertNotIn('if-none-match', request['headers'])
@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+from django.db.models.signals import post_delete
+
+from reviewboard.signals import initializing
+
+
+def _record_index_change(sender, review_request, **kwargs):
+    """Records that a review request needs to be updated in the index."""
+    from reviewboard.reviews.models import ReviewRequestIndexChange
+
+    ReviewRequestIndexChange.objects.record(review_request)
+
+
+def _record_index_deletion(sender, instance, **kwargs):
+    """Records that a deleted review request needs to leave the index."""
+    _record_index_change(sender, review_request=instance)
+
+
+def _connect_signals(**kwargs):
+    """Connects the signals used to keep track of search index changes."""
+    from reviewboard.reviews.models import ReviewRequest
+    from reviewboard.reviews.signals import (review_request_closed,
+                                             review_request_published,
+                                             review_request_reopened)
+
+    for signal in (review_request_published, review_request_closed,
+                   review_request_reopened):
+        signal.connect(_record_index_change, sender=ReviewRequest)
+
+    post_delete.connect(_record_index_deletion, sender=ReviewRequest)
+
+
+initializing.connect(_connect_signals)
@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from haystack import connections
+from haystack.backends.whoosh_backend import WhooshSearchBackend
+
+from reviewboard.reviews.models import ReviewRequest
+
+
+class Command(NoArgsCommand):
+    """Benchmarks rebuilding the search index for review requests.
+
+    The index is rebuilt from the review requests in the database, the
+    same way as ``rebuild_index``, but into a temporary Whoosh index, so
+    the site's own search index isn't touched. This is done once fetching
+    the review requests as ReviewRequestIndex does, and once fetching them
+    without prefetching any related data, for comparison.
+
+    A large data set to benchmark against can be created with
+    ``fill-database``.
+    """
+    help = ('Benchmarks rebuilding the search index against the review '
+            'requests in the database')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', default=None,
+                    dest='batch_size',
+                    help='The number of review requests to index at a time. '
+                         'Defaults to the search index batch size in the '
+                         'General Settings'),
+        make_option('--iterations', type='int', default=1,
+                    dest='iterations',
+                    help='The number of times to rebuild the index'),
+    )
+
+    def handle_noargs(self, **options):
+        batch_size = (options['batch_size'] or
+                      connections['default'].get_backend().batch_size)
+        iterations = options['iterations']
+
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        index = connections['default'].get_unified_index().get_index(
+            ReviewRequest)
+
+        unoptimized_queryset = ReviewRequest.objects.public(
+            status=None,
+            extra_query=Q(status='P') | Q(status='S'))
+
+        self.stdout.write('Rebuilding the search index for %d review '
+                          'requests (batch size %d, %d iterations)...\n'
+                          % (unoptimized_queryset.count(), batch_size,
+                             iterations))
+
+        results = [
+            ('prefetched',) + self._run(index, index.index_queryset(),
+                                        batch_size, iterations),
+            ('unoptimized',) + self._run(index, unoptimized_queryset,
+                                         batch_size, iterations),
+        ]
+
+        baseline = results[-1][1]
+
+        for label, elapsed, num_docs, num_queries in results:
+            self.stdout.write(
+                '  %-12s %8.3fs  %10.1f docs/sec  %6.2fx  %d queries\n'
+                % (label, elapsed, num_docs / max(elapsed, 1e-9),
+                   baseline / max(elapsed, 1e-9), num_queries))
+
+    def _run(self, index, queryset, batch_size, iterations):
+        """Rebuilds a temporary index from a queryset.
+
+        This returns the total time taken, the number of documents indexed
+        and the number of queries made.
+        """
+        elapsed = 0
+        num_docs = 0
+        num_queries = 0
+
+        for i in range(iterations):
+            path = tempfile.mkdtemp(prefix='rb-search-benchmark-')
+
+            try:
+                backend = WhooshSearchBackend('default', PATH=path)
+
+                # Set up the index ahead of time, so that creating it isn't
+                # counted.
+                backend.setup()
+
+                queryset = queryset.order_by('pk')
+                total = queryset.count()
+                start_time = time.time()
+
+                with CaptureQueriesContext(connection) as queries:
+                    # This is how Haystack's update_index fetches the objects
+                    # to index.
+                    for start in range(0, total, batch_size):
+                        end = min(start + batch_size, total)
+                        backend.update(index, queryset.all()[start:end])
+
+                elapsed += time.time() - start_time
+                num_docs += total
+                num_queries += len(queries)
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+
+        return elapsed, num_docs, num_queries
@@ -1,22 +1,28 @@
 from __future__ import unicode_literals
 
+import multiprocessing
 import os
 import random
 import string
 import sys
+import time
 from optparse import make_option
 
 from django import db
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
 from django.core.files import File
 from django.core.management.base import (BaseCommand, CommandError,
                                          NoArgsCommand)
-from django.db import transaction
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
 from django.utils import six
 
 from reviewboard.accounts.models import Profile
 from reviewboard.reviews.forms import UploadDiffForm
-from reviewboard.diffviewer.models import DiffSetHistory
+from reviewboard.diffviewer.diffutils import get_diff_compat_version
+from reviewboard.diffviewer.models import DiffSet, DiffSetHistory, FileDiff
 from reviewboard.reviews.models import ReviewRequest, Review, Comment
 from reviewboard.scmtools.models import Repository, Tool
 
@@ -94,6 +100,22 @@ NAMES = [
 
 
 class Command(NoArgsCommand):
+    """Populates the database with generated users and review requests.
+
+    By default, everything is created one object at a time, the way it
+    would be through the web UI, with diffs uploaded through UploadDiffForm.
+
+    Passing ``--bulk`` generates large data sets far more quickly, for
+    load testing. Objects are then inserted in bulk, in batches of users,
+    and no signals are sent. The diffs are parsed once, up front, and each
+    diff created shares the stored data for those diffs (through
+    FileDiffData), instead of storing another copy. Batches can be
+    generated in parallel by passing ``--processes``.
+
+    Passing ``--seed`` generates the same data set each time, so that
+    benchmark data sets can be reproduced. In bulk mode, this is true
+    regardless of the number of processes.
+    """
     help = 'Populates the database with the specified fields'
 
     option_list = BaseCommand.option_list + (
@@ -109,57 +131,50 @@ class Command(NoArgsCommand):
                     help='The number of comments per diff [min:max]'),
         make_option('-p', '--password', type="string", default=None,
                     dest='password',
-                    help='The login password for users created')
+                    help='The login password for users created'),
+        make_option('--seed', type='int', default=None, dest='seed',
+                    help='The random seed to use, for generating the same '
+                         'data each time'),
+        make_option('--bulk', action='store_true', default=False,
+                    dest='bulk',
+                    help='Insert objects in bulk, for quickly generating '
+                         'large data sets'),
+        make_option('--batch-size', type='int', default=100,
+                    dest='batch_size',
+                    help='The number of users to generate data for at a '
+                         'time when using --bulk'),
+        make_option('--processes', type='int', default=1,
+                    dest='processes',
+                    help='The number of batches to generate in parallel '
+                         'when using --bulk'),
     )
 
+    def handle_noargs(self, **options):
+        if options['bulk']:
+            self._fill_in_bulk(**options)
+        else:
+            self._fill_one_at_a_time(**options)
+
     @transaction.atomic
-    def handle_noargs(self, users=None, review_requests=None, diffs=None,
-                      reviews=None, diff_comments=None, password=None,
-                      verbosity=NORMAL, **options):
+    def _fill_one_at_a_time(self, users=None, review_requests=None,
+                            diffs=None, reviews=None, diff_comments=None,
+                            password=None, seed=None, verbosity=NORMAL,
+                            **options):
         num_of_requests = None
         num_of_diffs = None
         num_of_reviews = None
         num_of_diff_comments = None
-        random.seed()
+        random.seed(seed)
 
         if review_requests:
             num_of_requests = self.parseCommand("review_requests",
                                                 review_requests)
-
-            # Setup repository.
-            repo_dir = os.path.abspath(
-                os.path.join(sys.argv[0], "..", "scmtools", "testdata",
-                             "git_repo"))
-
-            # Throw exception on error so transaction reverts.
-            if not os.path.exists(repo_dir):
-                raise CommandError("No path to the repository")
-
-            self.repository = Repository.objects.create(
-                name="Test Repository", path=repo_dir,
-                tool=Tool.objects.get(name="Git"))
+            self.repository = self._create_repository()
 
         if diffs:
             num_of_diffs = self.parseCommand("diffs", diffs)
-
-            # Create the diff directory locations.
-            diff_dir_tmp = os.path.abspath(
-                os.path.join(sys.argv[0], "..", "reviews", "management",
-                             "commands", "diffs"))
-
-            # Throw exception on error so transaction reverts.
-            if not os.path.exists(diff_dir_tmp):
-                    raise CommandError("Diff dir does not exist")
-
-            diff_dir = diff_dir_tmp + '/'  # Add trailing slash.
-
-            # Get a list of the appropriate files.
-            files = [f for f in os.listdir(diff_dir)
-                     if f.endswith('.diff')]
-
-            # Check for any diffs in the files.
-            if len(files) == 0:
-                raise CommandError("No diff files in this directory")
+            diff_dir = self._get_diff_dir() + '/'  # Add trailing slash.
+            files = self._get_diff_files(diff_dir)
 
         if reviews:
             num_of_reviews = self.parseCommand("reviews", reviews)
@@ -317,6 +332,286 @@ class Command(NoArgsCommand):
                 self.stdout.write("user %s created successfully"
                                   % new_user.username)
 
+    def _fill_in_bulk(self, users=None, review_requests=None, diffs=None,
+                      reviews=None, diff_comments=None, password=None,
+                      seed=None, batch_size=100, processes=1, **options):
+        """Populates the database by inserting objects in bulk.
+
+        Users are generated in batches of ``batch_size``. The number of
+        objects of each type in a batch is decided up front, so that each
+        batch can be given its own range of primary keys to use. That lets
+        batches be inserted independently, in any order, and lets objects
+        be inserted along with the objects that reference them, without
+        looking up the IDs of anything inserted.
+
+        Each batch gets its own random number generator, seeded from
+        ``seed``, so the data generated doesn't depend on which process
+        generates a batch.
+        """
+        if not users:
+            raise CommandError("At least one user must be added")
+
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        if processes < 1:
+            raise CommandError('--processes must be at least 1')
+
+        num_of_requests = None
+        num_of_diffs = None
+        num_of_reviews = None
+        num_of_diff_comments = None
+        repository = None
+        diff_pool = []
+
+        if review_requests:
+            num_of_requests = self.parseCommand("review_requests",
+                                                review_requests)
+            repository = self._create_repository()
+
+            if diffs:
+                num_of_diffs = self.parseCommand("diffs", diffs)
+                diff_pool = self._create_diff_pool(repository)
+
+        if reviews:
+            num_of_reviews = self.parseCommand("reviews", reviews)
+
+        if diff_comments:
+            num_of_diff_comments = self.parseCommand("diff-comments",
+                                                     diff_comments)
+
+        # Everything shared by the batches.
+        job_info = {
+            'diff_pool': diff_pool,
+            'repository_id': repository and repository.pk,
+            'diffcompat': get_diff_compat_version(repository),
+
+            # Hashing the password is slow, so it's only done once.
+            'password': make_password(password or 'test1'),
+        }
+
+        num_batches = (users + batch_size - 1) // batch_size
+        jobs = self._iter_bulk_jobs(
+            users, batch_size, random.Random(seed), job_info,
+            (num_of_requests, num_of_diffs, num_of_reviews,
+             num_of_diff_comments))
+
+        self.stdout.write('Generating %d users in %d batches...\n'
+                          % (users, num_batches))
+
+        start_time = time.time()
+        totals = dict((model, 0) for model in BULK_MODELS)
+
+        if processes > 1:
+            # The workers need their own database connections.
+            for conn in connections.all():
+                conn.close()
+
+            pool = multiprocessing.Pool(processes)
+
+            try:
+                results = pool.imap_unordered(_create_batch, jobs)
+
+                for i, counts in enumerate(results):
+                    self._report_batch(i, num_batches, counts, totals,
+                                       start_time)
+
+                pool.close()
+            finally:
+                pool.terminate()
+        else:
+            for i, job in enumerate(jobs):
+                self._report_batch(i, num_batches, _create_batch(job),
+                                   totals, start_time)
+
+        # The objects were inserted with their primary keys, so databases
+        # using sequences need to be told to start after the highest one.
+        for sql in connection.ops.sequence_reset_sql(no_style(),
+                                                     BULK_MODELS):
+            connection.cursor().execute(sql)
+
+        self.stdout.write('Done. Created %s.\n'
+                          % self._format_counts(totals))
+
+    def _iter_bulk_jobs(self, users, batch_size, rng, job_info, ranges):
+        """Yields the jobs for creating each batch of users in bulk.
+
+        Each job contains the plan for the batch, which is the number of
+        objects of each type to create for each user, and the first primary
+        key to use for each model. The plans are generated as the jobs are
+        needed, so they don't all have to be kept in memory.
+        """
+        num_of_requests, num_of_diffs, num_of_reviews, num_of_diff_comments = \
+            ranges
+        diff_pool = job_info['diff_pool']
+        next_pks = dict(
+            (model, (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1)
+            for model in BULK_MODELS
+        )
+
+        for first_user in range(0, users, batch_size):
+            batch_rng = random.Random(rng.getrandbits(64))
+            plan = []
+
+            for i in range(min(batch_size, users - first_user)):
+                user_review_requests = []
+
+                for j in range(self._pick_random_value(batch_rng,
+                                                       num_of_requests)):
+                    review_request_diffs = []
+
+                    for k in range(self._pick_random_value(batch_rng,
+                                                           num_of_diffs)):
+                        review_request_diffs.append((
+                            batch_rng.randrange(len(diff_pool)),
+                            [
+                                self._pick_random_value(batch_rng,
+                                                        num_of_diff_comments)
+                                for l in range(self._pick_random_value(
+                                    batch_rng, num_of_reviews))
+                            ]))
+
+                    user_review_requests.append(review_request_diffs)
+
+                plan.append(user_review_requests)
+
+            # Through models for many-to-many relations can't be pickled,
+            # so the primary keys are passed in the order of BULK_MODELS.
+            job = dict(job_info,
+                       plan=plan,
+                       rng=batch_rng,
+                       first_pks=[next_pks[model] for model in BULK_MODELS])
+
+            for model, count in six.iteritems(
+                    _count_planned_objects(plan, diff_pool)):
+                next_pks[model] += count
+
+            yield job
+
+    def _report_batch(self, i, num_batches, counts, totals, start_time):
+        """Writes the progress after a batch has been created."""
+        for model, count in zip(BULK_MODELS, counts):
+            totals[model] += count
+
+        num_objects = sum(six.itervalues(totals))
+
+        self.stdout.write(
+            'Created batch %d of %d (%.1f objects/sec)\n'
+            % (i + 1, num_batches,
+               num_objects / max(time.time() - start_time, 1e-9)))
+
+    def _format_counts(self, counts):
+        """Formats the number of objects created for each model."""
+        return ', '.join(
+            '%d %s' % (counts[model], model._meta.verbose_name_plural)
+            for model in BULK_MODELS
+        )
+
+    def _create_repository(self):
+        """Creates a repository for the review requests."""
+        repo_dir = os.path.abspath(
+            os.path.join(sys.argv[0], "..", "scmtools", "testdata",
+                         "git_repo"))
+
+        # Throw exception on error so transaction reverts.
+        if not os.path.exists(repo_dir):
+            raise CommandError("No path to the repository")
+
+        return Repository.objects.create(
+            name="Test Repository", path=repo_dir,
+            tool=Tool.objects.get(name="Git"))
+
+    def _get_diff_dir(self):
+        """Returns the directory containing the diffs to upload."""
+        diff_dir = os.path.abspath(
+            os.path.join(sys.argv[0], "..", "reviews", "management",
+                         "commands", "diffs"))
+
+        # Throw exception on error so transaction reverts.
+        if not os.path.exists(diff_dir):
+            raise CommandError("Diff dir does not exist")
+
+        return diff_dir
+
+    def _get_diff_files(self, diff_dir):
+        """Returns the names of the diffs to upload."""
+        files = sorted(f for f in os.listdir(diff_dir)
+                       if f.endswith('.diff'))
+
+        # Check for any diffs in the files.
+        if len(files) == 0:
+            raise CommandError("No diff files in this directory")
+
+        return files
+
+    def _create_diff_pool(self, repository):
+        """Parses the diffs to use when generating data in bulk.
+
+        The data for each file in the diffs is stored once, as a
+        FileDiffData. This returns a list of the diffs, each of which is a
+        list of the field values for a FileDiff of each file in the diff.
+        """
+        tool = repository.get_scmtool()
+        diff_dir = self._get_diff_dir()
+        diff_pool = []
+
+        for filename in self._get_diff_files(diff_dir):
+            with open(os.path.join(diff_dir, filename), 'rb') as f:
+                data = f.read()
+
+            files = []
+
+            for f in tool.get_parser(data).parse():
+                source_file, source_revision = tool.parse_diff_revision(
+                    f.origFile, f.origInfo, f.moved)
+
+                if f.deleted:
+                    status = FileDiff.DELETED
+                elif f.moved:
+                    status = FileDiff.MOVED
+                else:
+                    status = FileDiff.MODIFIED
+
+                # This stores the diff data, if it isn't already stored.
+                filediff = FileDiff(source_file=source_file,
+                                    dest_file=f.newFile,
+                                    source_revision=source_revision,
+                                    dest_detail=f.newInfo,
+                                    diff=f.data,
+                                    binary=f.binary,
+                                    status=status)
+                filediff.set_line_counts(raw_insert_count=f.insert_count,
+                                         raw_delete_count=f.delete_count)
+
+                files.append({
+                    'source_file': filediff.source_file,
+                    'dest_file': filediff.dest_file,
+                    'source_revision': filediff.source_revision,
+                    'dest_detail': filediff.dest_detail,
+                    'diff_hash_id': filediff.diff_hash_id,
+                    'binary': filediff.binary,
+                    'status': filediff.status,
+                    'extra_data': filediff.get_extra_data_json(),
+                })
+
+            if files:
+                diff_pool.append((filename, files))
+
+        if not diff_pool:
+            raise CommandError("No diff files in this directory")
+
+        return diff_pool
+
+    def _pick_random_value(self, rng, value):
+        """Picks a value in a range, like pickRandomValue, using rng."""
+        if not value:
+            return 0
+
+        if len(value) == 1:
+            return value[0]
+
+        return rng.randrange(value[0], value[1])
+
     def parseCommand(self, com_arg, com_string):
         """Parse the values given in the command line."""
         try:
@@ -351,3 +646,148 @@ class Command(NoArgsCommand):
 
         return ' '.join(random.choice(LOREM_VOCAB)
                         for x in range(0, max_size))
+
+
+# The models inserted in bulk with their primary keys, in the order they
+# must be inserted.
+BULK_MODELS = (User, Profile, DiffSetHistory, ReviewRequest, DiffSet,
+               FileDiff, Review, Comment, Review.comments.through)
+
+
+def _count_planned_objects(plan, diff_pool):
+    """Returns the number of objects of each model in a batch's plan.
+
+    The plan is a list of users, each a list of review requests, each a
+    list of diffs. Each diff is a tuple of the index of the diff in the
+    diff pool and a list of reviews, each of which is the number of
+    comments in that review.
+    """
+    counts = dict((model, 0) for model in BULK_MODELS)
+    counts[User] = len(plan)
+    counts[Profile] = len(plan)
+
+    for user_review_requests in plan:
+        counts[DiffSetHistory] += len(user_review_requests)
+        counts[ReviewRequest] += len(user_review_requests)
+
+        for review_request_diffs in user_review_requests:
+            counts[DiffSet] += len(review_request_diffs)
+
+            for pool_index, diff_reviews in review_request_diffs:
+                counts[FileDiff] += len(diff_pool[pool_index][1])
+                counts[Review] += len(diff_reviews)
+                counts[Comment] += sum(diff_reviews)
+                counts[Review.comments.through] += sum(diff_reviews)
+
+    return counts
+
+
+def _create_batch(job):
+    """Creates the objects for a batch of users in bulk.
+
+    This may be run in a worker process. The objects are created with the
+    primary keys assigned to the batch, and the same generated data
+    regardless of the process. This returns the number of objects created
+    for each model, in the order of BULK_MODELS.
+    """
+    rng = job['rng']
+    next_pks = dict(zip(BULK_MODELS, job['first_pks']))
+    diff_pool = job['diff_pool']
+    repository_id = job['repository_id']
+    objs = dict((model, []) for model in BULK_MODELS)
+
+    def _add(model, **kwargs):
+        obj = model(pk=next_pks[model], **kwargs)
+        next_pks[model] += 1
+        objs[model].append(obj)
+
+        return obj
+
+    def _lorem_ipsum(size):
+        return ' '.join(rng.choice(LOREM_VOCAB) for x in range(size))
+
+    for user_review_requests in job['plan']:
+        first_name = rng.choice(NAMES)
+        user = _add(User,
+                    username='%s%d' % (first_name.lower(), next_pks[User]),
+                    first_name=first_name,
+                    last_name=rng.choice(NAMES),
+                    email='test@example.com',
+                    password=job['password'],
+                    is_staff=False,
+                    is_active=True,
+                    is_superuser=False)
+
+        _add(Profile,
+             user_id=user.pk,
+             first_time_setup_done=True,
+             collapsed_diffs=True,
+             wordwrapped_diffs=True,
+             syntax_highlighting=True,
+             show_closed=True)
+
+        for review_request_diffs in user_review_requests:
+            diffset_history = _add(DiffSetHistory, name='')
+            review_request = _add(
+                ReviewRequest,
+                submitter_id=user.pk,
+                status=ReviewRequest.PENDING_REVIEW,
+                public=True,
+                summary=_lorem_ipsum(SUMMARY_SIZE),
+                description=_lorem_ipsum(DESCRIPTION_SIZE),
+                repository_id=repository_id,
+                diffset_history_id=diffset_history.pk,
+                # The counts would otherwise be computed and saved as soon
+                # as the review request is constructed. None of the
+                # comments open issues.
+                issue_open_count=0,
+                issue_resolved_count=0,
+                issue_dropped_count=0)
+
+            for revision, (pool_index, diff_reviews) in \
+                    enumerate(review_request_diffs, start=1):
+                diff_name, diff_files = diff_pool[pool_index]
+                diffset = _add(DiffSet,
+                               name=diff_name,
+                               revision=revision,
+                               basedir='',
+                               history_id=diffset_history.pk,
+                               repository_id=repository_id,
+                               diffcompat=job['diffcompat'])
+
+                filediffs = [
+                    _add(FileDiff, diffset_id=diffset.pk, **fields)
+                    for fields in diff_files
+                ]
+
+                for num_comments in diff_reviews:
+                    review = _add(Review,
+                                  review_request_id=review_request.pk,
+                                  user_id=user.pk,
+                                  public=True,
+                                  body_top='',
+                                  body_bottom='')
+
+                    for m in range(num_comments):
+                        # Choose random lines to comment.
+                        max_lines = 220
+                        first_line = rng.randrange(1, max_lines - 1)
+                        comment = _add(
+                            Comment,
+                            filediff_id=filediffs[0].pk,
+                            text='comment number %s' % (m + 1),
+                            first_line=first_line,
+                            num_lines=rng.randrange(
+                                1, max_lines - first_line))
+
+                        _add(Review.comments.through,
+                             review_id=review.pk,
+                             comment_id=comment.pk)
+
+    with transaction.atomic():
+        for model in BULK_MODELS:
+            model.objects.bulk_create(objs[model])
+
+    db.reset_queries()
+
+    return [len(objs[model]) for model in BULK_MODELS]
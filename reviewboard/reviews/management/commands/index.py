@@ -1,7 +1,11 @@
 import optparse
 
 from django.core.management import call_command
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from haystack import connections
+
+from reviewboard.reviews.models import ReviewRequest, ReviewRequestIndexChange
 
 
 class Command(BaseCommand):
@@ -9,13 +13,61 @@ class Command(BaseCommand):
         optparse.make_option('--full', action='store_true',
                              dest='rebuild', default=False,
                              help='Rebuild the database index'),
+        optparse.make_option('--incremental', action='store_true',
+                             dest='incremental', default=False,
+                             help='Only update the index for review '
+                                  'requests that have been published, '
+                                  'closed, reopened or deleted since the '
+                                  'last update. Review requests that were '
+                                  'deleted are removed from the index'),
+        optparse.make_option('--batch-size', type='int',
+                             dest='batch_size', default=None,
+                             help='The number of review requests to index '
+                                  'at a time. Defaults to the search index '
+                                  'batch size in the General Settings'),
     )
     help = "Creates a search index of review requests"
     requires_model_validation = True
 
     def handle(self, *args, **options):
+        if options['rebuild'] and options['incremental']:
+            raise CommandError('--full and --incremental cannot be used '
+                               'together')
+
+        batch_size = options['batch_size']
+
+        if batch_size is not None and batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        index = connections['default'].get_unified_index().get_index(
+            ReviewRequest)
+
+        if options['incremental']:
+            count = index.update_changed(batch_size=batch_size)
+
+            self.stdout.write('Updated the search index for %d review '
+                              'requests\n' % count)
+            return
+
         # Call the appropriate Haystack command to refresh the search index.
+        # If no batch size was given, Haystack will use the one configured
+        # for the search backend.
         if options['rebuild']:
-            call_command('rebuild_index', interactive=False)
+            # The rebuilt index covers every change recorded so far, so
+            # those no longer need to be processed. Anything recorded
+            # while rebuilding is left for the next update.
+            changes = ReviewRequestIndexChange.objects.all()
+            last_change_id = changes.aggregate(Max('pk'))['pk__max']
+
+            call_command('rebuild_index', interactive=False,
+                         batchsize=batch_size)
+
+            if last_change_id is not None:
+                changes.filter(pk__lte=last_change_id).delete()
         else:
-            call_command('update_index')
+            call_command('update_index', batchsize=batch_size)
+
+            # Updating the index doesn't remove anything from it, so the
+            # recorded changes are still processed, removing any review
+            # requests that were closed or deleted, and then cleared.
+            index.update_changed(batch_size=batch_size)
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import itertools
 import logging
 
 from django.contrib.auth.models import User
@@ -7,8 +8,10 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db import connections, router, transaction
 from django.db.models import Manager, Q
 from django.db.models.query import QuerySet
+from django.db.models.sql.constants import GET_ITERATOR_CHUNK_SIZE
 from django.utils import six
 from djblets.db.managers import ConcurrencyManager
+from djblets.siteconfig.models import SiteConfiguration
 
 from reviewboard.diffviewer.models import DiffSetHistory
 from reviewboard.scmtools.errors import ChangeNumberInUseError
@@ -59,6 +62,49 @@ class ReviewGroupManager(Manager):
 
 
 class ReviewRequestQuerySet(QuerySet):
+    _prefetch_diff_filenames = False
+
+    def with_diff_filenames(self):
+        """Prefetches the filenames in the diffs for each review request.
+
+        As review requests are fetched, the filenames for each chunk of
+        review requests are fetched in a single query, and returned by
+        ReviewRequest.get_all_diff_filenames. This avoids a query per review
+        request when indexing them for search.
+        """
+        clone = self._clone()
+        clone._prefetch_diff_filenames = True
+
+        return clone
+
+    def iterator(self):
+        results = super(ReviewRequestQuerySet, self).iterator()
+
+        if self._prefetch_diff_filenames:
+            results = self._iter_with_diff_filenames(results)
+
+        return results
+
+    def _iter_with_diff_filenames(self, results):
+        """Yields review requests, prefetching filenames a chunk at a time."""
+        while True:
+            review_requests = list(itertools.islice(results,
+                                                    GET_ITERATOR_CHUNK_SIZE))
+
+            if not review_requests:
+                break
+
+            self.model.prefetch_all_diff_filenames(review_requests)
+
+            for review_request in review_requests:
+                yield review_request
+
+    def _clone(self, *args, **kwargs):
+        clone = super(ReviewRequestQuerySet, self)._clone(*args, **kwargs)
+        clone._prefetch_diff_filenames = self._prefetch_diff_filenames
+
+        return clone
+
     def with_counts(self, user):
         queryset = self
 
@@ -336,6 +382,19 @@ class ReviewRequestManager(ConcurrencyManager):
                                           Q(local_site=local_site))
 
 
+class ReviewRequestIndexChangeManager(Manager):
+    """A manager for ReviewRequestIndexChange objects."""
+    def record(self, review_request):
+        """Records that a review request needs to be updated in the index.
+
+        This does nothing unless search is enabled.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if siteconfig.get('search_enable'):
+            self.create(review_request_id=review_request.pk)
+
+
 class ReviewManager(ConcurrencyManager):
     """A manager for Review models.
 
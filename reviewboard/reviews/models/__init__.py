@@ -9,6 +9,8 @@ from reviewboard.reviews.models.group import Group
 from reviewboard.reviews.models.review import Review
 from reviewboard.reviews.models.review_request import ReviewRequest
 from reviewboard.reviews.models.review_request_draft import ReviewRequestDraft
+from reviewboard.reviews.models.review_request_index_change import \
+    ReviewRequestIndexChange
 from reviewboard.reviews.models.screenshot import Screenshot
 from reviewboard.reviews.models.screenshot_comment import ScreenshotComment
 
@@ -22,6 +24,7 @@ __all__ = [
     'Review',
     'ReviewRequest',
     'ReviewRequestDraft',
+    'ReviewRequestIndexChange',
     'Screenshot',
     'ScreenshotComment',
 ]
@@ -506,11 +506,42 @@ class ReviewRequest(BaseReviewRequestDetails):
         return self._diffsets
 
     def get_all_diff_filenames(self):
-        """Returns a set of filenames from files in all diffsets."""
+        """Returns a set of filenames from files in all diffsets.
+
+        If the filenames were fetched ahead of time by
+        prefetch_all_diff_filenames, those will be returned instead.
+        """
+        if hasattr(self, '_all_diff_filenames'):
+            return self._all_diff_filenames
+
         q = FileDiff.objects.filter(
             diffset__history__id=self.diffset_history_id)
         return set(q.values_list('source_file', 'dest_file'))
 
+    @classmethod
+    def prefetch_all_diff_filenames(cls, review_requests):
+        """Fetches the filenames in all diffsets for several review requests.
+
+        This fetches the filenames for all the review requests in a single
+        query, which will then be returned by get_all_diff_filenames.
+        """
+        filenames = {}
+
+        q = FileDiff.objects.filter(
+            diffset__history__in=[
+                review_request.diffset_history_id
+                for review_request in review_requests
+            ])
+
+        for history_id, source_file, dest_file in \
+                q.values_list('diffset__history', 'source_file', 'dest_file'):
+            filenames.setdefault(history_id, set()).add(
+                (source_file, dest_file))
+
+        for review_request in review_requests:
+            review_request._all_diff_filenames = \
+                filenames.get(review_request.diffset_history_id, set())
+
     def get_latest_diffset(self):
         """Returns the latest diffset for this review request."""
         try:
@@ -10,7 +10,7 @@ from djblets.db.managers import ConcurrencyManager
 
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.changedescs.models import ChangeDescription
-from reviewboard.diffviewer.models import DiffSet
+from reviewboard.diffviewer.models import DiffChunkJob, DiffSet
 from reviewboard.reviews.models.group import Group
 from reviewboard.reviews.models.base_review_request_details import \
     BaseReviewRequestDetails
@@ -307,6 +307,12 @@ class ReviewRequestDraft(BaseReviewRequestDetails):
             self.diffset.history = review_request.diffset_history
             self.diffset.save(update_fields=['history'])
 
+            # Reviewers will be looking at the new diff soon, so make sure
+            # it's generated ahead of anything that's only been uploaded.
+            DiffChunkJob.objects.queue_filediffs(
+                self.diffset.files.all(),
+                priority=DiffChunkJob.PRIORITY_PUBLISH)
+
         if self.changedesc:
             self.changedesc.timestamp = timezone.now()
             self.changedesc.rich_text = self.rich_text
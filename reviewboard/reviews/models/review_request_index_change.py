@@ -0,0 +1,30 @@
+from __future__ import unicode_literals
+
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from reviewboard.reviews.managers import ReviewRequestIndexChangeManager
+
+
+class ReviewRequestIndexChange(models.Model):
+    """A record of a review request needing to be updated in the search index.
+
+    These are recorded when review requests are published, closed,
+    reopened or deleted. Running the ``index`` management command with
+    ``--incremental`` updates the search index for only those review
+    requests, and then removes the records. Full and regular runs of the
+    command also remove the records they cover.
+
+    The review request is stored by ID, rather than as a foreign key, so
+    that changes for deleted review requests are kept until they're
+    removed from the index.
+    """
+    review_request_id = models.IntegerField(_('review request ID'),
+                                            db_index=True)
+    timestamp = models.DateTimeField(_('timestamp'), default=timezone.now)
+
+    objects = ReviewRequestIndexChangeManager()
+
+    class Meta:
+        app_label = 'reviews'
@@ -1,7 +1,7 @@
-from django.db.models import Q
+from django.db.models import Max, Q
 from haystack import indexes
 
-from reviewboard.reviews.models import ReviewRequest
+from reviewboard.reviews.models import ReviewRequest, ReviewRequestIndexChange
 
 
 class ReviewRequestIndex(indexes.SearchIndex, indexes.Indexable):
@@ -27,7 +27,74 @@ class ReviewRequestIndex(indexes.SearchIndex, indexes.Indexable):
         return ReviewRequest
 
     def index_queryset(self, using=None):
-        """Index only public pending and submitted review requests."""
-        return self.get_model().objects.public(
-            status=None,
-            extra_query=Q(status='P') | Q(status='S'))
+        """Index only public pending and submitted review requests.
+
+        The submitters and diff filenames used in the indexed fields are
+        fetched along with the review requests, rather than one review
+        request at a time.
+        """
+        return (
+            self.get_model().objects.public(
+                status=None,
+                extra_query=Q(status='P') | Q(status='S'))
+            .select_related('submitter')
+            .with_diff_filenames()
+        )
+
+    def update_changed(self, batch_size=None, using=None):
+        """Updates the index for review requests that have changed.
+
+        This processes the review requests recorded as
+        ReviewRequestIndexChanges, in batches of ``batch_size``, defaulting
+        to the batch size configured for the search backend. Each review
+        request is updated in the index if it should be indexed, or removed
+        from the index otherwise.
+
+        The changes are removed once processed. Changes recorded while this
+        is running are left for the next run.
+
+        This returns the number of review requests processed.
+        """
+        backend = self._get_backend(using)
+
+        if backend is None:
+            return 0
+
+        changes = ReviewRequestIndexChange.objects.all()
+        last_change_id = changes.aggregate(Max('pk'))['pk__max']
+
+        if last_change_id is None:
+            return 0
+
+        batch_size = batch_size or backend.batch_size
+
+        changes = changes.filter(pk__lte=last_change_id)
+        review_request_ids = list(
+            changes.order_by('review_request_id')
+            .values_list('review_request_id', flat=True)
+            .distinct())
+
+        for i in range(0, len(review_request_ids), batch_size):
+            batch_ids = review_request_ids[i:i + batch_size]
+            review_requests = list(
+                self.index_queryset(using).filter(pk__in=batch_ids))
+
+            if review_requests:
+                backend.update(self, review_requests)
+
+            # Anything that's no longer public, or was discarded or
+            # deleted, shouldn't show up in search results. Deleted review
+            # requests can't be fetched, so these are removed by their
+            # identifiers in the index.
+            removed_ids = (set(batch_ids) -
+                           set(review_request.pk
+                               for review_request in review_requests))
+
+            for review_request_id in sorted(removed_ids):
+                backend.remove('%s.%s.%s' % (ReviewRequest._meta.app_label,
+                                             ReviewRequest._meta.model_name,
+                                             review_request_id))
+
+            changes.filter(review_request_id__in=batch_ids).delete()
+
+        return len(review_request_ids)
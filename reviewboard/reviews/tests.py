@@ -1,20 +1,33 @@
 from __future__ import print_function, unicode_literals
 
 from datetime import timedelta
+from importlib import import_module
 import logging
 import os
+import re
+import sys
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
+from django.core import serializers
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import models, transaction
 from django.template import Context, Template
 from django.utils import six
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.testing.decorators import add_fixtures
+from haystack import connections
+from haystack.management.commands.rebuild_index import \
+    Command as RebuildIndexCommand
+from haystack.management.commands.update_index import \
+    Command as UpdateIndexCommand
 from kgb import SpyAgency
 
 from reviewboard.accounts.models import Profile, LocalSiteProfile
 from reviewboard.attachments.models import FileAttachment
+from reviewboard.diffviewer.models import (DiffChunkJob, DiffSet, FileDiff,
+                                           FileDiffData)
 from reviewboard.reviews.forms import DefaultReviewerForm, GroupForm
 from reviewboard.reviews.markdown_utils import (markdown_escape,
                                                 markdown_unescape)
@@ -23,8 +36,10 @@ from reviewboard.reviews.models import (Comment,
                                         Group,
                                         ReviewRequest,
                                         ReviewRequestDraft,
+                                        ReviewRequestIndexChange,
                                         Review,
                                         Screenshot)
+from reviewboard.reviews.search_indexes import ReviewRequestIndex
 from reviewboard.scmtools.core import Commit
 from reviewboard.scmtools.models import Repository, Tool
 from reviewboard.site.models import LocalSite
@@ -545,6 +560,200 @@ class ReviewRequestTests(TestCase):
         self.assertTrue(review_request.public)
 
 
+class SearchIndexTests(SpyAgency, TestCase):
+    """Tests for keeping the search index up to date."""
+    fixtures = ['test_users', 'test_scmtools']
+
+    def setUp(self):
+        super(SearchIndexTests, self).setUp()
+
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.siteconfig.set('search_enable', True)
+        self.siteconfig.save()
+
+    def tearDown(self):
+        super(SearchIndexTests, self).tearDown()
+
+        self.siteconfig.set('search_enable', False)
+        self.siteconfig.save()
+
+    def test_changes_recorded(self):
+        """Testing ReviewRequestIndexChanges recorded when publishing,
+        closing and reopening review requests
+        """
+        review_request = self.create_review_request(publish=True)
+        review_request.close(ReviewRequest.SUBMITTED)
+        review_request.reopen()
+
+        self.assertEqual(
+            list(ReviewRequestIndexChange.objects.values_list(
+                'review_request_id', flat=True)),
+            [review_request.pk] * 3)
+
+    def test_changes_not_recorded_with_search_disabled(self):
+        """Testing ReviewRequestIndexChanges not recorded when search is
+        disabled
+        """
+        self.siteconfig.set('search_enable', False)
+        self.siteconfig.save()
+
+        self.create_review_request(publish=True)
+
+        self.assertFalse(ReviewRequestIndexChange.objects.exists())
+
+    def test_update_changed(self):
+        """Testing ReviewRequestIndex.update_changed"""
+        class DummyBackend(object):
+            def __init__(self):
+                self.updated = []
+                self.removed = []
+
+            def update(self, index, iterable):
+                self.updated.append([
+                    (obj.pk, index.full_prepare(obj)['file'])
+                    for obj in iterable
+                ])
+
+            def remove(self, obj_or_string):
+                self.removed.append(obj_or_string)
+
+        review_request1 = self.create_review_request(publish=True,
+                                                     create_repository=True)
+        diffset = self.create_diffset(review_request1)
+        self.create_filediff(diffset)
+
+        review_request2 = self.create_review_request(publish=True)
+        review_request3 = self.create_review_request(publish=True)
+        review_request3.close(ReviewRequest.DISCARDED)
+
+        # This one hasn't changed, and shouldn't be touched.
+        self.create_review_request(public=True)
+
+        backend = DummyBackend()
+        index = ReviewRequestIndex()
+        self.spy_on(index._get_backend, call_fake=lambda *args: backend)
+
+        self.assertEqual(index.update_changed(batch_size=1), 3)
+        self.assertEqual(len(backend.updated), 2)
+        self.assertEqual(sorted(sum(backend.updated, [])), sorted([
+            (review_request1.pk, "set([(u'/test-file', u'/test-file')])"),
+            (review_request2.pk, 'set([])'),
+        ]))
+        self.assertEqual(backend.removed,
+                         ['reviews.reviewrequest.%s' % review_request3.pk])
+        self.assertFalse(ReviewRequestIndexChange.objects.exists())
+
+        # There's nothing left to update.
+        self.assertEqual(index.update_changed(), 0)
+
+    def test_update_changed_with_deleted(self):
+        """Testing ReviewRequestIndex.update_changed with deleted review
+        requests
+        """
+        class DummyBackend(object):
+            def __init__(self):
+                self.updated = []
+                self.removed = []
+
+            def update(self, index, iterable):
+                self.updated += [obj.pk for obj in iterable]
+
+            def remove(self, obj_or_string):
+                self.removed.append(obj_or_string)
+
+        review_request = self.create_review_request(publish=True)
+        review_request_id = review_request.pk
+        review_request.delete()
+
+        self.assertEqual(
+            list(ReviewRequestIndexChange.objects.values_list(
+                'review_request_id', flat=True)),
+            [review_request_id] * 2)
+
+        backend = DummyBackend()
+        index = ReviewRequestIndex()
+        self.spy_on(index._get_backend, call_fake=lambda *args: backend)
+
+        self.assertEqual(index.update_changed(batch_size=10), 1)
+        self.assertEqual(backend.updated, [])
+        self.assertEqual(backend.removed,
+                         ['reviews.reviewrequest.%s' % review_request_id])
+        self.assertFalse(ReviewRequestIndexChange.objects.exists())
+
+    def test_index_full_removes_changes(self):
+        """Testing the index command with --full removing the recorded
+        changes
+        """
+        review_request = self.create_review_request(publish=True)
+
+        # Changes recorded while rebuilding should be left for the next
+        # update.
+        self.spy_on(
+            RebuildIndexCommand.handle,
+            call_fake=lambda *args, **kwargs:
+                ReviewRequestIndexChange.objects.record(review_request))
+
+        call_command('index', rebuild=True)
+
+        self.assertEqual(len(RebuildIndexCommand.handle.spy.calls), 1)
+        self.assertEqual(ReviewRequestIndexChange.objects.count(), 1)
+
+    def test_index_update_processes_changes(self):
+        """Testing the index command without --incremental or --full
+        processing the recorded changes
+        """
+        class DummyBackend(object):
+            batch_size = 10
+
+            def __init__(self):
+                self.removed = []
+
+            def remove(self, obj_or_string):
+                self.removed.append(obj_or_string)
+
+        review_request = self.create_review_request(publish=True)
+        review_request_id = review_request.pk
+        review_request.delete()
+
+        backend = DummyBackend()
+        index = connections['default'].get_unified_index().get_index(
+            ReviewRequest)
+        self.spy_on(index._get_backend, call_fake=lambda *args: backend)
+        self.spy_on(UpdateIndexCommand.handle,
+                    call_fake=lambda *args, **kwargs: None)
+
+        call_command('index')
+
+        self.assertEqual(len(UpdateIndexCommand.handle.spy.calls), 1)
+        self.assertEqual(backend.removed,
+                         ['reviews.reviewrequest.%s' % review_request_id])
+        self.assertFalse(ReviewRequestIndexChange.objects.exists())
+
+    def test_index_queryset_prefetches(self):
+        """Testing ReviewRequestIndex.index_queryset fetches indexed data
+        without a query per review request
+        """
+        for i in range(3):
+            review_request = self.create_review_request(
+                publish=True, create_repository=True)
+            diffset = self.create_diffset(review_request)
+            self.create_filediff(diffset)
+
+        index = ReviewRequestIndex()
+
+        with self.assertNumQueries(2):
+            docs = [
+                index.full_prepare(indexed_review_request)
+                for indexed_review_request in index.index_queryset()
+            ]
+
+        self.assertEqual(len(docs), 3)
+
+        for doc in docs:
+            self.assertEqual(doc['username'], 'doc')
+            self.assertIn('/test-file', doc['file'])
+
+
 class ViewTests(TestCase):
     """Tests for views in reviewboard.reviews.views"""
     fixtures = ['test_users', 'test_scmtools', 'test_site']
@@ -1134,6 +1343,30 @@ class DraftTests(TestCase):
         self.assertEqual(set(fields["bugs_closed"]["removed"]), old_bugs_norm)
         self.assertEqual(set(fields["bugs_closed"]["added"]), new_bugs_norm)
 
+    def test_publish_queues_chunk_jobs(self):
+        """Testing ReviewRequestDraft.publish queues jobs to generate the
+        new diff
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+        siteconfig.set('diffviewer_precompute_chunks', True)
+        siteconfig.save()
+
+        try:
+            review_request = self.create_review_request(
+                publish=True, create_repository=True)
+            draft = ReviewRequestDraft.create(review_request)
+            draft.diffset = self.create_diffset(review_request, draft=True)
+            filediff = self.create_filediff(draft.diffset)
+
+            draft.publish()
+        finally:
+            siteconfig.set('diffviewer_precompute_chunks', False)
+            siteconfig.save()
+
+        job = DiffChunkJob.objects.get()
+        self.assertEqual(job.filediff, filediff)
+        self.assertEqual(job.priority, DiffChunkJob.PRIORITY_PUBLISH)
+
     def getDraft(self):
         """Convenience function for getting a new draft to work with."""
         review_request = self.create_review_request(publish=True)
@@ -2610,3 +2843,130 @@ class MarkdownUtilsTests(TestCase):
         """Testing markdown_unescape"""
         self.assertEqual(markdown_unescape(self.ESCAPED_TEXT),
                          self.UNESCAPED_TEXT)
+
+
+class FillDatabaseTests(TestCase):
+    """Unit tests for the fill-database management command."""
+    fixtures = ['test_users', 'test_scmtools']
+
+    def setUp(self):
+        super(FillDatabaseTests, self).setUp()
+
+        # The repository and diffs are found relative to manage.py.
+        self.old_argv = sys.argv
+        sys.argv = [os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                 'manage.py')]
+
+        self.bulk_models = import_module(
+            'reviewboard.reviews.management.commands.fill-database'
+        ).BULK_MODELS
+
+    def tearDown(self):
+        super(FillDatabaseTests, self).tearDown()
+
+        sys.argv = self.old_argv
+
+    def test_bulk(self):
+        """Testing fill-database --bulk creates the planned objects"""
+        old_counts = self._get_counts()
+        output = self._fill(users=5, review_requests='2', diffs='1',
+                            reviews='2', diff_comments='3')
+        counts = dict(
+            (model, count - old_counts[model])
+            for model, count in six.iteritems(self._get_counts())
+        )
+
+        self.assertEqual(counts[User], 5)
+        self.assertEqual(counts[Profile], 5)
+        self.assertEqual(counts[ReviewRequest], 10)
+        self.assertEqual(counts[DiffSet], 10)
+        self.assertEqual(counts[Review], 20)
+        self.assertEqual(counts[Comment], 60)
+        self.assertEqual(counts[Review.comments.through], 60)
+
+        # The reported counts should match what was inserted.
+        m = re.search(r'Done. Created (.*)\.', output)
+        self.assertNotEqual(m, None)
+        self.assertEqual(
+            m.group(1),
+            ', '.join(
+                '%d %s' % (counts[model], model._meta.verbose_name_plural)
+                for model in self.bulk_models
+            ))
+
+    def test_bulk_with_seed(self):
+        """Testing fill-database --bulk generates the same data for the
+        same seed
+        """
+        expected = self._fill_and_rollback(seed=42)
+
+        self.assertNotEqual(expected, [])
+        self.assertEqual(self._fill_and_rollback(seed=42), expected)
+        self.assertNotEqual(self._fill_and_rollback(seed=43), expected)
+
+    def test_bulk_shares_diff_data(self):
+        """Testing fill-database --bulk shares diff data between
+        FileDiffs
+        """
+        self._fill(users=5, review_requests='2', diffs='2')
+
+        diff_hash_ids = list(
+            FileDiff.objects.values_list('diff_hash_id', flat=True))
+
+        self.assertNotIn(None, diff_hash_ids)
+        self.assertTrue(len(diff_hash_ids) > len(set(diff_hash_ids)))
+        self.assertEqual(
+            FileDiffData.objects.filter(pk__in=diff_hash_ids).count(),
+            len(set(diff_hash_ids)))
+
+    def _fill(self, seed=1, **options):
+        """Runs fill-database --bulk, returning its output."""
+        stdout = six.StringIO()
+        call_command('fill-database', bulk=True, seed=seed, batch_size=2,
+                     stdout=stdout, **options)
+
+        return stdout.getvalue()
+
+    def _fill_and_rollback(self, seed):
+        """Returns the rows generated for a seed, without keeping them.
+
+        Timestamps are left out, since they're set when the objects are
+        generated, and so are the salted password hashes.
+        """
+        class Rollback(Exception):
+            pass
+
+        rows = []
+
+        try:
+            with transaction.atomic():
+                self._fill(users=3, review_requests='1:3', diffs='1:3',
+                           reviews='0:3', diff_comments='0:3', seed=seed)
+
+                for model in self.bulk_models:
+                    excluded_fields = [
+                        field.name
+                        for field in model._meta.fields
+                        if (isinstance(field, models.DateTimeField) or
+                            (model is User and field.name == 'password'))
+                    ]
+
+                    for data in serializers.serialize(
+                            'python', model.objects.order_by('pk')):
+                        for field_name in excluded_fields:
+                            del data['fields'][field_name]
+
+                        rows.append(data)
+
+                raise Rollback
+        except Rollback:
+            pass
+
+        return rows
+
+    def _get_counts(self):
+        """Returns the number of objects of each model in bulk mode."""
+        return dict(
+            (model, model.objects.count())
+            for model in self.bulk_models
+        )
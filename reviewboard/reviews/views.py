@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import logging
+import sys
 import time
 
 from django.conf import settings
@@ -36,7 +37,7 @@ from reviewboard.accounts.models import ReviewRequestVisit, Profile
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.changedescs.models import ChangeDescription
 from reviewboard.diffviewer.diffutils import (convert_to_unicode,
-                                              get_file_chunks_in_range,
+                                              get_file_chunks_in_ranges,
                                               get_original_file,
                                               get_patched_file)
 from reviewboard.diffviewer.models import DiffSet
@@ -152,20 +153,55 @@ def build_diff_comment_fragments(
     comments, context,
     comment_template_name='reviews/diff_comment_fragment.html',
     error_template_name='diffviewer/diff_fragment_error.html'):
+    """Renders the diff fragments for a list of diff comments.
 
+    Comments on the same file share a single lookup of the file's chunks.
+    This returns a tuple of whether there were any errors, and the list of
+    rendered comment entries.
+    """
     comment_entries = []
     had_error = False
     siteconfig = SiteConfiguration.objects.get_current()
+    comments = list(comments)
+
+    # Group the comments by the file they're on, so that each file's chunks
+    # are only loaded once, no matter how many comments there are on it.
+    comments_by_file = {}
 
     for comment in comments:
+        comments_by_file.setdefault(
+            (comment.filediff_id, comment.interfilediff_id),
+            []).append(comment)
+
+    comment_chunks = {}
+    comment_errors = {}
+
+    for file_comments in six.itervalues(comments_by_file):
         try:
+            all_chunks = get_file_chunks_in_ranges(
+                context,
+                file_comments[0].filediff,
+                file_comments[0].interfilediff,
+                [
+                    (comment.first_line, comment.num_lines)
+                    for comment in file_comments
+                ])
+
+            for comment, chunks in zip(file_comments, all_chunks):
+                comment_chunks[comment.pk] = chunks
+        except Exception as e:
+            for comment in file_comments:
+                comment_errors[comment.pk] = (e, sys.exc_info()[2])
+
+    for comment in comments:
+        try:
+            if comment.pk in comment_errors:
+                e, tb = comment_errors[comment.pk]
+                six.reraise(type(e), e, tb)
+
             content = render_to_string(comment_template_name, {
                 'comment': comment,
-                'chunks': list(get_file_chunks_in_range(context,
-                                                        comment.filediff,
-                                                        comment.interfilediff,
-                                                        comment.first_line,
-                                                        comment.num_lines)),
+                'chunks': comment_chunks[comment.pk],
                 'domain': Site.objects.get_current().domain,
                 'domain_method': siteconfig.get("site_domain_method"),
             })
@@ -988,7 +1024,11 @@ def comment_diff_fragments(
     if not review_request:
         return response
 
-    comments = get_list_or_404(Comment, pk__in=comment_ids.split(","))
+    comments = get_list_or_404(
+        Comment.objects.select_related('filediff', 'filediff__diffset',
+                                       'interfilediff',
+                                       'interfilediff__diffset'),
+        pk__in=comment_ids.split(","))
     latest_timestamp = get_latest_timestamp([comment.timestamp
                                              for comment in comments])
 
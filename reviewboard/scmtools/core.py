@@ -10,14 +10,13 @@ from django.utils import six
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.six.moves.urllib.error import HTTPError
 from django.utils.six.moves.urllib.parse import urlparse
-from django.utils.six.moves.urllib.request import (Request as URLRequest,
-                                                   urlopen)
 from django.utils.translation import ugettext_lazy as _
 
 import reviewboard.diffviewer.parser as diffparser
 from reviewboard.scmtools.errors import (AuthenticationError,
                                          FileNotFoundError,
                                          SCMError)
+from reviewboard.scmtools.http import http_request
 from reviewboard.ssh import utils as sshutils
 from reviewboard.ssh.errors import SSHAuthenticationError
 
@@ -139,6 +138,29 @@ class SCMTool(object):
     def get_file(self, path, revision=None):
         raise NotImplementedError
 
+    def get_files(self, files):
+        """Returns the contents of several files.
+
+        ``files`` is a list of (path, revision) tuples. This returns a
+        dictionary mapping each of those tuples to the contents of the file.
+        Files that can't be fetched are left out, so that the errors can be
+        reported when fetching them through get_file.
+
+        By default, this fetches each file with get_file. Subclasses for
+        repositories that can fetch many files at once, or can pipeline
+        requests, should override this.
+        """
+        results = {}
+
+        for path, revision in files:
+            try:
+                results[(path, revision)] = self.get_file(path, revision)
+            except Exception as e:
+                logging.debug('Unable to fetch %s (revision %s) in a batch: '
+                              '%s', path, revision, e)
+
+        return results
+
     def file_exists(self, path, revision=HEAD):
         try:
             self.get_file(path, revision)
@@ -214,12 +236,15 @@ class SCMTool(object):
         return patch
 
     @classmethod
-    def popen(cls, command, local_site_name=None):
+    def popen(cls, command, local_site_name=None, stdin=None,
+              stderr=subprocess.PIPE):
         """Launches an application, capturing output.
 
         This wraps subprocess.Popen to provide some common parameters and
         to pass environment variables that may be needed by rbssh, if
-        indirectly invoked.
+        indirectly invoked. ``stdin`` can be set to subprocess.PIPE in
+        order to write to the application. ``stderr`` can be changed for
+        applications whose errors won't be read.
         """
         env = os.environ.copy()
 
@@ -230,7 +255,8 @@ class SCMTool(object):
 
         return subprocess.Popen(command,
                                 env=env,
-                                stderr=subprocess.PIPE,
+                                stdin=stdin,
+                                stderr=stderr,
                                 stdout=subprocess.PIPE,
                                 close_fds=(os.name != 'nt'))
 
@@ -313,14 +339,14 @@ class SCMClient(object):
         logging.info('Fetching file from %s' % url)
 
         try:
-            request = URLRequest(url)
+            headers = {}
 
             if self.username:
                 auth_string = base64.b64encode('%s:%s' % (self.username,
                                                           self.password))
-                request.add_header('Authorization', 'Basic %s' % auth_string)
+                headers['Authorization'] = 'Basic %s' % auth_string
 
-            return urlopen(request).read()
+            return http_request(url, headers=headers).data
         except HTTPError as e:
             if e.code == 404:
                 logging.error('404')
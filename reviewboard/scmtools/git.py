@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 
+import atexit
 import logging
 import os
 import re
+import subprocess
+import threading
+import time
 
 from django.utils import six
 from django.utils.six.moves.urllib.parse import quote as urlquote
@@ -90,6 +94,23 @@ class GitTool(SCMTool):
 
         return self.client.get_file(path, revision)
 
+    def get_files(self, files):
+        if self.client.raw_file_url:
+            return super(GitTool, self).get_files(files)
+
+        results = dict(
+            ((path, revision), "")
+            for path, revision in files
+            if revision == PRE_CREATION
+        )
+        results.update(self.client.get_files(
+            (path, revision)
+            for path, revision in files
+            if revision != PRE_CREATION
+        ))
+
+        return results
+
     def file_exists(self, path, revision=HEAD):
         if revision == PRE_CREATION:
             return False
@@ -345,6 +366,329 @@ class GitDiffParser(DiffParser):
                 setattr(file_info, attr, '')
 
 
+class GitCatFileProcess(object):
+    """A long-lived git cat-file process for looking up objects.
+
+    This runs ``git cat-file --batch`` (to fetch the contents of objects)
+    or ``git cat-file --batch-check`` (to fetch only their types) for a
+    repository. Object names are written to the process one at a time, and
+    the results are read back, saving the cost of starting a new process for
+    every lookup.
+
+    A process must only be used by one thread at a time. GitCatFilePool
+    takes care of this.
+
+    Nothing reads the process's errors while it's running, so they're
+    discarded, rather than left to fill up a pipe and block the process.
+    """
+    def __init__(self, git_dir, batch_option, local_site_name=None):
+        self.batch_option = batch_option
+        self.last_used = time.time()
+
+        with open(os.devnull, 'wb') as devnull:
+            self._process = SCMTool.popen(
+                ['git', '--git-dir=%s' % git_dir, 'cat-file', batch_option],
+                local_site_name=local_site_name,
+                stdin=subprocess.PIPE,
+                stderr=devnull)
+
+    def is_alive(self):
+        """Returns whether the process is still running."""
+        return self._process.poll() is None
+
+    def lookup(self, object_name):
+        """Looks up an object in the repository.
+
+        This returns a tuple of the object's type and, when using
+        ``--batch``, its contents. The type will be None if the object
+        doesn't exist.
+
+        IOError will be raised if the process can't be communicated with,
+        in which case it should be closed.
+        """
+        self.last_used = time.time()
+
+        if '\n' in object_name:
+            raise FileNotFoundError(object_name)
+
+        self._process.stdin.write(object_name.encode('utf-8') + b'\n')
+        self._process.stdin.flush()
+
+        return self._read_result(object_name)
+
+    def lookup_many(self, object_names):
+        """Looks up several objects in the repository.
+
+        This returns a dictionary mapping object names to results like
+        those returned by lookup. Objects that are ambiguous are treated as
+        missing, and invalid object names are left out.
+
+        All the object names are sent without waiting for the results of
+        the previous ones. They're written from a separate thread while the
+        results are read, so that neither side can block the other.
+        """
+        self.last_used = time.time()
+
+        object_names = [
+            object_name
+            for object_name in object_names
+            if '\n' not in object_name
+        ]
+
+        def _write_names():
+            try:
+                for object_name in object_names:
+                    self._process.stdin.write(object_name.encode('utf-8') +
+                                              b'\n')
+
+                self._process.stdin.flush()
+            except IOError:
+                # The process has exited. This will be noticed when reading
+                # the results.
+                pass
+
+        writer = threading.Thread(target=_write_names)
+        writer.daemon = True
+        writer.start()
+
+        results = {}
+
+        try:
+            for object_name in object_names:
+                try:
+                    results[object_name] = self._read_result(object_name)
+                except SCMError:
+                    results[object_name] = (None, None)
+        except Exception:
+            # The writer may be blocked waiting for the process to read, so
+            # the process has to be stopped before waiting for the writer.
+            self.close()
+            raise
+        finally:
+            writer.join()
+
+        return results
+
+    def _read_result(self, object_name):
+        """Reads the result of looking up an object."""
+        header = self._process.stdout.readline()
+
+        if not header.endswith(b'\n'):
+            raise IOError('git cat-file exited unexpectedly (exit code %s)'
+                          % self._process.poll())
+
+        # The header is "<sha1> <type> <size>" for objects that exist, and
+        # "<name> missing" (or "<name> ambiguous") for those that don't.
+        if header.endswith(b' missing\n'):
+            return None, None
+        elif header.endswith(b' ambiguous\n'):
+            raise SCMError('%s is ambiguous' % object_name)
+
+        sha1, object_type, size = header.split()
+        object_type = object_type.decode('utf-8')
+
+        if self.batch_option != '--batch':
+            return object_type, None
+
+        size = int(size)
+        contents = self._process.stdout.read(size + 1)
+
+        if len(contents) != size + 1:
+            raise IOError('git cat-file exited while reading %s'
+                          % object_name)
+
+        # Strip the trailing newline following the contents.
+        return object_type, contents[:-1]
+
+    def close(self):
+        """Shuts down the process."""
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+
+        if self.is_alive():
+            try:
+                self._process.terminate()
+            except OSError:
+                pass
+
+        self._process.wait()
+
+
+class GitCatFilePool(object):
+    """A pool of git cat-file processes for a repository.
+
+    Each lookup takes an idle process from the pool, or starts a new one
+    if there are no idle processes, up to ``max_processes``. Lookups made
+    while all processes are busy wait for one to be free.
+
+    Processes that have exited are replaced. Processes that have been idle
+    for longer than ``idle_timeout`` seconds are shut down the next time
+    any pool is fetched, so that pools for repositories that are no longer
+    being used don't keep their processes around.
+
+    Pools are shared by all GitClients in a process, and are created with
+    get_pool.
+    """
+    max_processes = 4
+    idle_timeout = 60
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, git_dir, batch_option, local_site_name=None):
+        """Returns the pool for a repository and git cat-file option.
+
+        Any processes in any of the pools that have been idle for too long
+        are shut down.
+        """
+        key = (git_dir, batch_option, local_site_name)
+
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+
+            # The processes in a pool can't be shared with a forked process,
+            # which needs a pool of its own.
+            if pool is None or pool.pid != os.getpid():
+                pool = cls(git_dir, batch_option, local_site_name)
+                cls._pools[key] = pool
+
+            pools = list(six.itervalues(cls._pools))
+
+        for other_pool in pools:
+            if other_pool.pid == os.getpid():
+                other_pool.close_expired()
+
+        return pool
+
+    @classmethod
+    def close_all(cls):
+        """Shuts down the processes in all pools."""
+        with cls._pools_lock:
+            for pool in six.itervalues(cls._pools):
+                if pool.pid == os.getpid():
+                    pool.close()
+
+            cls._pools = {}
+
+    def __init__(self, git_dir, batch_option, local_site_name=None):
+        self.git_dir = git_dir
+        self.batch_option = batch_option
+        self.local_site_name = local_site_name
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.Semaphore(self.max_processes)
+
+    def lookup(self, object_name):
+        """Looks up an object using a process in the pool.
+
+        See GitCatFileProcess.lookup for the result. If the process fails
+        while looking up the object, it's replaced, and the lookup is tried
+        once more.
+        """
+        return self._run(lambda process: process.lookup(object_name))
+
+    def lookup_many(self, object_names):
+        """Looks up several objects using a process in the pool.
+
+        This returns a dictionary mapping each object name to a result. See
+        GitCatFileProcess.lookup_many.
+        """
+        return self._run(lambda process: process.lookup_many(object_names))
+
+    def close(self):
+        """Shuts down all idle processes."""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for process in idle:
+            process.close()
+
+    def close_expired(self):
+        """Shuts down idle processes that have expired or exited."""
+        expire_time = time.time() - self.idle_timeout
+
+        with self._lock:
+            expired = []
+            still_idle = []
+
+            for process in self._idle:
+                if process.last_used < expire_time or not process.is_alive():
+                    expired.append(process)
+                else:
+                    still_idle.append(process)
+
+            self._idle = still_idle
+
+        for process in expired:
+            process.close()
+
+    def _run(self, func):
+        """Runs a function with a process from the pool.
+
+        If the process fails, it's replaced, and the function is tried once
+        more.
+        """
+        with self._semaphore:
+            for attempt in range(2):
+                process = self._get_process()
+
+                try:
+                    result = func(process)
+                except IOError as e:
+                    logging.warning('Restarting git cat-file for %s: %s',
+                                    self.git_dir, e)
+                    process.close()
+
+                    if attempt == 1:
+                        raise SCMError(six.text_type(e))
+
+                    continue
+                except Exception:
+                    # The process may be partway through a result, so it
+                    # can't be reused.
+                    process.close()
+                    raise
+
+                with self._lock:
+                    self._idle.append(process)
+
+                return result
+
+    def _get_process(self):
+        """Returns a running process, starting one if needed."""
+        expired = []
+        process = None
+        expire_time = time.time() - self.idle_timeout
+
+        with self._lock:
+            # Reuse the most recently used process, so that the others can
+            # go idle and be shut down when they're not needed.
+            while self._idle and process is None:
+                candidate = self._idle.pop()
+
+                if candidate.is_alive() and candidate.last_used >= expire_time:
+                    process = candidate
+                else:
+                    expired.append(candidate)
+
+        for candidate in expired:
+            candidate.close()
+
+        if process is None:
+            process = GitCatFileProcess(self.git_dir, self.batch_option,
+                                        self.local_site_name)
+
+        return process
+
+
+atexit.register(GitCatFilePool.close_all)
+
+
 class GitClient(SCMClient):
     FULL_SHA1_LENGTH = 40
 
@@ -406,7 +750,49 @@ class GitClient(SCMClient):
             return self.get_file_http(self._build_raw_url(path, revision),
                                       path, revision)
         else:
-            return self._cat_file(path, revision, "blob")
+            commit = self._resolve_head(revision, path)
+            object_type, contents = self._get_cat_file_pool('--batch').lookup(
+                commit)
+
+            if object_type is None:
+                raise FileNotFoundError(commit)
+            elif object_type != 'blob':
+                raise SCMError('%s is a %s, not a blob'
+                               % (commit, object_type))
+
+            return contents
+
+    def get_files(self, files):
+        """Returns the contents of several files in a local repository.
+
+        ``files`` is a list of (path, revision) tuples. The files are all
+        fetched through a single git cat-file process, without waiting for
+        each file before requesting the next.
+
+        This returns a dictionary mapping (path, revision) tuples to the
+        contents of the files. Files that don't exist or aren't blobs are
+        left out.
+        """
+        object_names = {}
+
+        for path, revision in files:
+            try:
+                object_names[(path, revision)] = \
+                    self._resolve_head(revision, path)
+            except SCMError:
+                pass
+
+        lookups = self._get_cat_file_pool('--batch').lookup_many(
+            list(six.itervalues(object_names)))
+        results = {}
+
+        for f, object_name in six.iteritems(object_names):
+            object_type, contents = lookups.get(object_name, (None, None))
+
+            if object_type == 'blob':
+                results[f] = contents
+
+        return results
 
     def get_file_exists(self, path, revision):
         if self.raw_file_url:
@@ -421,8 +807,14 @@ class GitClient(SCMClient):
             except Exception:
                 return False
         else:
-            contents = self._cat_file(path, revision, "-t")
-            return contents and contents.strip() == "blob"
+            commit = self._resolve_head(revision, path)
+            object_type = self._get_cat_file_pool('--batch-check').lookup(
+                commit)[0]
+
+            if object_type is None:
+                raise FileNotFoundError(commit)
+
+            return object_type == 'blob'
 
     def validate_sha1_format(self, path, sha1):
         """Validates that a SHA1 is of the right length for this repository."""
@@ -440,32 +832,15 @@ class GitClient(SCMClient):
         url = url.replace("<filename>", urlquote(path))
         return url
 
-    def _cat_file(self, path, revision, option):
-        """
-        Call git-cat-file(1) to get content or type information for a
-        repository object.
-
-        If called with just "commit", gets the content of a blob (or
-        raises an exception if the commit is not a blob).
+    def _get_cat_file_pool(self, batch_option):
+        """Returns the pool of git cat-file processes for the repository.
 
-        Otherwise, "option" can be used to pass a switch to git-cat-file,
-        e.g. to test or existence or get the type of "commit".
+        Rather than starting a git cat-file process for every lookup, files
+        and their types are looked up through long-lived processes shared
+        by all clients for the repository.
         """
-        commit = self._resolve_head(revision, path)
-
-        p = self._run_git(['--git-dir=%s' % self.git_dir, 'cat-file',
-                           option, commit])
-        contents = p.stdout.read()
-        errmsg = six.text_type(p.stderr.read())
-        failure = p.wait()
-
-        if failure:
-            if errmsg.startswith("fatal: Not a valid object name"):
-                raise FileNotFoundError(commit)
-            else:
-                raise SCMError(errmsg)
-
-        return contents
+        return GitCatFilePool.get_pool(self.git_dir, batch_option,
+                                       self.local_site_name)
 
     def _resolve_head(self, revision, path):
         if revision == HEAD:
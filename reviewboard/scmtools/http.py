@@ -0,0 +1,360 @@
+from __future__ import unicode_literals
+
+import atexit
+import logging
+import os
+import select
+import socket
+import threading
+import time
+import zlib
+from io import BytesIO
+
+from django.utils import six
+from django.utils.encoding import force_str
+from django.utils.six.moves import http_client
+from django.utils.six.moves.urllib.error import HTTPError, URLError
+from django.utils.six.moves.urllib.parse import urljoin, urlparse
+from django.utils.six.moves.urllib.request import (getproxies, proxy_bypass,
+                                                   Request as URLRequest,
+                                                   urlopen)
+
+
+class HTTPResponse(object):
+    """A response to an HTTP request made through http_request.
+
+    ``data`` is the body of the response, decompressed if the server sent
+    it compressed. ``headers`` is the message containing the response
+    headers, the same as the ``headers`` of a response from ``urlopen``.
+    """
+    def __init__(self, url, status, headers, data):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+    @property
+    def not_modified(self):
+        """Whether the server reported the resource as unchanged.
+
+        This is only the case for conditional requests, made with an
+        If-None-Match or If-Modified-Since header.
+        """
+        return self.status == 304
+
+
+class HTTPConnectionPool(object):
+    """A pool of keep-alive HTTP connections to a host.
+
+    Each request takes an idle connection from the pool, or opens a new one
+    if there are no idle connections, up to ``max_connections``. Requests
+    made while all connections are busy wait for one to be free.
+
+    Connections are kept open after a request, as long as the server allows
+    it, so later requests don't need a new connection or TLS handshake.
+    Connections that have been idle for longer than ``idle_timeout``
+    seconds are closed the next time the pool is used.
+
+    Pools are shared by everything making requests in a process, and are
+    created with get_pool.
+    """
+    max_connections = 4
+    idle_timeout = 30
+    timeout = socket._GLOBAL_DEFAULT_TIMEOUT
+
+    # Methods that can safely be sent again if it's not known whether the
+    # server received them.
+    IDEMPOTENT_METHODS = ('DELETE', 'GET', 'HEAD', 'OPTIONS', 'PUT', 'TRACE')
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, scheme, netloc):
+        """Returns the pool for a scheme and host."""
+        key = (scheme, netloc)
+
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+
+            # The connections in a pool can't be shared with a forked
+            # process, which needs a pool of its own.
+            if pool is None or pool.pid != os.getpid():
+                pool = cls(scheme, netloc)
+                cls._pools[key] = pool
+
+        return pool
+
+    @classmethod
+    def close_all(cls):
+        """Closes the connections in all pools."""
+        with cls._pools_lock:
+            for pool in six.itervalues(cls._pools):
+                if pool.pid == os.getpid():
+                    pool.close()
+
+            cls._pools = {}
+
+    def __init__(self, scheme, netloc):
+        if scheme == 'https':
+            self.connection_cls = http_client.HTTPSConnection
+        elif scheme == 'http':
+            self.connection_cls = http_client.HTTPConnection
+        else:
+            raise ValueError('Unsupported URL scheme "%s"' % scheme)
+
+        self.scheme = scheme
+        self.netloc = netloc
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._semaphore = threading.Semaphore(self.max_connections)
+
+    def request(self, method, path, body=None, headers={}):
+        """Makes a request using a connection in the pool.
+
+        This returns a tuple of the status code, the response headers and
+        the response body.
+
+        If a connection that was kept open from an earlier request turns
+        out to have been closed by the server, the request is tried again
+        on another connection. Requests using methods that aren't
+        idempotent, such as POST, are only tried again if they couldn't be
+        sent, since the server may otherwise have acted on them already.
+        """
+        retry_after_send = method.upper() in self.IDEMPOTENT_METHODS
+
+        with self._semaphore:
+            while True:
+                conn, reused = self._get_connection()
+                sent = False
+
+                try:
+                    conn.request(method, path, body, headers)
+                    sent = True
+                    response = conn.getresponse()
+                    data = response.read()
+                except (http_client.HTTPException, socket.error) as e:
+                    conn.close()
+
+                    if reused and (retry_after_send or not sent):
+                        logging.debug('Reopening HTTP connection to %s: %s',
+                                      self.netloc, e)
+                        continue
+
+                    raise
+                except Exception:
+                    conn.close()
+                    raise
+
+                if response.will_close:
+                    conn.close()
+                else:
+                    conn.last_used = time.time()
+
+                    with self._lock:
+                        self._idle.append(conn)
+
+                return response.status, response.msg, data
+
+    def close(self):
+        """Closes all idle connections."""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+
+        for conn in idle:
+            conn.close()
+
+    def _get_connection(self):
+        """Returns a connection, and whether it has been used before."""
+        expired = []
+        conn = None
+        expire_time = time.time() - self.idle_timeout
+
+        with self._lock:
+            # Reuse the most recently used connection, so that the others
+            # can expire if they're no longer needed.
+            while self._idle:
+                idle_conn = self._idle.pop()
+
+                if (idle_conn.last_used < expire_time or
+                    _is_connection_dropped(idle_conn)):
+                    expired.append(idle_conn)
+                else:
+                    conn = idle_conn
+                    break
+
+            # Anything older than the connection we're reusing expired too.
+            expired += [
+                old_conn
+                for old_conn in self._idle
+                if old_conn.last_used < expire_time
+            ]
+            self._idle = [
+                recent_conn
+                for recent_conn in self._idle
+                if recent_conn.last_used >= expire_time
+            ]
+
+        for idle_conn in expired:
+            idle_conn.close()
+
+        if conn is not None:
+            return conn, True
+
+        return self.connection_cls(self.netloc, timeout=self.timeout), False
+
+
+atexit.register(HTTPConnectionPool.close_all)
+
+
+def http_request(url, body=None, headers={}, method=None, max_redirects=5):
+    """Makes an HTTP request, reusing pooled keep-alive connections.
+
+    This can be used in place of ``urlopen``. Requests to the same host
+    share a pool of connections (see HTTPConnectionPool). Responses are
+    requested with gzip compression, and decompressed automatically.
+    Redirects are followed.
+
+    The method defaults to POST if there's a body, and GET otherwise.
+
+    Conditional requests can be made by passing an If-None-Match or
+    If-Modified-Since header. If the server responds with 304 Not Modified,
+    the response is returned, with ``not_modified`` set, instead of being
+    raised as an error.
+
+    Like ``urlopen``, this raises HTTPError if the server responds with an
+    error, and URLError if the server can't be reached. Requests for URLs
+    that aren't HTTP or HTTPS (such as ``file://`` URLs), and requests to
+    hosts that need to go through a proxy, are made with ``urlopen``.
+
+    This returns an HTTPResponse.
+    """
+    if method is None:
+        if body is None:
+            method = 'GET'
+        else:
+            method = 'POST'
+
+    # httplib can't mix Unicode and byte strings in a request on Python 2.
+    headers = dict(
+        (force_str(key), force_str(value))
+        for key, value in six.iteritems(headers)
+    )
+    conditional = _is_conditional(headers)
+
+    if not any(key.lower() == 'accept-encoding' for key in headers):
+        headers[str('Accept-Encoding')] = str('gzip')
+
+    for i in range(max_redirects + 1):
+        parsed = urlparse(url)
+
+        if parsed.scheme not in ('http', 'https') or _uses_proxy(parsed):
+            return _urlopen_request(url, body, headers, method)
+
+        path = parsed.path or '/'
+
+        if parsed.query:
+            path += '?' + parsed.query
+
+        # Any credentials in the URL aren't part of the host to connect to.
+        netloc = parsed.netloc.rsplit('@', 1)[-1]
+
+        try:
+            pool = HTTPConnectionPool.get_pool(parsed.scheme, netloc)
+            status, response_headers, data = pool.request(
+                force_str(method), force_str(path), body, headers)
+        except (http_client.HTTPException, socket.error, ValueError) as e:
+            raise URLError(e)
+
+        if (response_headers.get('Content-Encoding', '').lower() == 'gzip'
+            and method != 'HEAD'):
+            try:
+                data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+            except zlib.error as e:
+                raise URLError('Unable to decompress the response from %s: '
+                               '%s' % (url, e))
+
+            del response_headers['Content-Encoding']
+
+        if status in (301, 302, 303, 307) and 'Location' in response_headers:
+            url = urljoin(url, response_headers['Location'])
+
+            # Like urlopen, redirects of anything but GET and HEAD requests
+            # are followed with a GET.
+            if method not in ('GET', 'HEAD'):
+                method = 'GET'
+                body = None
+
+                for key in list(six.iterkeys(headers)):
+                    if key.lower() in ('content-type', 'content-length'):
+                        del headers[key]
+
+            continue
+
+        if status >= 400 or (status == 304 and not conditional):
+            raise HTTPError(url, status, http_client.responses.get(status, ''),
+                            response_headers, BytesIO(data))
+
+        return HTTPResponse(url, status, response_headers, data)
+
+    raise HTTPError(url, status, 'Too many redirects', response_headers,
+                    BytesIO(data))
+
+
+def _is_connection_dropped(conn):
+    """Returns whether the server has closed an idle connection.
+
+    An idle connection has nothing left to read, so if its socket is
+    readable, the server has closed it (or sent something unexpected, in
+    which case it can't be used either).
+    """
+    if conn.sock is None:
+        return True
+
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+def _is_conditional(headers):
+    """Returns whether request headers make a conditional request."""
+    return any(
+        key.lower() in ('if-none-match', 'if-modified-since')
+        for key in headers
+    )
+
+
+def _uses_proxy(parsed):
+    """Returns whether requests to a URL need to go through a proxy."""
+    return (parsed.scheme in getproxies() and
+            not proxy_bypass(parsed.hostname or ''))
+
+
+def _urlopen_request(url, body, headers, method):
+    """Makes an HTTP request with urlopen.
+
+    This is used for requests that the connection pools don't support,
+    which are those for other URL schemes and those that need to go
+    through a proxy.
+    """
+    request = URLRequest(url, body, headers)
+    request.get_method = lambda: method
+
+    try:
+        u = urlopen(request)
+    except HTTPError as e:
+        if e.code == 304 and _is_conditional(headers):
+            return HTTPResponse(url, e.code, e.hdrs, b'')
+
+        raise
+
+    data = u.read()
+
+    if u.headers.get('Content-Encoding', '').lower() == 'gzip':
+        data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        del u.headers['Content-Encoding']
+
+    return HTTPResponse(u.geturl(), u.getcode(), u.headers, data)
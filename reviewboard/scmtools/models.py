@@ -20,6 +20,10 @@ from reviewboard.scmtools.signals import (checked_file_exists,
 from reviewboard.site.models import LocalSite
 
 
+class _CachedFileMissing(Exception):
+    pass
+
+
 @python_2_unicode_compatible
 class Tool(models.Model):
     name = models.CharField(max_length=32, unique=True)
@@ -218,6 +222,48 @@ class Repository(models.Model):
                                              request)],
             large_data=True)[0]
 
+    def get_files(self, files, request=None):
+        """Returns several files from the repository.
+
+        ``files`` is a list of (path, revision, base_commit_id) tuples. This
+        returns a dictionary mapping each of those tuples to the contents of
+        the file.
+
+        Each file is looked up in the cache first. Any files that aren't
+        cached are then fetched together, through the hosting service or
+        SCMTool's get_files (which may be able to fetch them more
+        efficiently than one at a time), and cached the same way as files
+        fetched with get_file.
+
+        Files that can't be fetched are left out. Calling get_file for
+        those will raise the error.
+        """
+        keys = dict(
+            (f, self._make_file_cache_key(*f))
+            for f in files
+        )
+        results = {}
+        missing = []
+
+        for f, key in six.iteritems(keys):
+            data = self._get_cached_file(key)
+
+            if data is None:
+                missing.append(f)
+            else:
+                results[f] = data
+
+        if missing:
+            for f, data in six.iteritems(
+                    self._get_files_uncached(missing, request)):
+                # As in get_file, this is wrapped in a list so that the cache
+                # backend doesn't convert it to unicode.
+                cache_memoize(keys[f], lambda: [data], large_data=True,
+                              force_overwrite=True)
+                results[f] = data
+
+        return results
+
     def get_file_exists(self, path, revision, base_commit_id=None,
                         request=None):
         """Returns whether or not a file exists in the repository.
@@ -379,6 +425,65 @@ class Repository(models.Model):
 
         return data
 
+    def _get_cached_file(self, key):
+        """Returns a file stored in the cache by get_file.
+
+        This returns None if the file isn't in the cache.
+        """
+        def _missing():
+            raise _CachedFileMissing
+
+        try:
+            return cache_memoize(key, _missing, large_data=True)[0]
+        except _CachedFileMissing:
+            return None
+
+    def _get_files_uncached(self, files, request):
+        """Internal function for fetching several uncached files.
+
+        This is called by get_files for the files that aren't already in
+        the cache.
+        """
+        for path, revision, base_commit_id in files:
+            fetching_file.send(sender=self,
+                               path=path,
+                               revision=revision,
+                               base_commit_id=base_commit_id,
+                               request=request)
+
+        log_timer = log_timed("Fetching %d files from %s" % (len(files), self),
+                              request=request)
+
+        hosting_service = self.hosting_service
+
+        if hosting_service:
+            results = hosting_service.get_files(self, files)
+        else:
+            # SCMTools don't use base commit IDs, so the files are fetched by
+            # path and revision.
+            tool_results = self.get_scmtool().get_files(list(set(
+                (path, revision)
+                for path, revision, base_commit_id in files
+            )))
+
+            results = dict(
+                (f, tool_results[f[:2]])
+                for f in files
+                if f[:2] in tool_results
+            )
+
+        log_timer.done()
+
+        for (path, revision, base_commit_id), data in six.iteritems(results):
+            fetched_file.send(sender=self,
+                              path=path,
+                              revision=revision,
+                              base_commit_id=base_commit_id,
+                              request=request,
+                              data=data)
+
+        return results
+
     def _get_file_exists_uncached(self, path, revision, base_commit_id,
                                   request):
         """Internal function for checking that a file exists.
@@ -2,6 +2,9 @@
 from __future__ import unicode_literals
 
 import os
+import shutil
+import socket
+import threading
 from errno import ECONNREFUSED
 from hashlib import md5
 from socket import error as SocketError
@@ -11,7 +14,8 @@ from django import forms
 from django.contrib.auth.models import AnonymousUser, User
 from django.core.cache import cache
 from django.utils import six
-from django.utils.six.moves import zip_longest
+from django.utils.six.moves import http_client, zip_longest
+from django.utils.six.moves.urllib.error import HTTPError, URLError
 from djblets.util.filesystem import is_exe_in_path
 import nose
 
@@ -24,12 +28,13 @@ from reviewboard.hostingsvcs.service import (HostingService,
                                              unregister_hosting_service)
 from reviewboard.reviews.models import Group
 from reviewboard.scmtools.core import (Branch, ChangeSet, Commit, Revision,
-                                       HEAD, PRE_CREATION)
+                                       SCMClient, HEAD, PRE_CREATION)
 from reviewboard.scmtools.errors import (SCMError, FileNotFoundError,
                                          RepositoryNotFoundError,
                                          AuthenticationError)
 from reviewboard.scmtools.forms import RepositoryForm
-from reviewboard.scmtools.git import ShortSHA1Error
+from reviewboard.scmtools.git import GitCatFilePool, ShortSHA1Error
+from reviewboard.scmtools.http import HTTPConnectionPool, http_request
 from reviewboard.scmtools.models import Repository, Tool
 from reviewboard.scmtools.perforce import STunnelProxy, STUNNEL_SERVER
 from reviewboard.scmtools.signals import (checked_file_exists,
@@ -39,6 +44,7 @@ from reviewboard.site.models import LocalSite
 from reviewboard.ssh.client import SSHClient
 from reviewboard.ssh.tests import SSHTestCase
 from reviewboard.testing import online_only
+from reviewboard.testing.httpserver import LocalHTTPServer
 from reviewboard.testing.testcase import TestCase
 
 
@@ -153,6 +159,234 @@ class CoreTests(TestCase):
         self.assertTrue(len(cs.files) == 0)
 
 
+class HTTPTests(TestCase):
+    """Tests for the scmtools.http module"""
+
+    def setUp(self):
+        super(HTTPTests, self).setUp()
+
+        self.old_max_connections = HTTPConnectionPool.max_connections
+
+        self.server = LocalHTTPServer()
+        self.server.start()
+
+    def tearDown(self):
+        super(HTTPTests, self).tearDown()
+
+        HTTPConnectionPool.close_all()
+        HTTPConnectionPool.max_connections = self.old_max_connections
+
+        self.server.stop()
+
+    def test_http_request(self):
+        """Testing http_request"""
+        self.server.add_response('/file', b'Hello\n',
+                                 headers={'X-Test': 'yes'})
+
+        response = http_request(self.server.url + '/file')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.data, b'Hello\n')
+        self.assertEqual(response.headers['X-Test'], 'yes')
+        self.assertFalse(response.not_modified)
+        self.assertEqual(self.server.requests[0]['method'], 'GET')
+
+    def test_http_request_post(self):
+        """Testing http_request with a body"""
+        self.server.add_response('/api', b'{}')
+
+        http_request(self.server.url + '/api', b'a=1',
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+
+        request = self.server.requests[0]
+        self.assertEqual(request['method'], 'POST')
+        self.assertEqual(request['body'], b'a=1')
+
+    def test_http_request_keep_alive(self):
+        """Testing http_request reuses connections"""
+        self.server.add_response('/file', b'Hello\n')
+
+        for i in range(3):
+            self.assertEqual(http_request(self.server.url + '/file').data,
+                             b'Hello\n')
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.num_connections, 1)
+
+    def test_http_request_connection_closed(self):
+        """Testing http_request with connections closed by the server"""
+        self.server.add_response('/file', b'Hello\n', close=True)
+
+        for i in range(2):
+            self.assertEqual(http_request(self.server.url + '/file').data,
+                             b'Hello\n')
+
+        self.assertEqual(self.server.num_connections, 2)
+
+    def test_http_request_connection_dropped(self):
+        """Testing http_request with idle connections dropped by the server"""
+        self.server.add_response('/api', b'{}')
+
+        http_request(self.server.url + '/api')
+        self._get_idle_connection().sock.shutdown(socket.SHUT_RDWR)
+
+        http_request(self.server.url + '/api', b'a=1')
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.num_connections, 2)
+
+    def test_http_request_retry_idempotent(self):
+        """Testing http_request retries GET requests on failed connections"""
+        self.server.add_response('/file', b'Hello\n')
+
+        http_request(self.server.url + '/file')
+        self._break_idle_connection()
+
+        self.assertEqual(http_request(self.server.url + '/file').data,
+                         b'Hello\n')
+        self.assertTrue(self.server.wait_for_requests(3))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.num_connections, 2)
+
+    def test_http_request_no_retry_post(self):
+        """Testing http_request doesn't resend POST requests on failed
+        connections
+        """
+        self.server.add_response('/api', b'{}')
+
+        http_request(self.server.url + '/api')
+        self._break_idle_connection()
+
+        with self.assertRaises(URLError):
+            http_request(self.server.url + '/api', b'a=1')
+
+        # The server may still be handling the failed request.
+        self.assertTrue(self.server.wait_for_requests(2))
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1]['method'], 'POST')
+
+    def test_http_request_max_connections(self):
+        """Testing http_request limits the connections to a host"""
+        HTTPConnectionPool.max_connections = 2
+        self.server.add_response('/file', b'Hello\n', delay=0.1)
+
+        results = []
+
+        def _fetch():
+            results.append(http_request(self.server.url + '/file').data)
+
+        threads = [threading.Thread(target=_fetch) for i in range(5)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [b'Hello\n'] * 5)
+        self.assertEqual(self.server.num_connections, 2)
+
+    def test_http_request_gzip(self):
+        """Testing http_request with gzip-compressed responses"""
+        self.server.add_response('/file', b'Hello\n' * 100, gzip_body=True)
+
+        response = http_request(self.server.url + '/file')
+        self.assertEqual(response.data, b'Hello\n' * 100)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(
+            self.server.requests[0]['headers']['accept-encoding'], 'gzip')
+
+    def test_http_request_if_none_match(self):
+        """Testing http_request with If-None-Match"""
+        self.server.add_response('/file', b'Hello\n', etag='"abc123"')
+
+        response = http_request(self.server.url + '/file')
+        self.assertEqual(response.headers['ETag'], '"abc123"')
+
+        response = http_request(self.server.url + '/file',
+                                headers={'If-None-Match': '"abc123"'})
+        self.assertTrue(response.not_modified)
+        self.assertEqual(response.data, b'')
+
+        response = http_request(self.server.url + '/file',
+                                headers={'If-None-Match': '"def456"'})
+        self.assertFalse(response.not_modified)
+        self.assertEqual(response.data, b'Hello\n')
+
+    def test_http_request_file_url(self):
+        """Testing http_request with file:// URLs"""
+        filename = os.path.join(mkdtemp(), 'file.txt')
+
+        try:
+            with open(filename, 'wb') as fp:
+                fp.write(b'Hello\n')
+
+            response = http_request('file://' + filename)
+            self.assertEqual(response.data, b'Hello\n')
+        finally:
+            shutil.rmtree(os.path.dirname(filename))
+
+    def test_http_request_redirect(self):
+        """Testing http_request follows redirects"""
+        self.server.add_response('/old', status=302,
+                                 headers={'Location': '/new'})
+        self.server.add_response('/new', b'Hello\n')
+
+        response = http_request(self.server.url + '/old')
+        self.assertEqual(response.url, self.server.url + '/new')
+        self.assertEqual(response.data, b'Hello\n')
+
+    def test_http_request_http_error(self):
+        """Testing http_request with HTTP errors"""
+        self.server.add_response('/error', b'Oops', status=500)
+
+        with self.assertRaises(HTTPError) as cm:
+            http_request(self.server.url + '/error')
+
+        self.assertEqual(cm.exception.code, 500)
+        self.assertEqual(cm.exception.read(), b'Oops')
+
+        # The connection is still usable after an error.
+        with self.assertRaises(HTTPError):
+            http_request(self.server.url + '/missing')
+
+        self.assertEqual(self.server.num_connections, 1)
+
+    def test_get_file_http(self):
+        """Testing SCMClient.get_file_http"""
+        self.server.add_response('/raw/readme', b'Hello\n')
+
+        client = SCMClient(self.server.url, username='user',
+                           password='pass')
+        self.assertEqual(
+            client.get_file_http(self.server.url + '/raw/readme',
+                                 'readme', 'abc123'),
+            b'Hello\n')
+        self.assertEqual(
+            self.server.requests[0]['headers']['authorization'],
+            'Basic dXNlcjpwYXNz')
+
+        self.assertRaises(
+            FileNotFoundError,
+            lambda: client.get_file_http(self.server.url + '/raw/missing',
+                                         'missing', 'abc123'))
+
+        self.assertEqual(self.server.num_connections, 1)
+
+    def _get_idle_connection(self):
+        pool = HTTPConnectionPool.get_pool(
+            'http', self.server.url.split('://', 1)[1])
+        self.assertEqual(len(pool._idle), 1)
+
+        return pool._idle[0]
+
+    def _break_idle_connection(self):
+        """Makes the idle connection fail after the next request is sent."""
+        def _getresponse(*args, **kwargs):
+            raise http_client.BadStatusLine('')
+
+        self._get_idle_connection().getresponse = _getresponse
+
+
 class RepositoryTests(TestCase):
     fixtures = ['test_scmtools']
 
@@ -167,6 +401,7 @@ class RepositoryTests(TestCase):
 
         self.scmtool_cls = self.repository.get_scmtool().__class__
         self.old_get_file = self.scmtool_cls.get_file
+        self.old_get_files = self.scmtool_cls.get_files
         self.old_file_exists = self.scmtool_cls.file_exists
 
     def tearDown(self):
@@ -175,6 +410,7 @@ class RepositoryTests(TestCase):
         cache.clear()
 
         self.scmtool_cls.get_file = self.old_get_file
+        self.scmtool_cls.get_files = self.old_get_files
         self.scmtool_cls.file_exists = self.old_file_exists
 
     def test_get_file_caching(self):
@@ -225,6 +461,50 @@ class RepositoryTests(TestCase):
         self.assertEqual(found_signals[1],
                          ('fetched_file', path, revision, request))
 
+    def test_get_files(self):
+        """Testing Repository.get_files"""
+        self.assertEqual(
+            self.repository.get_files([
+                ('readme', 'e965047', None),
+                ('readme', 'd6613f5', None),
+                ('readme', '0000000', None),
+            ]),
+            {
+                ('readme', 'e965047', None): b'Hello\n',
+                ('readme', 'd6613f5', None): b'Hello there\n',
+            })
+
+    def test_get_files_caching(self):
+        """Testing Repository.get_files only fetches uncached files, and
+        caches them
+        """
+        def get_files(self, files):
+            fetched_files.append(sorted(files))
+            return dict((f, b'data for %s' % f[1]) for f in files)
+
+        fetched_files = []
+        self.scmtool_cls.get_files = get_files
+
+        self.repository.get_file('readme', 'e965047')
+
+        files = [
+            ('readme', 'e965047', None),
+            ('readme', 'd6613f5', None),
+        ]
+        expected = {
+            ('readme', 'e965047', None): b'Hello\n',
+            ('readme', 'd6613f5', None): b'data for d6613f5',
+        }
+
+        self.assertEqual(self.repository.get_files(files), expected)
+        self.assertEqual(fetched_files, [[('readme', 'd6613f5')]])
+
+        # Everything is cached now.
+        self.assertEqual(self.repository.get_files(files), expected)
+        self.assertEqual(len(fetched_files), 1)
+        self.assertEqual(self.repository.get_file('readme', 'd6613f5'),
+                         b'data for d6613f5')
+
     def test_get_file_exists_caching_when_exists(self):
         """Testing Repository.get_file_exists caches result when exists"""
         def file_exists(self, path, revision):
@@ -1998,6 +2278,95 @@ class GitTests(SCMTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file("readme", "0000000"))
 
+        # This is a commit, not a file.
+        self.assertRaises(SCMError,
+                          lambda: self.tool.get_file("readme", "a62df6c"))
+
+    def test_get_files(self):
+        """Testing GitTool.get_files"""
+        self.assertEqual(
+            self.tool.get_files([
+                ('readme', PRE_CREATION),
+                ('readme', 'e965047'),
+                ('readme', 'd6613f5'),
+                ('readme', HEAD),
+                ('readme', '0000000'),
+                ('readme', 'a62df6c'),
+                ('', HEAD),
+            ]),
+            {
+                ('readme', PRE_CREATION): b'',
+                ('readme', 'e965047'): b'Hello\n',
+                ('readme', 'd6613f5'): b'Hello there\n',
+                ('readme', HEAD): b'Hello there\n',
+            })
+
+    def test_get_file_reuses_process(self):
+        """Testing GitTool.get_file reuses git cat-file processes"""
+        GitCatFilePool.close_all()
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), b'Hello\n')
+
+        pool = GitCatFilePool.get_pool(self.tool.client.git_dir, '--batch')
+        self.assertEqual(len(pool._idle), 1)
+        process = pool._idle[0]
+
+        self.assertEqual(self.tool.get_file("readme", "d6613f5"),
+                         b'Hello there\n')
+        self.assertEqual(pool._idle, [process])
+
+        GitCatFilePool.close_all()
+
+    def test_get_file_replaces_exited_process(self):
+        """Testing GitTool.get_file replaces git cat-file processes that
+        have exited or been idle too long
+        """
+        GitCatFilePool.close_all()
+
+        self.tool.get_file("readme", "e965047")
+
+        pool = GitCatFilePool.get_pool(self.tool.client.git_dir, '--batch')
+        process = pool._idle[0]
+        process._process.kill()
+        process._process.wait()
+
+        self.assertEqual(self.tool.get_file("readme", "d6613f5"),
+                         b'Hello there\n')
+        self.assertEqual(len(pool._idle), 1)
+        self.assertNotEqual(pool._idle[0], process)
+
+        process = pool._idle[0]
+        process.last_used -= pool.idle_timeout + 1
+
+        self.assertEqual(self.tool.get_file("readme", "d6613f5"),
+                         b'Hello there\n')
+        self.assertEqual(len(pool._idle), 1)
+        self.assertNotEqual(pool._idle[0], process)
+        self.assertFalse(process.is_alive())
+
+        GitCatFilePool.close_all()
+
+    def test_get_pool_closes_expired_processes(self):
+        """Testing GitCatFilePool.get_pool shuts down processes that have
+        been idle too long in other pools
+        """
+        GitCatFilePool.close_all()
+
+        self.tool.get_file("readme", "e965047")
+
+        pool = GitCatFilePool.get_pool(self.tool.client.git_dir, '--batch')
+        process = pool._idle[0]
+        process.last_used -= pool.idle_timeout + 1
+
+        try:
+            GitCatFilePool.get_pool(self.tool.client.git_dir,
+                                    '--batch-check')
+
+            self.assertEqual(pool._idle, [])
+            self.assertFalse(process.is_alive())
+        finally:
+            GitCatFilePool.close_all()
+
     def test_parse_diff_revision_with_remote_and_short_SHA1_error(self):
         """Testing GitTool.parse_diff_revision with remote files and short SHA1 error"""
         self.assertRaises(
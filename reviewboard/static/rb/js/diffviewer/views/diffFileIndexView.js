@@ -118,7 +118,7 @@ RB.DiffFileIndexView = Backbone.View.extend({
         var $table = diffReviewableView.$el,
             fileDeleted = $item.hasClass('deleted-file'),
             fileAdded = $item.hasClass('new-file'),
-            linesEqual = $table.data('lines-equal'),
+            linesEqual = $table.children('tfoot').data('lines-equal'),
             numDeletes = 0,
             numInserts = 0,
             numReplaces = 0,
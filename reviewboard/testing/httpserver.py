@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+
+import gzip
+import threading
+import time
+from io import BytesIO
+
+from django.utils import six
+from django.utils.six.moves import BaseHTTPServer, socketserver
+
+
+class LocalHTTPServer(object):
+    """A local HTTP server standing in for a remote service in tests.
+
+    The server runs in a background thread on a free port on localhost.
+    Responses are registered for paths with add_response. Each request
+    made to the server is recorded in ``requests`` as a dictionary of the
+    method, path, headers and body, and ``num_connections`` counts the
+    connections made to the server.
+
+    Requests are recorded by the server's thread. A client may see a
+    request fail before the server has handled it, so tests checking
+    ``requests`` after a failed request should call wait_for_requests
+    first.
+
+    Connections are kept alive between requests, the way most services
+    do it, unless a response is registered with ``close=True``.
+
+    This can be used as a context manager, which starts the server and
+    shuts it down afterward.
+    """
+    def __init__(self):
+        self.requests = []
+        self.num_connections = 0
+        self._responses = {}
+        self._lock = threading.Lock()
+        self._requests_changed = threading.Condition(self._lock)
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """The URL to the root of the server."""
+        return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def start(self):
+        """Starts the server."""
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0),
+                                            _RequestHandler)
+        self._server.test_server = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Shuts down the server."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def add_response(self, path, body=b'', status=200, headers={},
+                     etag=None, gzip_body=False, close=False, delay=0):
+        """Registers the response for a path.
+
+        If ``etag`` is set, the response has that ETag, and requests with
+        a matching If-None-Match header get a 304 Not Modified response.
+        If ``gzip_body`` is set, the body is compressed for clients that
+        accept gzip. If ``close`` is set, the connection is closed after
+        the response. ``delay`` is a number of seconds to wait before
+        responding.
+
+        ``body`` can also be a function taking the request handler, which
+        returns the body.
+        """
+        self._responses[path] = {
+            'body': body,
+            'status': status,
+            'headers': headers,
+            'etag': etag,
+            'gzip_body': gzip_body,
+            'close': close,
+            'delay': delay,
+        }
+
+    def wait_for_requests(self, num_requests, timeout=5):
+        """Waits until the server has recorded a number of requests.
+
+        This returns whether that many requests were recorded before the
+        timeout.
+        """
+        deadline = time.time() + timeout
+
+        with self._requests_changed:
+            while len(self.requests) < num_requests:
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    return False
+
+                self._requests_changed.wait(remaining)
+
+        return True
+
+    def __enter__(self):
+        self.start()
+
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = str('HTTP/1.1')
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+        test_server = self.server.test_server
+
+        with test_server._lock:
+            test_server.num_connections += 1
+
+    def do_GET(self):
+        self._respond()
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_POST(self):
+        self._respond()
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, send_body=True):
+        test_server = self.server.test_server
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length)
+
+        with test_server._requests_changed:
+            test_server.requests.append({
+                'method': self.command,
+                'path': self.path,
+                'headers': dict(self.headers.items()),
+                'body': body,
+            })
+            test_server._requests_changed.notify_all()
+
+        response = test_server._responses.get(self.path)
+
+        if response is None:
+            response = {
+                'body': b'Not Found',
+                'status': 404,
+                'headers': {},
+                'etag': None,
+                'gzip_body': False,
+                'close': False,
+                'delay': 0,
+            }
+
+        if response['delay']:
+            time.sleep(response['delay'])
+
+        status = response['status']
+        headers = dict(response['headers'])
+        data = response['body']
+
+        if callable(data):
+            data = data(self)
+
+        if response['etag']:
+            headers['ETag'] = response['etag']
+
+            if self.headers.get('If-None-Match') == response['etag']:
+                status = 304
+                data = b''
+
+        if (data and response['gzip_body'] and
+            'gzip' in self.headers.get('Accept-Encoding', '')):
+            out = BytesIO()
+
+            with gzip.GzipFile(fileobj=out, mode='wb') as fp:
+                fp.write(data)
+
+            data = out.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+
+        if response['close']:
+            headers['Connection'] = 'close'
+            self.close_connection = 1
+
+        self.send_response(status)
+
+        for key, value in six.iteritems(headers):
+            self.send_header(str(key), str(value))
+
+        self.send_header(str('Content-Length'), str(len(data)))
+        self.end_headers()
+
+        if send_body:
+            self.wfile.write(data)
@@ -16,7 +16,7 @@ from djblets.webapi.errors import (DOES_NOT_EXIST, NOT_LOGGED_IN,
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.diffviewer.diffutils import (get_diff_files,
                                               populate_diff_chunks)
-from reviewboard.diffviewer.models import FileDiff
+from reviewboard.diffviewer.models import DiffChunkJob, FileDiff
 from reviewboard.webapi.base import CUSTOM_MIMETYPE_BASE, WebAPIResource
 from reviewboard.webapi.decorators import (webapi_check_login_required,
                                            webapi_check_local_site)
@@ -77,6 +77,13 @@ class FileDiffResource(WebAPIResource):
                            "patched file for this file diff, if representing "
                            "a binary file.",
         },
+        'chunks_status': {
+            'type': ('pending', 'running', 'done', 'failed'),
+            'description': 'The status of the job generating the diff for '
+                           'this file ahead of time, if one was queued. '
+                           'This will be null if it was not queued.',
+            'added_in': '2.0',
+        },
     }
     item_child_resources = [
         resources.filediff_comment,
@@ -111,6 +118,12 @@ class FileDiffResource(WebAPIResource):
         except FileAttachment.DoesNotExist:
             return None
 
+    def serialize_chunks_status_field(self, filediff, **kwargs):
+        try:
+            return filediff.chunk_job.status_name
+        except DiffChunkJob.DoesNotExist:
+            return None
+
     def get_last_modified(self, request, obj, *args, **kwargs):
         return obj.diffset.timestamp
 
@@ -128,7 +141,7 @@ class FileDiffResource(WebAPIResource):
 
         return self.model.objects.filter(
             diffset__history__review_request=review_request_id,
-            diffset__revision=diff_revision)
+            diffset__revision=diff_revision).select_related('chunk_job')
 
     def has_access_permissions(self, request, filediff, *args, **kwargs):
         review_request = resources.review_request.get_object(
@@ -401,7 +414,8 @@ class FileDiffResource(WebAPIResource):
         highlighting = request.GET.get('syntax-highlighting', False)
 
         files = get_diff_files(filediff.diffset, filediff, request=request)
-        populate_diff_chunks(files, highlighting, request=request)
+        populate_diff_chunks(files, highlighting, request=request,
+                             highlight_collapsed=True)
 
         if not files:
             # This may not be the right error here.
@@ -410,6 +424,9 @@ class FileDiffResource(WebAPIResource):
         assert len(files) == 1
         f = files[0]
 
+        if f.get('error'):
+            raise f['error']
+
         payload = {
             'diff_data': {
                 'binary': f['binary'],